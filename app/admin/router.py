@@ -1,4 +1,5 @@
 import imp
+from typing import List
 
 from fastapi import APIRouter, Depends, Request
 from fastapi.exceptions import HTTPException
@@ -7,6 +8,7 @@ from starlette.status import HTTP_302_FOUND
 
 from app.admin.models import AdminUserView
 from app.auth.utils import admin_authentication
+from app.db.cache import CacheStats, caches
 from app.db.models import User
 from app.db.session import SessionLocal
 from app.frontend.templates import template_response
@@ -22,3 +24,9 @@ async def get_admin_home(request: Request):
         users = db.query(User).order_by(User.created_on.desc()).all()
         users = [AdminUserView.load_from_db(u) for u in users]
     return template_response("./admin/admin-home.html", {"request": request, "users": users})
+
+
+@router.get("/admin/cache-stats", response_model=List[CacheStats])
+async def get_cache_stats():
+    """Hit and miss counts for this process's in memory caches - each worker process keeps its own"""
+    return [cache.stats() for cache in caches.values()]
@@ -0,0 +1,263 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+from fastapi import APIRouter, Depends, Request
+from fastapi.exceptions import HTTPException
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.utils import requires_authentication
+from app.db.pagination import InvalidCursor
+from app.db.session import get_async_db
+from app.invoices.config import config as invoice_config
+from app.invoices.db_utils import (PUBLIC_INVOICE_LOAD_OPTIONS,
+                                   bulk_categorize_invoices,
+                                   bulk_delete_invoices,
+                                   bulk_update_paid_status,
+                                   encode_change_cursor,
+                                   get_aging_report_by_id,
+                                   get_aging_reports_version,
+                                   get_invoice_by_id, get_invoices_version,
+                                   load_public_invoice_page,
+                                   query_aging_reports, query_invoice_changes)
+from app.invoices.models import (BulkInvoiceResult, PublicAgingReport,
+                                 PublicInvoice, PublicInvoiceChange)
+from app.utils import to_naive_utc
+from app.vendors.db_utils import (get_vendors_version,
+                                  query_vendors_with_aggregates)
+from app.vendors.models import PublicVendorView
+
+from .utils import compute_etag, etag_json_response, etag_matches, not_modified
+
+# Every JSON endpoint lives under a version prefix so the html routes can change freely
+router = APIRouter(prefix="/api/v1", tags=["api"])
+
+
+def status_epoch() -> str:
+    """Invoice status and humanized dates change with time alone - rolling this into etags bounds their staleness"""
+    return datetime.utcnow().strftime("%Y-%m-%dT%H")
+
+
+class BulkInvoicesBody(BaseModel):
+    invoice_ids: List[str]
+
+
+class BulkPaidBody(BulkInvoicesBody):
+    paid: bool
+
+
+class BulkCategoryBody(BulkInvoicesBody):
+    category_name: str
+
+
+def check_bulk_size(body: BulkInvoicesBody) -> None:
+    if len(body.invoice_ids) > invoice_config.bulk_operation_max_ids:
+        raise HTTPException(422, detail=f"At most {invoice_config.bulk_operation_max_ids} invoices per request")
+
+
+def to_bulk_results(statuses: Dict) -> List[BulkInvoiceResult]:
+    return [BulkInvoiceResult(invoice_id=i, status=status) for i, status in statuses.items()]
+
+
+def load_owned_invoice(db: sa.orm.Session, user_id: str, invoice_id: str) -> Tuple[Optional[Dict], Optional[datetime]]:
+    invoice = get_invoice_by_id(db, invoice_id, options=PUBLIC_INVOICE_LOAD_OPTIONS)
+    if not invoice or invoice.user_id != user_id:
+        return None, None
+    return PublicInvoice.from_orm(invoice).dict(), invoice.updated_on or invoice.created_on
+
+
+@router.get("/invoices")
+async def get_invoices(
+    request: Request,
+    user_id: str = Depends(requires_authentication),
+    filter_by: str = None,
+    order_by: str = "due_date",
+    desc: bool = False,
+    limit: int = 100,
+    cursor: str = None,
+    since: datetime = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Invoices as JSON - pass the previous response's last_modified as `since` to only fetch what changed
+
+    Deltas start invoice_delta_overlap seconds before `since` so edits that commit late aren't missed. Some
+    invoices therefore come back again - merge them by id. Deleted invoices don't appear in deltas; the
+    /invoice-changes feed has them, and exactly once.
+    """
+    modified_after = None
+    if since is not None:
+        modified_after = to_naive_utc(since) - timedelta(seconds=invoice_config.invoice_delta_overlap)
+
+    version = await db.run_sync(get_invoices_version, user_id)
+    etag = compute_etag("invoices", user_id, version, status_epoch(), str(request.query_params))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        invoices, next_cursor = await db.run_sync(
+            load_public_invoice_page,
+            user_id,
+            filter_by=filter_by,
+            order_by=order_by,
+            desc=desc,
+            limit=limit,
+            cursor=cursor,
+            modified_after=modified_after,
+        )
+    except InvalidCursor as e:
+        raise HTTPException(400, detail=str(e))
+
+    content = {"invoices": list(invoices.values()), "next_cursor": next_cursor, "last_modified": version[1]}
+    return etag_json_response(content, etag)
+
+
+@router.get("/invoices/{invoice_id}")
+async def get_invoice(
+    request: Request,
+    invoice_id: str,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    invoice, modified_on = await db.run_sync(load_owned_invoice, user_id, invoice_id)
+    if not invoice:
+        raise HTTPException(404, detail="Invoice not found")
+
+    etag = compute_etag("invoice", invoice_id, modified_on, status_epoch())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return etag_json_response(invoice, etag)
+
+
+@router.post("/invoices/bulk/paid")
+async def post_bulk_paid(
+    body: BulkPaidBody, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    check_bulk_size(body)
+    statuses = await db.run_sync(bulk_update_paid_status, user_id, body.invoice_ids, body.paid)
+    return to_bulk_results(statuses)
+
+
+@router.post("/invoices/bulk/categories")
+async def post_bulk_categories(
+    body: BulkCategoryBody, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    check_bulk_size(body)
+    statuses = await db.run_sync(bulk_categorize_invoices, user_id, body.invoice_ids, body.category_name)
+    return to_bulk_results(statuses)
+
+
+@router.post("/invoices/bulk/delete")
+async def post_bulk_delete(
+    body: BulkInvoicesBody, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    check_bulk_size(body)
+    statuses = await db.run_sync(bulk_delete_invoices, user_id, body.invoice_ids)
+    return to_bulk_results(statuses)
+
+
+@router.get("/invoice-changes")
+async def get_invoice_changes(
+    request: Request,
+    user_id: str = Depends(requires_authentication),
+    cursor: str = None,
+    limit: int = 100,
+    wait: float = 0,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Tails the invoice change log - pass the returned cursor back in to continue from where this left off
+
+    With wait > 0 an empty response is held open for up to that many seconds until a change arrives.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(max(wait, 0), invoice_config.change_feed_max_wait)
+
+    while True:
+        try:
+            changes = await db.run_sync(query_invoice_changes, user_id, cursor=cursor, limit=limit)
+        except InvalidCursor as e:
+            raise HTTPException(400, detail=str(e))
+
+        remaining = deadline - loop.time()
+        if changes or remaining <= 0 or await request.is_disconnected():
+            break
+
+        # End the read transaction so the connection goes back to the pool while we wait
+        await db.commit()
+        await asyncio.sleep(min(invoice_config.change_feed_poll_interval, remaining))
+
+    return {
+        "changes": [PublicInvoiceChange.from_orm(c) for c in changes],
+        "cursor": encode_change_cursor(changes[-1]) if changes else cursor,
+    }
+
+
+@router.get("/vendors")
+async def get_vendors(
+    request: Request,
+    user_id: str = Depends(requires_authentication),
+    order_by: str = "name",
+    desc: bool = False,
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Vendor totals are aggregates over invoices so both versions feed the etag
+    vendors_version = await db.run_sync(get_vendors_version, user_id)
+    invoices_version = await db.run_sync(get_invoices_version, user_id)
+    etag = compute_etag("vendors", user_id, vendors_version, invoices_version, str(request.query_params))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    rows = await db.run_sync(
+        query_vendors_with_aggregates, user_id, order_by=order_by, desc=desc, limit=limit, offset=offset
+    )
+    vendors = [
+        PublicVendorView.from_aggregates(
+            row.Vendor,
+            total_due=row.total_due,
+            total_paid=row.total_paid,
+            total_invoice_count=row.total_invoice_count,
+            last_added_on=row.last_added_on,
+        )
+        for row in rows
+    ]
+    return etag_json_response({"vendors": vendors}, etag)
+
+
+@router.get("/aging-reports")
+async def get_aging_reports(
+    request: Request,
+    user_id: str = Depends(requires_authentication),
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_async_db),
+):
+    version = await db.run_sync(get_aging_reports_version, user_id)
+    etag = compute_etag("aging-reports", user_id, version, str(request.query_params))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    reports = await db.run_sync(
+        query_aging_reports, user_id, order_by="created_on", desc=True, limit=limit, offset=offset
+    )
+    return etag_json_response({"aging_reports": [PublicAgingReport.from_orm(r) for r in reports]}, etag)
+
+
+@router.get("/aging-reports/{report_id}")
+async def get_aging_report(
+    request: Request,
+    report_id: str,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    report = await db.run_sync(get_aging_report_by_id, report_id)
+    if not report or report.user_id != user_id:
+        raise HTTPException(404, detail="Aging report not found")
+
+    # Reports are immutable once generated
+    etag = compute_etag("aging-report", report.id, report.created_on)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return etag_json_response(PublicAgingReport.from_orm(report), etag)
@@ -0,0 +1,25 @@
+from pydantic import BaseSettings
+
+
+class AuthSettings(BaseSettings):
+    # bcrypt work factor - existing hashes are upgraded (or downgraded) to it on the user's next login
+    password_hash_rounds: int = 12
+    # Hashing runs off the event loop on a fixed size pool, so at most this many logins burn CPU at once
+    password_hash_workers: int = 2
+    password_hash_executor: str = "thread"  # "thread" or "process"
+
+    # Sessions - "cookie" keeps the whole session in a signed cookie, "memory" and "postgres" keep it server side
+    # with only an opaque id in the cookie. "memory" is per process so only suits local development
+    session_backend: str = "postgres"
+    session_max_age: int = 14 * 24 * 60 * 60  # seconds
+    # Server side sessions are cached in each process for GET requests - a logout elsewhere takes up to the ttl to
+    # apply to those here. Other methods always check the backend
+    session_cache_size: int = 10000
+    session_cache_ttl: float = 60  # seconds
+
+    class Config:
+        env_file = ".env"
+        case_sensitive = False
+
+
+config = AuthSettings()
@@ -17,7 +17,8 @@ from app.users.db_utils import get_user_by_id
 
 from .db_utils import create_reset_pwd_token
 from .session_utils import UserSession, clear_session, set_session
-from .utils import hash_pswd, requires_authentication, verify_pswd
+from .utils import (hash_pswd_async, requires_authentication,
+                    verify_and_update_pswd_async)
 
 router = APIRouter()
 
@@ -42,6 +43,8 @@ async def post_register(
             params = urlencode({"error": "This email has already been registered."})
             return RedirectResponse(f"/landing?{params}", status_code=HTTP_302_FOUND)
 
+        password_hash = await hash_pswd_async(password)
+
         # Create a new organization and add user to it.
         # TODO: Allow users to merge with an exisiting organization
         new_organization = db_models.Organization(name=company_name)
@@ -50,7 +53,7 @@ async def post_register(
         db.refresh(new_organization)
 
         new_user = db_models.User(
-            name=name, email=email, password_hash=hash_pswd(password), organization_id=new_organization.id
+            name=name, email=email, password_hash=password_hash, organization_id=new_organization.id
         )
         db.add(new_user)
         db.flush()
@@ -75,13 +78,20 @@ async def post_login(request: Request, email: str = Form(...), password: str = F
             params = urlencode({"error": "Password or email is incorrect."})
             return RedirectResponse(f"/login?{params}", status_code=HTTP_302_FOUND)
 
-        if not verify_pswd(password, existing_user.password_hash):
+        is_valid, new_password_hash = await verify_and_update_pswd_async(password, existing_user.password_hash)
+        if not is_valid:
             params = urlencode({"error": "Password or email is incorrect."})
             return RedirectResponse(f"/login?{params}", status_code=HTTP_302_FOUND)
 
-        set_session(request, UserSession.from_user(existing_user))
+        user_session = UserSession.from_user(existing_user)
+        set_session(request, user_session)
+
+        # Rehashed with the configured work factor while the plaintext is at hand
+        if new_password_hash:
+            existing_user.password_hash = new_password_hash
+            db.commit()
 
-    if existing_user.role == UserRoleEnum.admin:
+    if user_session.role == UserRoleEnum.admin:
         return RedirectResponse("/admin/home", status_code=HTTP_302_FOUND)
     return RedirectResponse("/", status_code=HTTP_302_FOUND)
 
@@ -122,7 +132,7 @@ async def post_reset_password(token: str, password: str = Form(..., min_length=6
         if not user:
             raise HTTPException(400, "Bad Request.")
 
-        user.password_hash = hash_pswd(password)
+        user.password_hash = await hash_pswd_async(password)
         db.commit()
     return RedirectResponse("/login", status_code=HTTP_302_FOUND)
 
@@ -0,0 +1,224 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from secrets import token_urlsafe
+from typing import Dict, Optional, Tuple, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.db.cache import create_cache
+from app.db.models import ServerSession
+from app.db.session import SessionLocal
+
+
+class SessionBackend:
+    """Stores serialized sessions by id with an expiry.
+
+    Deliberately the subset of the redis-py client the middleware uses - get, set with ex and delete - so a
+    redis.Redis instance can be passed to ServerSessionMiddleware as is.
+    """
+
+    def get(self, name: str) -> Optional[Union[str, bytes]]:
+        raise NotImplementedError
+
+    def set(self, name: str, value: str, ex: int = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, *names: str) -> None:
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """Sessions in this process only - for local development and single process deployments"""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self._cache = create_cache("sessions", max_size, ttl)
+
+    def get(self, name: str) -> Optional[str]:
+        return self._cache.get(name)
+
+    def set(self, name: str, value: str, ex: int = None) -> None:
+        self._cache.set(name, value)
+
+    def delete(self, *names: str) -> None:
+        for name in names:
+            self._cache.invalidate(name)
+
+
+class PostgresSessionBackend(SessionBackend):
+    """Sessions in the server_sessions table, shared by every app process"""
+
+    def __init__(self, purge_interval: float = 60) -> None:
+        self._purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[str]:
+        with SessionLocal() as db:
+            return db.execute(
+                sa.select(ServerSession.data).where(
+                    ServerSession.id == name, ServerSession.expires_on > datetime.utcnow()
+                )
+            ).scalar()
+
+    def set(self, name: str, value: str, ex: int = None) -> None:
+        expires_on = datetime.utcnow() + timedelta(seconds=ex or 14 * 24 * 60 * 60)
+        with SessionLocal() as db:
+            db.execute(
+                pg_insert(ServerSession)
+                .values(id=name, data=value, expires_on=expires_on)
+                .on_conflict_do_update(
+                    index_elements=[ServerSession.id],
+                    set_={"data": value, "expires_on": expires_on, "updated_on": sa.func.now()},
+                )
+            )
+            self._maybe_purge(db)
+            db.commit()
+
+    def delete(self, *names: str) -> None:
+        with SessionLocal() as db:
+            db.execute(sa.delete(ServerSession).where(ServerSession.id.in_(names)))
+            db.commit()
+
+    def _maybe_purge(self, db: sa.orm.Session) -> None:
+        """Expired rows are never read again - clear them out now and then rather than on a schedule"""
+        with self._lock:
+            if time.monotonic() - self._last_purge < self._purge_interval:
+                return
+            self._last_purge = time.monotonic()
+        db.execute(sa.delete(ServerSession).where(ServerSession.expires_on <= datetime.utcnow()))
+
+
+# Methods that can't change anything may be served from a session cached in this process
+CACHEABLE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ServerSessionMiddleware:
+    """Drop in replacement for starlette's SessionMiddleware that keeps the session data server side.
+
+    The cookie only holds an opaque random id. Decoded sessions are cached in process for `cache_ttl` seconds
+    so most reads never reach the backend - a session cleared in another process can therefore outlive the
+    clear here by up to that long, but only for GET, HEAD and OPTIONS requests. Anything else always loads the
+    session from the backend, so a logged out session can't change anything anywhere. The id is replaced
+    whenever the logged in user changes so a pre-login id can't be fixated.
+
+    Expiry slides like starlette's: once less than half of `max_age` is left the session is written back with
+    a fresh expiry and the cookie is sent again. Otherwise the backend is only written when a request changes
+    the session.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: SessionBackend,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,  # 14 days, in seconds
+        same_site: str = "lax",
+        https_only: bool = False,
+        cache_size: int = 10000,
+        cache_ttl: float = 60,
+    ) -> None:
+        self.app = app
+        self.backend = backend
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+        self.cache = create_cache("sessions_by_id", cache_size, cache_ttl)
+
+    async def load(self, session_id: str, use_cache: bool = True) -> Tuple[Dict, float]:
+        """Returns the session and when it expires as a unix timestamp - ({}, 0) if there's no such session"""
+        entry = self.cache.get(session_id) if use_cache else None
+        if entry is None:
+            raw = await run_in_threadpool(self.backend.get, session_id)
+            if raw is None:
+                self.cache.invalidate(session_id)
+                return {}, 0
+            stored = json.loads(raw)
+            if "data" in stored and "expires_at" in stored:
+                entry = (stored["data"], stored["expires_at"])
+            else:
+                # Stored before expiry was tracked - renewed on this request
+                entry = (stored, 0)
+            self.cache.set(session_id, entry)
+        data, expires_at = entry
+        # Handlers mutate the session in place - the cached copy has to stay as loaded
+        return dict(data), expires_at
+
+    async def save(self, session_id: str, data: Dict) -> None:
+        expires_at = time.time() + self.max_age
+        stored = json.dumps({"data": data, "expires_at": expires_at})
+        await run_in_threadpool(self.backend.set, session_id, stored, ex=self.max_age)
+        self.cache.set(session_id, (dict(data), expires_at))
+
+    async def delete(self, session_id: str) -> None:
+        self.cache.invalidate(session_id)
+        await run_in_threadpool(self.backend.delete, session_id)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):  # pragma: no cover
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        initial_session, expires_at = {}, 0
+        if session_id:
+            use_cache = scope["type"] == "http" and scope["method"] in CACHEABLE_METHODS
+            initial_session, expires_at = await self.load(session_id, use_cache=use_cache)
+        if not initial_session:
+            # Expired or made up - a fresh id is issued if this request stores anything
+            session_id = None
+        scope["session"] = dict(initial_session)
+        needs_renewal = bool(session_id) and expires_at - time.time() < self.max_age / 2
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                await self.commit(scope, message, session_id, initial_session, needs_renewal)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def commit(
+        self,
+        scope: Scope,
+        message: Message,
+        session_id: Optional[str],
+        initial_session: Dict,
+        needs_renewal: bool = False,
+    ) -> None:
+        session = scope["session"]
+        if session == initial_session and not needs_renewal:
+            return
+
+        path = scope.get("root_path", "") or "/"
+        headers = MutableHeaders(scope=message)
+
+        if not session:
+            if session_id:
+                await self.delete(session_id)
+            headers.append(
+                "Set-Cookie",
+                f"{self.session_cookie}=null; path={path}; expires=Thu, 01 Jan 1970 00:00:00 GMT; "
+                f"{self.security_flags}",
+            )
+            return
+
+        new_session_id = session_id
+        if not session_id or session.get("user_id") != initial_session.get("user_id"):
+            new_session_id = token_urlsafe(32)
+            if session_id:
+                await self.delete(session_id)
+
+        # Every save pushes the expiry out by max_age, so the cookie's expiry moves with it
+        await self.save(new_session_id, session)
+        headers.append(
+            "Set-Cookie",
+            f"{self.session_cookie}={new_session_id}; path={path}; Max-Age={self.max_age}; {self.security_flags}",
+        )
@@ -1,4 +1,3 @@
-import json
 from typing import List, Optional
 
 from fastapi import Request
@@ -18,13 +17,22 @@ class UserSession(BaseModel):
         return UserSession(user_id=user.id, role=user.role, organization_id=user.organization_id)
 
 
+def get_user_session(req: Request) -> UserSession:
+    """The request's session as a UserSession - parsed once per request and kept on request.state"""
+    session = getattr(req.state, "user_session", None)
+    if session is None:
+        session = UserSession(**req.session)
+        req.state.user_session = session
+    return session
+
+
 def set_session(req: Request, data: UserSession) -> None:
     """Modifies Request.session in place"""
-    jsonable_dict: dict = json.loads(data.json())
-    for k, v in jsonable_dict.items():
-        req.session[k] = v
+    req.session.update(data.dict())
+    req.state.user_session = data
 
 
 def clear_session(req: Request) -> None:
     """Modifies Request.session in place"""
-    set_session(req, UserSession())
+    req.session.clear()
+    req.state.user_session = UserSession()
@@ -1,9 +1,14 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
 from secrets import token_urlsafe
-from typing import Optional
+from typing import Any, Callable, Optional, Tuple
 
 from fastapi import Request
 from fastapi.exceptions import HTTPException
-from passlib.hash import bcrypt
+from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.functions import user
 
@@ -11,26 +16,69 @@ import app.db.models as db_models
 from app.auth.models import UserRoleEnum
 from app.config import config as global_config
 
-from .session_utils import UserSession
+from .config import config
+from .session_utils import get_user_session
 
+# Hashes with a different cost than the configured one are reported as needing an update by verify_and_update_pswd
+pswd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=config.password_hash_rounds)
 
-def hash_pswd(pswd: str):
-    return bcrypt.encrypt(pswd)
+_hash_pool: Optional[Executor] = None
+_hash_pool_lock = threading.Lock()
 
 
-def verify_pswd(pswd: str, hashed: str) -> bool:
-    return bcrypt.verify(pswd, hashed)
+def hash_pswd(pswd: str) -> str:
+    return pswd_context.hash(pswd)
+
+
+def verify_and_update_pswd(pswd: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """Returns (matches, new hash) - new hash is only set when the password matched and hashed used another cost"""
+    return pswd_context.verify_and_update(pswd, hashed)
+
+
+def _get_hash_pool() -> Executor:
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            if config.password_hash_executor == "process":
+                _hash_pool = ProcessPoolExecutor(
+                    config.password_hash_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                # The bcrypt backend releases the GIL while hashing so threads run in parallel
+                _hash_pool = ThreadPoolExecutor(config.password_hash_workers, thread_name_prefix="password-hash")
+    return _hash_pool
+
+
+def shutdown_password_hash_pool() -> None:
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=True)
+            _hash_pool = None
+
+
+async def _run_in_hash_pool(fn: Callable, *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_get_hash_pool(), fn, *args)
+
+
+async def hash_pswd_async(pswd: str) -> str:
+    """hash_pswd on the password hash pool - each call is hundreds of ms of CPU that would otherwise block the loop"""
+    return await _run_in_hash_pool(hash_pswd, pswd)
+
+
+async def verify_and_update_pswd_async(pswd: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return await _run_in_hash_pool(verify_and_update_pswd, pswd, hashed)
 
 
 def requires_authentication(req: Request) -> str:
-    session = UserSession(**req.session)
+    session = get_user_session(req)
     if not session.user_id:
         raise HTTPException(400, "Must be logged in.")
     return session.user_id
 
 
 def admin_authentication(req: Request) -> str:
-    session = UserSession(**req.session)
+    session = get_user_session(req)
     if not session.user_id or session.role != UserRoleEnum.admin:
         raise HTTPException(401, "Unauthorizes")
     return session.user_id
@@ -42,7 +90,7 @@ def optional_authentication(req: Request) -> Optional[str]:
     # else:
     #     raise Exception("Forgot to update from testing env")
 
-    session = UserSession(**req.session)
+    session = get_user_session(req)
     if not session.user_id:
         return None
     return session.user_id
@@ -9,6 +9,17 @@ class DBSettings(BaseSettings):
     pg_port: int = 5432
     DATABASE_URL: str = None  # Default env name for digital ocean url
 
+    # Connection pool - applies to both the sync and async engines
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: int = 30  # seconds to wait for a connection
+    pool_recycle: int = 1800  # seconds before a connection is replaced, -1 to disable
+    pool_pre_ping: bool = True
+
+    # Per process caches of ids that rarely change - vendor ids by name, organization ids by user. 0 disables
+    id_cache_size: int = 10000
+    id_cache_ttl: float = 300  # seconds, bounds how stale another process's writes can look
+
     class Config:
         env_file = ".env"
         case_sensitive = False
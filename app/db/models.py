@@ -2,8 +2,10 @@ from datetime import datetime
 from secrets import token_urlsafe
 
 import ulid
-from sqlalchemy import (ARRAY, DECIMAL, Boolean, Column, DateTime, Float,
-                        ForeignKey, Integer, String, UniqueConstraint, alias)
+from sqlalchemy import (ARRAY, DECIMAL, BigInteger, Boolean, Column, DateTime,
+                        Float, ForeignKey, Index, Integer, LargeBinary, String,
+                        UniqueConstraint, alias, text)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -59,6 +61,8 @@ class Organization(Base):
 
 class Vendor(Base):
     __tablename__ = "vendors"
+    # Vendors are looked up and listed per user - see ensure_vendor_ids_by_name
+    __table_args__ = (UniqueConstraint("user_id", "name", name="uq_vendors_user_id_name"),)
 
     id = Column(String, default=ulid.ulid, primary_key=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=True, index=True)
@@ -75,6 +79,36 @@ class Vendor(Base):
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        # An organization can only store a given file once - see ingestion content hashing
+        Index(
+            "ix_invoices_organization_id_content_hash",
+            "organization_id",
+            "content_hash",
+            unique=True,
+            postgresql_where=text("content_hash IS NOT NULL"),
+        ),
+        # NULL organization ids never conflict above, so users without an organization get their own index
+        Index(
+            "ix_invoices_user_id_content_hash",
+            "user_id",
+            "content_hash",
+            unique=True,
+            postgresql_where=text("organization_id IS NULL AND content_hash IS NOT NULL"),
+        ),
+        # Invoice listings filter by owner (and optionally is_paid) then keyset paginate on (due_date, id)
+        Index("ix_invoices_user_id_due_date_id", "user_id", "due_date", "id"),
+        Index("ix_invoices_user_id_is_paid_due_date_id", "user_id", "is_paid", "due_date", "id"),
+        Index("ix_invoices_organization_id_is_paid_due_date", "organization_id", "is_paid", "due_date"),
+        # Vendor pages list a vendor's invoices newest first
+        Index("ix_invoices_vendor_id_created_on_id", "vendor_id", "created_on", "id"),
+        # Only rows the derivative backfill still has to visit
+        Index(
+            "ix_invoices_missing_derivatives",
+            "created_on",
+            postgresql_where=text("thumbnail_uri IS NULL AND image_uri IS NOT NULL"),
+        ),
+    )
 
     id = Column(String, default=ulid.ulid, primary_key=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=True, index=True)
@@ -89,6 +123,11 @@ class Invoice(Base):
     due_date = Column(DateTime)
     invoice_id = Column(String)
     image_uri = Column(String)
+    # Downscaled copies of image_uri for listings and the detail view - empty string if they couldn't be made
+    thumbnail_uri = Column(String)
+    preview_uri = Column(String)
+    # Set while the derivative backfill is working on the row so other processes skip it
+    derivatives_claimed_on = Column(DateTime)
 
     raw_vendor_name = Column(String)
     raw_amount_due = Column(String)
@@ -102,12 +141,13 @@ class Invoice(Base):
 
 class Category(Base):
     __tablename__ = "categories"
+    __table_args__ = (UniqueConstraint("user_id", "name", name="uq_categories_user_id_name"),)
 
     id = Column(String, default=ulid.ulid, primary_key=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=True, index=True)
     organization_id = Column(String, ForeignKey("organizations.id"), nullable=True, index=True)
 
-    name = Column(String, unique=True)
+    name = Column(String)
 
     invoice_links = relationship("CategoryInvoiceAssociation", back_populates="category")
 
@@ -139,3 +179,75 @@ class AgingReport(Base):
 
     created_on = Column(DateTime, server_default=func.now())
     updated_on = Column(DateTime, onupdate=func.now())
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, default=ulid.ulid, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    invoice_id = Column(String, ForeignKey("invoices.id", ondelete="SET NULL"), nullable=True)
+
+    status = Column(String, nullable=False, default="queued", index=True)
+    step = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+
+    content_type = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True)
+    # The uploaded file is either held inline or, for direct uploads, in storage under storage_key
+    file_data = Column(LargeBinary, nullable=True)
+    storage_key = Column(String, nullable=True)
+
+    created_on = Column(DateTime, server_default=func.now())
+    updated_on = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class InvoiceStats(Base):
+    """Per user invoice counters kept in step with invoice writes - see invoices.db_utils.bump_invoice_stats"""
+
+    __tablename__ = "invoice_stats"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+
+    num_paid = Column(Integer, nullable=False, default=0, server_default="0")
+    num_unpaid = Column(Integer, nullable=False, default=0, server_default="0")
+    amount_paid = Column(DECIMAL, nullable=False, default=0, server_default="0")
+    amount_unpaid = Column(DECIMAL, nullable=False, default=0, server_default="0")
+
+    updated_on = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class InvoiceChange(Base):
+    """Append only log of invoice changes, written in the same transaction as the change itself.
+
+    txid is the writing transaction's id. Readers only take rows below the oldest in-flight transaction
+    and page by (txid, id), so a change can't become visible behind a consumer's cursor.
+    """
+
+    __tablename__ = "invoice_changes"
+    __table_args__ = (Index("ix_invoice_changes_user_id_txid_id", "user_id", "txid", "id"),)
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    txid = Column(BigInteger, nullable=False, server_default=text("txid_current()"))
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    # Not a foreign key - deletes are logged too
+    invoice_id = Column(String, nullable=False)
+
+    operation = Column(String, nullable=False)
+    data = Column(JSONB, nullable=True)
+
+    created_on = Column(DateTime, server_default=func.now())
+
+
+class ServerSession(Base):
+    """Session data for the postgres session backend - the cookie only carries the id"""
+
+    __tablename__ = "server_sessions"
+
+    id = Column(String, primary_key=True)
+    data = Column(String, nullable=False)
+    expires_on = Column(DateTime, nullable=False, index=True)
+
+    created_on = Column(DateTime, server_default=func.now())
+    updated_on = Column(DateTime, server_default=func.now(), onupdate=func.now())
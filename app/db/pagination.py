@@ -0,0 +1,73 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Query
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order_by: str, desc: bool, value: Any, row_id: str) -> str:
+    """Builds an opaque cursor pointing just past the row with the given sort value and id"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+
+    payload = json.dumps({"o": order_by, "d": desc, "v": value, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, column: sa.Column, order_by: str, desc: bool) -> Tuple[Any, str]:
+    """Returns the (sort value, id) of the last row of the previous page
+
+    Raises InvalidCursor if the cursor is malformed or was issued for a different sort order.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        value, row_id = payload["v"], payload["id"]
+        if payload["o"] != order_by or payload["d"] != desc:
+            raise InvalidCursor("Cursor was issued for a different sort order")
+        if value is not None:
+            python_type = column.type.python_type
+            value = datetime.fromisoformat(value) if python_type is datetime else python_type(value)
+    except InvalidCursor:
+        raise
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    return value, row_id
+
+
+def apply_keyset(
+    query: Query, column: sa.Column, id_column: sa.Column, desc: bool, after: Optional[Tuple[Any, str]] = None
+) -> Query:
+    """Orders the query by (column, id) and, given the previous page's last key, seeks past it
+
+    NULLs sort last ascending and first descending, matching Postgres' default btree order so the
+    composite indexes ending in (column, id) can be scanned in either direction.
+    """
+    if desc:
+        query = query.order_by(column.desc().nulls_first(), id_column.desc())
+    else:
+        query = query.order_by(column.asc().nulls_last(), id_column.asc())
+
+    if after is None:
+        return query
+
+    value, row_id = after
+    if value is None:
+        # Inside the NULL block, only the id decides - descending pages still have every non NULL row ahead
+        if desc:
+            return query.filter(sa.or_(column.isnot(None), sa.and_(column.is_(None), id_column < row_id)))
+        return query.filter(column.is_(None), id_column > row_id)
+
+    if desc:
+        return query.filter(sa.or_(column < value, sa.and_(column == value, id_column < row_id)))
+    return query.filter(sa.or_(column > value, sa.and_(column == value, id_column > row_id), column.is_(None)))
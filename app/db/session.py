@@ -1,4 +1,8 @@
+from typing import AsyncIterator, Dict, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -13,6 +17,47 @@ else:
 
 print(SQLALCHEMY_DATABASE_URI)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URI)
+
+def to_async_uri(uri: str) -> Tuple[str, Dict]:
+    """Converts a libpq style url to an asyncpg one - returns (url, connect_args)
+
+    asyncpg doesn't understand libpq query params like sslmode so it is passed as a connect arg instead.
+    """
+    parts = urlsplit(uri)
+    scheme = "postgresql+asyncpg"
+
+    params = dict(parse_qsl(parts.query))
+    connect_args = {}
+    sslmode = params.pop("sslmode", None)
+    if sslmode and sslmode != "disable":
+        connect_args["ssl"] = sslmode
+
+    return urlunsplit((scheme, parts.netloc, parts.path, urlencode(params), parts.fragment)), connect_args
+
+
+pool_options = dict(
+    pool_size=config.pool_size,
+    max_overflow=config.max_overflow,
+    pool_timeout=config.pool_timeout,
+    pool_recycle=config.pool_recycle,
+    pool_pre_ping=config.pool_pre_ping,
+)
+
+engine = create_engine(SQLALCHEMY_DATABASE_URI, **pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+ASYNC_SQLALCHEMY_DATABASE_URI, async_connect_args = to_async_uri(SQLALCHEMY_DATABASE_URI)
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URI, connect_args=async_connect_args, **pool_options)
+AsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession
+)
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency providing an AsyncSession for the request.
+
+    Existing sync db utils can be reused without blocking the event loop via `await db.run_sync(fn, *args)`.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
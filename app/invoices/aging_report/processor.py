@@ -1,28 +1,37 @@
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Tuple
 
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 
+from app.db.models import Invoice
 from app.invoices.aging_report.models import AgingReportInput, InvoiceGroup
-from app.invoices.db_utils import get_invoices_by_user
-from app.invoices.models import PublicInvoice
+from app.invoices.config import config
+from app.invoices.db_utils import (PUBLIC_INVOICE_LOAD_OPTIONS,
+                                   get_invoices_by_user)
+from app.invoices.models import PublicInvoice, format_amount
 
 
 class AgingReportProcessor:
     aging_columns = ["0-30", "31-60", "61-90", "90+"]
     columns = ["Number", "Due Date"] + aging_columns
+    # Upper (inclusive) edges of every aging column but the last - as time until due
+    aging_edges = [timedelta(days=30), timedelta(days=60), timedelta(days=90)]
+    aging_bins = np.array(aging_edges, dtype="timedelta64[ns]")
+    frame_columns = ["vendor_name", "invoice_id", "due_date", "amount_due"]
 
     @classmethod
     def fetch_data(cls, db: sa.orm.Session, user_id: str) -> AgingReportInput:
         all_invoices = get_invoices_by_user(
-            db, user_id, due_after=datetime.today(), filter_by="due"
+            db, user_id, due_after=datetime.today(), filter_by="due", limit=None, options=PUBLIC_INVOICE_LOAD_OPTIONS
         )  # TODO: use timezone?
 
         vendor_name_invoice_list_map = defaultdict(list)
         for invoice in all_invoices:
-            vendor_name_invoice_list_map[invoice.vendor_name].append(PublicInvoice.from_orm(invoice))
+            # A missing vendor name shares the blank vendor's section, as in fetch_aggregated
+            vendor_name_invoice_list_map[invoice.vendor_name or ""].append(PublicInvoice.from_orm(invoice))
 
         data = AgingReportInput(groups=[])
         for vendor_name, invoice_list in vendor_name_invoice_list_map.items():
@@ -30,65 +39,169 @@ class AgingReportProcessor:
         return data
 
     def apply(self, data: AgingReportInput) -> pd.DataFrame:
-        df = pd.DataFrame(columns=self.columns)
-
-        # Add Vendor Sections
-        for group in data.groups:
-            df = df.append(
-                pd.DataFrame([[group.vendor_name] + [" " for _ in range(len(self.columns) - 1)]], columns=self.columns)
-            )
-
-            invoice_rows = pd.DataFrame([self.invoice_to_row_dict(i) for i in group.invoice_list])
-            sub_total_row = pd.DataFrame([self.gen_total_row_dict(group.invoice_list, title="subtotals:")])
-
-            df = df.append(invoice_rows, sort=False)
-            df = df.append(sub_total_row, sort=False)
-            df = df.append(self.gen_empty_row_df(df), sort=False)
-
-        # Add Final Total Section
-        all_invoices = []
-        for group in data.groups:
-            all_invoices.extend(group.invoice_list)
-
-        total_row = pd.DataFrame([self.gen_total_row_dict(all_invoices, title="Totals:")])
-        df = df.append(total_row, sort=False)
+        return self.apply_frame(self.input_to_frame(data))
+
+    def input_to_frame(self, data: AgingReportInput) -> pd.DataFrame:
+        """Flattens the grouped input into one row per invoice, keeping group order"""
+        rows = [
+            (group.vendor_name, i.invoice_id, i.due_date, i.amount_due)
+            for group in data.groups
+            for i in group.invoice_list
+        ]
+        return pd.DataFrame(rows, columns=self.frame_columns)
+
+    def apply_frame(self, invoices: pd.DataFrame, now: datetime = None) -> pd.DataFrame:
+        """Builds the report from a frame with `frame_columns` - vendor sections appear in order of first appearance
+
+        Every invoice is bucketed in one vectorized pass and subtotals come from a single groupby.
+        """
+        now = now or datetime.utcnow()
+
+        vendor_codes, vendor_names = pd.factorize(invoices["vendor_name"].fillna(""), sort=False)
+        due_dates = pd.to_datetime(invoices["due_date"])
+        amounts = pd.to_numeric(invoices["amount_due"], errors="coerce").fillna(0).to_numpy(dtype=float)
+
+        # side="left" keeps the upper edge inclusive, i.e. exactly 30 days out is still "0-30"
+        buckets = np.searchsorted(self.aging_bins, (due_dates - now).to_numpy(), side="left")
+
+        bucketed_amounts = np.zeros((len(invoices), len(self.aging_columns)))
+        bucketed_amounts[np.arange(len(invoices)), buckets] = amounts
+
+        subtotals = pd.DataFrame(bucketed_amounts).groupby(vendor_codes, sort=True).sum().to_numpy()
+        totals = bucketed_amounts.sum(axis=0)
+        return self.assemble(invoices, buckets, vendor_codes, vendor_names, subtotals, totals)
+
+    def apply_aggregated(
+        self, invoices: pd.DataFrame, vendor_subtotals: pd.DataFrame, totals: np.ndarray
+    ) -> pd.DataFrame:
+        """Builds the report from invoices already bucketed (a `bucket` column) and subtotalled by the database"""
+        vendor_codes, vendor_names = pd.factorize(invoices["vendor_name"].fillna(""), sort=False)
+        subtotals = vendor_subtotals.reindex(vendor_names).fillna(0).to_numpy(dtype=float)
+        buckets = invoices["bucket"].to_numpy(dtype=int)
+        return self.assemble(invoices, buckets, vendor_codes, vendor_names, subtotals, totals)
+
+    def assemble(
+        self,
+        invoices: pd.DataFrame,
+        buckets: np.ndarray,
+        vendor_codes: np.ndarray,
+        vendor_names: pd.Index,
+        subtotals: np.ndarray,
+        totals: np.ndarray,
+    ) -> pd.DataFrame:
+        """Lays out the vendor sections and totals with a single concat
+
+        Args:
+            invoices (pd.DataFrame): One row per invoice with `frame_columns`
+            buckets (np.ndarray): Index into aging_columns for each invoice
+            vendor_codes (np.ndarray): Index into vendor_names for each invoice
+            vendor_names (pd.Index): Vendor names in the order their sections should appear
+            subtotals (np.ndarray): (num vendors, num aging columns) amounts
+            totals (np.ndarray): (num aging columns,) amounts
+        """
+        # Invoice rows: the amount goes in its aging column and every other aging column is 0
+        detail = pd.DataFrame(
+            {
+                "Number": invoices["invoice_id"].to_numpy(),
+                "Due Date": pd.to_datetime(invoices["due_date"]).dt.strftime("%m/%d/%Y").to_numpy(),
+            }
+        )
+        amount_strings = invoices["amount_due"].map(lambda v: f"{v}").to_numpy()
+        for idx, col in enumerate(self.aging_columns):
+            detail[col] = np.where(buckets == idx, amount_strings, 0)
+        detail["_vendor"], detail["_section"] = vendor_codes, 1
+
+        vendor_codes_range = np.arange(len(vendor_names))
+
+        subtotal_rows = self.format_totals(pd.DataFrame(subtotals, columns=self.aging_columns))
+        subtotal_rows["Due Date"] = "subtotals:"
+        subtotal_rows["_vendor"], subtotal_rows["_section"] = vendor_codes_range, 2
+
+        headers = pd.DataFrame(" ", index=vendor_codes_range, columns=self.columns)
+        headers["Number"] = vendor_names
+        headers["_vendor"], headers["_section"] = vendor_codes_range, 0
+
+        empties = pd.DataFrame("", index=vendor_codes_range, columns=self.columns)
+        empties["_vendor"], empties["_section"] = vendor_codes_range, 3
+
+        # Stable sort keeps invoice rows in their original order within each vendor section
+        sections = pd.concat([headers, detail, subtotal_rows, empties], ignore_index=True)
+        sections = sections.sort_values(["_vendor", "_section"], kind="mergesort")
+
+        total_row = self.format_totals(pd.DataFrame([totals], columns=self.aging_columns))
+        total_row["Due Date"] = "Totals:"
+
+        df = pd.concat([sections[self.columns], total_row], ignore_index=True)[self.columns]
 
         # Ensure we don't see any NaNs
         df = df.fillna("")
         return df
 
-    def datetime_to_aging_col(self, dt: datetime) -> str:
-        time_from_now = dt - datetime.utcnow()
-        if time_from_now <= timedelta(days=30):
-            return "0-30"
-        elif time_from_now <= timedelta(days=60):
-            return "31-60"
-        elif time_from_now <= timedelta(days=90):
-            return "61-90"
-        else:
-            return "90+"
-
-    def invoice_to_row_dict(self, invoice: PublicInvoice) -> Dict:
-        row_dict = {c: 0 for c in self.aging_columns}
-
-        row_dict["Number"] = invoice.invoice_id
-        row_dict["Due Date"] = invoice.due_date.strftime("%m/%d/%Y")
+    def format_totals(self, totals: pd.DataFrame) -> pd.DataFrame:
+        return totals.applymap(lambda v: f"{v:.2f}")
 
-        bucket = self.datetime_to_aging_col(invoice.due_date)
-        row_dict[bucket] = f"{invoice.amount_due}"
-
-        return row_dict
-
-    def gen_total_row_dict(self, invoices: List[PublicInvoice], title: str = None) -> Dict:
-        values = {c: [] for c in self.aging_columns}
-        for i in invoices:
-            col = self.datetime_to_aging_col(i.due_date)
-            values[col].append(float(i.amount_due))
-
-        row_dict = {c: f"{sum(values[c])}" for c in values}
-        row_dict["Due Date"] = title if title else ""
-
-        return row_dict
-
-    def gen_empty_row_df(self, df: pd.DataFrame) -> pd.DataFrame:
-        return pd.DataFrame([[""] * len(df.columns)], columns=df.columns)
+    @classmethod
+    def fetch_aggregated(
+        cls, db: sa.orm.Session, user_id: str, now: datetime = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, np.ndarray]:
+        """Alternate to fetch_data that buckets and subtotals in Postgres
+
+        Returns the detail lines (with a `bucket` column), per vendor subtotals indexed by vendor name and the
+        grand totals - ready for apply_aggregated. Uses the same filters as fetch_data.
+        """
+        now = now or datetime.utcnow()
+        due_filters = (
+            Invoice.user_id == user_id,
+            Invoice.is_paid == False,
+            Invoice.due_date >= datetime.today(),  # TODO: use timezone?
+        )
+
+        # NULL and empty vendor names are one section, as they are in the reference pipeline
+        vendor_name = sa.func.coalesce(Invoice.vendor_name, sa.literal_column("''"))
+        # Mirrors aging_bins - upper edges are inclusive
+        bucket = sa.case(
+            *[(Invoice.due_date <= now + edge, idx) for idx, edge in enumerate(cls.aging_edges)],
+            else_=len(cls.aging_edges),
+        )
+
+        detail_rows = (
+            db.query(
+                vendor_name.label("vendor_name"),
+                Invoice.invoice_id,
+                Invoice.due_date,
+                Invoice.amount_due,
+                bucket.label("bucket"),
+            )
+            .filter(*due_filters)
+            # Same order as get_invoices_by_user so vendors with equal due dates come out the same
+            .order_by(Invoice.due_date, Invoice.id)
+            .all()
+        )
+        invoices = pd.DataFrame(detail_rows, columns=cls.frame_columns + ["bucket"])
+        # Same formatting PublicInvoice applies in the reference pipeline
+        invoices["amount_due"] = invoices["amount_due"].map(format_amount)
+
+        bucket_sums = [
+            sa.func.coalesce(sa.func.sum(sa.case((bucket == idx, Invoice.amount_due), else_=0)), 0).label(col)
+            for idx, col in enumerate(cls.aging_columns)
+        ]
+        aggregate_rows = (
+            db.query(vendor_name.label("vendor_name"), sa.func.grouping(vendor_name).label("is_total"), *bucket_sums)
+            .filter(*due_filters)
+            .group_by(sa.func.rollup(vendor_name))
+            .all()
+        )
+        aggregates = pd.DataFrame(aggregate_rows, columns=["vendor_name", "is_total"] + cls.aging_columns)
+        aggregates[cls.aging_columns] = aggregates[cls.aging_columns].astype(float)
+
+        total_rows = aggregates[aggregates["is_total"] == 1]
+        totals = total_rows[cls.aging_columns].to_numpy()[0] if len(total_rows) else np.zeros(len(cls.aging_columns))
+
+        vendor_subtotals = aggregates[aggregates["is_total"] == 0].set_index("vendor_name")[cls.aging_columns]
+
+        return invoices, vendor_subtotals, totals
+
+    def generate(self, db: sa.orm.Session, user_id: str) -> pd.DataFrame:
+        if config.aging_report_sql_aggregation:
+            return self.apply_aggregated(*self.fetch_aggregated(db, user_id))
+        return self.apply(self.fetch_data(db, user_id))
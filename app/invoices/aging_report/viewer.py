@@ -0,0 +1,179 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from html import escape
+from typing import IO, Optional
+
+import requests
+from loguru import logger as log
+from starlette.concurrency import run_in_threadpool
+
+from app.invoices.config import config
+from app.invoices.models import PublicAgingReport
+from app.storage.backends import storage
+
+# Shared so repeated cache misses reuse connections
+http_session = requests.Session()
+
+# Cached in place of the html for reports over aging_report_html_max_rows so they aren't downloaded on every view
+TOO_LARGE_TO_RENDER = ""
+
+
+class ReportHtmlCache:
+    """Rendered aging report html keyed by report id - a bounded in memory LRU in front of a bounded disk cache.
+
+    The memory LRU is bounded by both entry count and the total size of the html it holds.
+    """
+
+    def __init__(
+        self, max_entries: int, directory: str = None, max_disk_entries: int = 1024, max_bytes: int = None
+    ) -> None:
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._directory = directory
+        self._max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, report_id: str) -> str:
+        return os.path.join(self._directory, f"{report_id}.html")
+
+    def get(self, report_id: str) -> Optional[str]:
+        with self._lock:
+            if report_id in self._entries:
+                self._entries.move_to_end(report_id)
+                return self._entries[report_id]
+
+        if not self._directory:
+            return None
+
+        try:
+            with open(self._path(report_id)) as f:
+                html = f.read()
+        except FileNotFoundError:
+            return None
+
+        self._remember(report_id, html)
+        return html
+
+    def set(self, report_id: str, html: str) -> None:
+        self._remember(report_id, html)
+
+        if not self._directory:
+            return
+
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            tmp_path = f"{self._path(report_id)}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(html)
+            os.replace(tmp_path, self._path(report_id))
+            self._evict_disk()
+        except OSError:
+            log.exception(f"Failed to cache aging report {report_id} on disk")
+
+    def _remember(self, report_id: str, html: str) -> None:
+        with self._lock:
+            previous = self._entries.pop(report_id, None)
+            if previous is not None:
+                self._num_bytes -= len(previous)
+            self._entries[report_id] = html
+            self._num_bytes += len(html)
+            while len(self._entries) > self._max_entries or (
+                self._max_bytes is not None and self._num_bytes > self._max_bytes and len(self._entries) > 1
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._num_bytes -= len(evicted)
+
+    def _evict_disk(self) -> None:
+        paths = [os.path.join(self._directory, name) for name in os.listdir(self._directory) if name.endswith(".html")]
+        if len(paths) <= self._max_disk_entries:
+            return
+
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: len(paths) - self._max_disk_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+report_html_cache = ReportHtmlCache(
+    config.aging_report_cache_size,
+    directory=config.aging_report_cache_dir or None,
+    max_disk_entries=config.aging_report_disk_cache_size,
+    max_bytes=config.aging_report_cache_bytes,
+)
+
+
+def render_report_html(csv_data: IO[str], max_rows: int) -> Optional[str]:
+    """Renders a generated aging report csv (including its title preamble) as an html table.
+
+    Reads the csv a row at a time so only the html is held in memory - returns None past `max_rows` rows.
+    """
+    reader = csv.reader(csv_data)
+    # Title preamble, then the blank line after it
+    next(reader, None)
+    next(reader, None)
+    columns = next(reader, None)
+    if columns is None:
+        return None
+
+    out = io.StringIO()
+    out.write('<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n')
+    for column in columns:
+        out.write(f"      <th>{escape(column)}</th>\n")
+    out.write("    </tr>\n  </thead>\n  <tbody>\n")
+
+    for num_rows, row in enumerate(reader, start=1):
+        if num_rows > max_rows:
+            return None
+        out.write("    <tr>\n")
+        for value in row:
+            out.write(f"      <td>{escape(value)}</td>\n")
+        out.write("    </tr>\n")
+
+    out.write("  </tbody>\n</table>")
+    return out.getvalue()
+
+
+def fetch_report_csv(csv_uri: str, fileobj: IO[bytes]) -> None:
+    with http_session.get(csv_uri, stream=True) as res:
+        res.raise_for_status()
+        res.raw.decode_content = True
+        shutil.copyfileobj(res.raw, fileobj)
+
+
+async def download_report_csv(csv_uri: str, fileobj: IO[bytes]) -> None:
+    """Streams the csv into fileobj via the storage backend - plain http for reports it doesn't manage"""
+    key = storage.key_from_uri(csv_uri)
+    if key is None:
+        await run_in_threadpool(fetch_report_csv, csv_uri, fileobj)
+    else:
+        await storage.download_fileobj_async(key, fileobj)
+
+
+async def get_report_html(report: PublicAgingReport) -> Optional[str]:
+    """Serves the rendered report from cache, rendering it on first view - None if it's too large to show.
+
+    A miss spools the csv to a temp file and renders it off of the event loop, so neither the download nor the
+    parse holds the whole report in memory.
+    """
+    html = report_html_cache.get(report.id)
+    if html is None:
+        with tempfile.TemporaryFile() as csv_file:
+            await download_report_csv(report.csv_uri, csv_file)
+            csv_file.seek(0)
+            with io.TextIOWrapper(csv_file, encoding="utf8", newline="") as csv_text:
+                html = await run_in_threadpool(render_report_html, csv_text, config.aging_report_html_max_rows)
+        if html is None:
+            log.info(f"Aging report {report.id} is too large to render, offering the csv only")
+            html = TOO_LARGE_TO_RENDER
+        report_html_cache.set(report.id, html)
+
+    return html or None
@@ -0,0 +1,125 @@
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+from typing import IO, Iterator, List
+
+import sqlalchemy as sa
+import ulid
+
+from app.db.models import AgingReport, Invoice
+from app.db.session import SessionLocal
+from app.invoices.config import config
+from app.invoices.models import format_amount
+from app.invoices.s3_utils import upload_string_to_s3
+from app.storage.backends import storage
+
+from .processor import AgingReportProcessor
+
+STREAM_BATCH_SIZE = 1000
+
+
+def _format_total(v: Decimal) -> str:
+    return f"{v:.2f}"
+
+
+def iter_aging_report_rows(db: sa.orm.Session, user_id: str, now: datetime = None) -> Iterator[List]:
+    """Yields the aging report row by row - same layout as AgingReportProcessor.apply, header first.
+
+    Invoices stream from a server side cursor grouped by vendor (vendors ordered by their first invoice) so only
+    the current vendor's subtotals are held in memory.
+    """
+    now = now or datetime.utcnow()
+    aging_columns = AgingReportProcessor.aging_columns
+    num_columns = len(AgingReportProcessor.columns)
+
+    bucket = sa.case(
+        *[(Invoice.due_date <= now + edge, idx) for idx, edge in enumerate(AgingReportProcessor.aging_edges)],
+        else_=len(AgingReportProcessor.aging_edges),
+    )
+    # NULL and empty vendor names are one section, as in fetch_data
+    vendor_name = sa.func.coalesce(Invoice.vendor_name, sa.literal_column("''"))
+    # Vendors come in order of their first invoice by (due_date, id), like the sections fetch_data builds
+    vendor_window = dict(partition_by=vendor_name, order_by=(Invoice.due_date, Invoice.id))
+    first_due_date = sa.func.first_value(Invoice.due_date).over(**vendor_window)
+    first_id = sa.func.first_value(Invoice.id).over(**vendor_window)
+
+    rows = (
+        db.query(
+            vendor_name.label("vendor_name"),
+            Invoice.invoice_id,
+            Invoice.due_date,
+            Invoice.amount_due,
+            bucket.label("bucket"),
+        )
+        .filter(Invoice.user_id == user_id)
+        .filter(Invoice.is_paid == False)
+        .filter(Invoice.due_date >= datetime.today())  # TODO: use timezone?
+        .order_by(first_due_date, first_id, Invoice.due_date, Invoice.id)
+        .yield_per(STREAM_BATCH_SIZE)
+    )
+
+    yield AgingReportProcessor.columns
+
+    totals = [Decimal(0)] * len(aging_columns)
+    subtotals = None
+    current_vendor = None
+
+    for row in rows:
+        vendor_name = row.vendor_name
+        if subtotals is None or vendor_name != current_vendor:
+            if subtotals is not None:
+                yield ["", "subtotals:"] + [_format_total(v) for v in subtotals]
+                yield [""] * num_columns
+            current_vendor = vendor_name
+            subtotals = [Decimal(0)] * len(aging_columns)
+            yield [vendor_name] + [" "] * (num_columns - 1)
+
+        amount = row.amount_due or Decimal(0)
+        subtotals[row.bucket] += amount
+        totals[row.bucket] += amount
+
+        bucket_values = [0] * len(aging_columns)
+        bucket_values[row.bucket] = f"{format_amount(row.amount_due)}"
+        yield [row.invoice_id or "", row.due_date.strftime("%m/%d/%Y")] + bucket_values
+
+    if subtotals is not None:
+        yield ["", "subtotals:"] + [_format_total(v) for v in subtotals]
+        yield [""] * num_columns
+
+    yield ["", "Totals:"] + [_format_total(v) for v in totals]
+
+
+def write_aging_report_csv(db: sa.orm.Session, user_id: str, sink: IO[str]) -> None:
+    """Writes the aging report csv (with its title preamble) to any file like object one row at a time"""
+    sink.write(f'{datetime.utcnow().strftime("%m/%d/%Y")} - Accounts Payable Aging Report,\n,\n')
+    writer = csv.writer(sink, lineterminator="\n")
+    for row in iter_aging_report_rows(db, user_id):
+        writer.writerow(row)
+
+
+def create_aging_report(user_id: str) -> AgingReport:
+    """Generates, uploads and saves a new aging report - html for the viewer is rendered on first view. Blocking."""
+    with SessionLocal() as db:
+        report_id = str(ulid.ulid())
+        filename = f"aging-report-{datetime.utcnow()}-{report_id}"
+
+        if config.aging_report_streaming:
+            with storage.open_writer(f"{filename}.csv") as sink:
+                write_aging_report_csv(db, user_id, sink)
+            s3_uri = sink.uri
+        else:
+            df = AgingReportProcessor().generate(db, user_id)
+
+            # Convert DF to buffer and save to S3
+            stream = io.StringIO()
+            stream.write(f'{datetime.utcnow().strftime("%m/%d/%Y")} - Accounts Payable Aging Report,\n,\n')
+            df.to_csv(stream, index=False)
+            s3_uri = upload_string_to_s3(stream.getvalue(), filename, "csv", content_type="text/csv")
+
+        # Save report
+        new_report = AgingReport(id=report_id, user_id=user_id, csv_uri=s3_uri)
+        db.add(new_report)
+        db.commit()
+        db.refresh(new_report)
+        return new_report
@@ -0,0 +1,66 @@
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+import sqlalchemy as sa
+from dateutil.relativedelta import relativedelta
+from fastapi.exceptions import HTTPException
+from pydantic import BaseModel
+
+from .db_utils import get_invoices_due_between
+from .models import PublicInvoice
+
+
+class CalendarDay(BaseModel):
+    year: int
+    month: int
+    day: int
+    active: bool
+    invoices_due: List[PublicInvoice] = []
+
+
+def resolve_calendar_month(year: int = None, month: int = None, next: bool = False, previous: bool = False) -> datetime:
+    """Builds the first day of the month to display from the calendar query params - defaults to now"""
+    # Validate combindations
+    if next and previous:
+        raise HTTPException(400, "Can't specify previous and next.")
+
+    if not (month and year):
+        month = datetime.utcnow().month
+        year = datetime.utcnow().year
+    current_dt = datetime(year, month, 1)
+
+    # Make adjustments if indicated
+    if next:
+        current_dt = current_dt + relativedelta(months=1)
+    if previous:
+        current_dt = current_dt - relativedelta(months=1)
+
+    return current_dt
+
+
+def load_calendar_month(db: sa.orm.Session, user_id: str, year: int, month: int) -> List[CalendarDay]:
+    """Loads every invoice due in the visible calendar range with a single query and buckets them by day"""
+    calendar_view = calendar.Calendar(firstweekday=6)
+    visible_dates = list(calendar_view.itermonthdates(year, month))
+
+    # Half open range so invoices due at any time on the last visible day are included
+    start = datetime.combine(visible_dates[0], datetime.min.time())
+    end = datetime.combine(visible_dates[-1] + timedelta(days=1), datetime.min.time())
+    invoices = get_invoices_due_between(db, user_id, start, end)
+
+    invoices_by_date: Dict[date, List[PublicInvoice]] = defaultdict(list)
+    for invoice in invoices:
+        invoices_by_date[invoice.due_date.date()].append(PublicInvoice.from_orm(invoice))
+
+    return [
+        CalendarDay(
+            year=d.year,
+            month=d.month,
+            day=d.day,
+            active=month == d.month,
+            invoices_due=invoices_by_date.get(d, []),
+        )
+        for d in visible_dates
+    ]
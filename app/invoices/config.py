@@ -2,7 +2,67 @@ from pydantic import BaseSettings
 
 
 class InvoiceSettings(BaseSettings):
-    s3_bucket_name: str = "aap-invoice-images"
+    ocr_cache_dir: str = ".ocr_cache"  # empty string disables the OCR result cache
+    ocr_page_concurrency: int = 4  # concurrent Textract calls per multi-page invoice
+
+    # Aging reports - bucket and subtotal in Postgres rather than in pandas
+    aging_report_sql_aggregation: bool = True
+    # Stream the csv row by row from a server side cursor straight into a multipart upload
+    aging_report_streaming: bool = True
+    # Rendered report html - entries held in memory and on disk, empty dir disables the disk cache
+    aging_report_cache_size: int = 64
+    aging_report_cache_bytes: int = 32 * 1024 * 1024  # total html held in memory
+    # Larger reports aren't rendered in the viewer, only offered as a csv download
+    aging_report_html_max_rows: int = 5000
+    aging_report_cache_dir: str = ".aging_report_cache"
+    aging_report_disk_cache_size: int = 1024
+
+    # PDF rasterization
+    pdf_dpi: int = 150
+    rasterize_workers: int = 4
+
+    # Image derivatives - downscaled copies stored next to each invoice image
+    derivative_format: str = "webp"  # "webp" or "jpeg"
+    derivative_quality: int = 80
+    thumbnail_max_size: int = 320  # px along the longest side
+    preview_max_size: int = 1280  # px along the longest side
+    derivative_workers: int = 2
+    # Invoices stored before derivatives existed are filled in by a background thread, 0 disables it
+    derivative_backfill_batch_size: int = 20
+    derivative_backfill_interval: float = 1.0  # seconds between batches
+    derivative_claim_timeout: int = 600  # seconds before a claimed batch is considered abandoned
+
+    # Background ingestion (rasterize -> OCR -> upload -> save)
+    ingestion_workers: int = 2
+    ingestion_executor: str = "thread"  # "thread" or "process"
+    ingestion_poll_interval: float = 2.0  # seconds
+    # Seconds without a heartbeat before a processing job is considered abandoned and requeued. Heartbeats are sent
+    # every ingestion_maintenance_interval, so keep this several times larger
+    ingestion_job_timeout: int = 600
+    ingestion_max_attempts: int = 3  # claims before a job that keeps getting abandoned is failed
+    # Direct uploads never completed within this many seconds are failed and their objects deleted - keep it above
+    # the storage presigned_url_expires_in so an upload can't land after its job was swept
+    direct_upload_timeout: int = 2 * 60 * 60
+    ingestion_maintenance_interval: float = 60  # seconds between heartbeats and sweeps for abandoned jobs
+
+    # Bulk uploads
+    bulk_upload_concurrency: int = 8  # max files being OCR'd (and held in memory) at once
+    # Limits on each uploaded .zip, checked against its directory before anything is decompressed
+    bulk_upload_max_zip_entries: int = 500
+    bulk_upload_max_zip_bytes: int = 500 * 1024 * 1024  # total uncompressed size
+    bulk_insert_batch_size: int = 50
+    bulk_operation_max_ids: int = 1000  # invoices per bulk paid/categorize/delete request
+
+    # Dashboard stats - how often invoice_stats is recomputed from invoices to catch drift, 0 disables
+    invoice_stats_reconcile_interval: float = 3600  # seconds
+
+    # How far before `since` invoice deltas start - updated_on is a transaction's start time, so an edit that commits
+    # after a client's poll can carry an earlier timestamp. Should exceed the longest invoice write transaction
+    invoice_delta_overlap: int = 300  # seconds
+
+    # Invoice change feed long polling
+    change_feed_poll_interval: float = 1.0  # seconds between checks while a consumer waits
+    change_feed_max_wait: float = 30.0  # seconds
 
     class Config:
         env_file = ".env"
@@ -1,55 +1,284 @@
-from datetime import date, datetime
-from typing import List, Optional
+import base64
+import binascii
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple, Type, Union)
 from unicodedata import name
 
 import sqlalchemy as sa
+import ulid
+from loguru import logger as log
+from result import Err, Ok, Result
 from sqlalchemy import asc, desc
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import InstrumentedAttribute, Load, Session, selectinload
 from sqlalchemy.sql.expression import func
 
+from app.db.cache import create_cache
+from app.db.config import config as db_config
 from app.db.models import (AgingReport, Category, CategoryInvoiceAssociation,
-                           Invoice, Vendor)
-from app.users.db_utils import get_user_by_id
+                           IngestionJob, Invoice, InvoiceChange, InvoiceStats,
+                           Vendor)
+from app.db.pagination import (InvalidCursor, apply_keyset, decode_cursor,
+                               encode_cursor)
+from app.users.db_utils import get_organization_id_by_user_id
 
-from .models import CreateInvoice
+from .models import (BulkInvoiceStatusEnum, CreateInvoice, InvoiceChangeEnum,
+                     PublicInvoice)
+from .serializers import PUBLIC_INVOICE_COLUMNS, PublicInvoiceRowSerializer
 
+# updated_on is only set once a row has been edited
+invoice_modified_on = func.coalesce(Invoice.updated_on, Invoice.created_on)
 
-def get_invoice_by_id(db: Session, invoice_id: str) -> Optional[Invoice]:
-    return db.query(Invoice).filter_by(id=invoice_id).first()
+# Everything PublicInvoice.from_orm touches beyond the invoice row itself - two extra queries per page
+# instead of two lazy loads per invoice
+PUBLIC_INVOICE_LOAD_OPTIONS = (selectinload(Invoice.category_links).selectinload(CategoryInvoiceAssociation.category),)
 
+# (user id, vendor name) -> vendor id. Vendors are never renamed or deleted, so once a name resolves it stays valid
+vendor_id_cache = create_cache("vendor_id_by_name", db_config.id_cache_size, db_config.id_cache_ttl)
 
-def ensure_vendor_by_name(db: sa.orm.Session, vendor_name: str, user_id: str) -> Vendor:
-    # TODO: proper upsert? And need to set organization id.
-    existing = db.query(Vendor).filter_by(name=vendor_name, user_id=user_id).first()
-    if existing:
-        return existing
 
-    new = Vendor(
-        name=vendor_name,
-        user_id=user_id,
-    )
+def get_invoice_by_id(db: Session, invoice_id: str, options: Sequence[Load] = ()) -> Optional[Invoice]:
+    return db.query(Invoice).options(*options).filter_by(id=invoice_id).first()
+
+
+def get_invoice_image_uri(db: Session, invoice_id: str) -> Optional[str]:
+    return db.query(Invoice.image_uri).filter_by(id=invoice_id).scalar()
+
+
+def claim_invoices_missing_derivatives(db: Session, limit: int, timeout: timedelta) -> List[Row]:
+    """Claims up to `limit` invoices without thumbnails, newest first, and returns their (id, image_uri).
 
-    db.add(new)
+    Commits straight away so no row lock is held while the images are rendered - the claim itself is what keeps
+    other processes off these rows, until it's older than `timeout` and assumed abandoned. updated_on is left as
+    is since nothing a client sees has changed yet.
+    """
+    claimable = (
+        sa.select(Invoice.id)
+        .where(
+            Invoice.thumbnail_uri.is_(None),
+            Invoice.image_uri.isnot(None),
+            sa.or_(
+                Invoice.derivatives_claimed_on.is_(None),
+                Invoice.derivatives_claimed_on < datetime.utcnow() - timeout,
+            ),
+        )
+        .order_by(Invoice.created_on.desc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(
+        sa.update(Invoice)
+        .where(Invoice.id.in_(claimable))
+        .values(derivatives_claimed_on=datetime.utcnow(), updated_on=Invoice.updated_on)
+        .returning(Invoice.id, Invoice.image_uri)
+        .execution_options(synchronize_session=False)
+    ).all()
     db.commit()
-    db.refresh(new)
-    return new
+    return rows
+
+
+def set_invoice_derivatives(db: Session, invoice_id: str, thumbnail_uri: str, preview_uri: str) -> None:
+    """Records derivatives made after the invoice was saved - doesn't commit.
+
+    Only fills in missing ones. updated_on is bumped since the uris are part of the public invoice, so ETags change
+    and delta pollers pick them up.
+    """
+    db.execute(
+        sa.update(Invoice)
+        .where(Invoice.id == invoice_id, Invoice.thumbnail_uri.is_(None))
+        .values(thumbnail_uri=thumbnail_uri, preview_uri=preview_uri)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_invoice_by_content_hash(
+    db: Session, user_id: str, organization_id: Optional[str], content_hash: str
+) -> Optional[Invoice]:
+    """An invoice already stored for this file - within the organization, or the user's own without one"""
+    query = db.query(Invoice).filter_by(content_hash=content_hash)
+    if organization_id:
+        return query.filter_by(organization_id=organization_id).first()
+    return query.filter_by(user_id=user_id, organization_id=None).first()
+
+
+def upsert_ids_by_name(
+    db: Session, model: Type[Union[Vendor, Category]], user_id: str, names: Iterable[str], **values
+) -> Dict[str, str]:
+    """Maps each name to the id of the user's row with that name, inserting whichever are missing.
+
+    One INSERT ... ON CONFLICT (user_id, name) DO NOTHING RETURNING statement, unioned with a select of the
+    rows that already existed. Doesn't commit. A row inserted by a concurrent transaction after this one's
+    snapshot is neither returned nor visible in the union, so those names are looked up again afterwards.
+    """
+    names = list(dict.fromkeys(n for n in names if n is not None))
+    if not names:
+        return {}
+
+    inserted = (
+        pg_insert(model)
+        .values([{"id": ulid.ulid(), "user_id": user_id, "name": name, **values} for name in names])
+        .on_conflict_do_nothing(index_elements=[model.user_id, model.name])
+        .returning(model.id, model.name)
+        .cte("inserted")
+    )
+    select_existing = sa.select(model.id, model.name).where(model.user_id == user_id)
+    ids = {
+        name: id
+        for id, name in db.execute(
+            sa.select(inserted.c.id, inserted.c.name).union_all(select_existing.where(model.name.in_(names)))
+        )
+    }
+
+    missing = [name for name in names if name not in ids]
+    if missing:
+        ids.update({name: id for id, name in db.execute(select_existing.where(model.name.in_(missing)))})
+    return ids
+
+
+def ensure_vendor_ids_by_name(
+    db: Session, user_id: str, vendor_names: Iterable[Optional[str]], organization_id: str = None
+) -> Dict[Optional[str], str]:
+    """Resolves many vendor names for a user to vendor ids in one statement, creating missing vendors
+
+    Names in vendor_id_cache skip the database entirely. Ids are only cached by remember_vendor_ids once the
+    transaction that resolved them commits, so a rolled back insert never leaves a dangling id behind.
+    """
+    ids: Dict[Optional[str], str] = {}
+    missing: List[Optional[str]] = []
+    for vendor_name in dict.fromkeys(vendor_names):
+        vendor_id = vendor_id_cache.get((user_id, vendor_name))
+        if vendor_id is None:
+            missing.append(vendor_name)
+        else:
+            ids[vendor_name] = vendor_id
+    if not missing:
+        return ids
+
+    ids.update(upsert_ids_by_name(db, Vendor, user_id, missing, organization_id=organization_id, aliases=[]))
+
+    # NULL names never conflict so invoices without a vendor name share one vendor the old fashioned way
+    if None in missing:
+        unnamed = db.query(Vendor).filter_by(name=None, user_id=user_id).first()
+        if not unnamed:
+            unnamed = Vendor(user_id=user_id, organization_id=organization_id)
+            db.add(unnamed)
+            db.flush()
+        ids[None] = unnamed.id
+    return ids
+
+
+def remember_vendor_ids(user_id: str, vendor_ids: Dict[Optional[str], str]) -> None:
+    """Caches ids from ensure_vendor_ids_by_name - only call once they're committed"""
+    for vendor_name, vendor_id in vendor_ids.items():
+        vendor_id_cache.set((user_id, vendor_name), vendor_id)
+
+
+def forget_vendor_ids(user_id: str, vendor_names: Iterable[Optional[str]]) -> None:
+    for vendor_name in vendor_names:
+        vendor_id_cache.invalidate((user_id, vendor_name))
+
+
+@contextmanager
+def caching_vendor_ids(vendor_ids_by_user: Dict[str, Dict[Optional[str], str]]) -> Iterator[None]:
+    """Wraps writing and committing invoices - caches the vendor ids they used once the block succeeds
+
+    A cached id whose vendor has gone missing (deleted by hand, restored backup) fails the invoice insert's
+    foreign key, so on integrity errors those entries are dropped and the next attempt resolves them again.
+    """
+    try:
+        yield
+    except sa.exc.IntegrityError:
+        for user_id, vendor_ids in vendor_ids_by_user.items():
+            forget_vendor_ids(user_id, vendor_ids)
+        raise
+
+    for user_id, vendor_ids in vendor_ids_by_user.items():
+        remember_vendor_ids(user_id, vendor_ids)
 
 
 def save_invoice(db: Session, invoice: CreateInvoice) -> Invoice:
     """Saves invoice - ensures vendor exists and sets orgnaization id that corresponds to user creating the invoice"""
     db_invoice = invoice.to_orm()
-    db_vendor = ensure_vendor_by_name(db, db_invoice.vendor_name, invoice.user_id)
-    db_invoice.vendor_id = db_vendor.id
+    organization_id = get_organization_id_by_user_id(db, invoice.user_id)
+    db_invoice.organization_id = organization_id
 
-    user = get_user_by_id(db, invoice.user_id)
-    db_invoice.organization_id = user.organization_id
+    vendor_ids = ensure_vendor_ids_by_name(
+        db, invoice.user_id, [db_invoice.vendor_name], organization_id=organization_id
+    )
+    db_invoice.vendor_id = vendor_ids[db_invoice.vendor_name]
 
-    db.add(db_invoice)
-    db.commit()
+    with caching_vendor_ids({invoice.user_id: vendor_ids}):
+        db.add(db_invoice)
+        db.flush()
+        bump_invoice_stats(db, db_invoice.user_id, **invoice_stats_delta(db_invoice))
+        record_invoice_change(
+            db, db_invoice.user_id, db_invoice.id, InvoiceChangeEnum.created, invoice_change_data(db_invoice)
+        )
+        db.commit()
     db.refresh(db_invoice)
     return db_invoice
 
 
+def save_invoices(db: Session, invoices: List[CreateInvoice]) -> List[Result[Invoice, str]]:
+    """Saves many invoices in a single transaction - vendors and organization ids are resolved once per user
+
+    Each invoice is inserted under its own savepoint so one that fails (a content hash saved concurrently, a
+    value the column rejects) only fails itself. Returns the saved invoice or the error for each, in order.
+    """
+    db_invoices = [invoice.to_orm() for invoice in invoices]
+
+    invoices_by_user: Dict[str, List[Invoice]] = defaultdict(list)
+    for db_invoice in db_invoices:
+        invoices_by_user[db_invoice.user_id].append(db_invoice)
+
+    vendor_ids_by_user: Dict[str, Dict[Optional[str], str]] = {}
+    for user_id, user_invoices in invoices_by_user.items():
+        organization_id = get_organization_id_by_user_id(db, user_id)
+        vendor_ids = ensure_vendor_ids_by_name(
+            db, user_id, [i.vendor_name for i in user_invoices], organization_id=organization_id
+        )
+        vendor_ids_by_user[user_id] = vendor_ids
+        for db_invoice in user_invoices:
+            db_invoice.organization_id = organization_id
+            db_invoice.vendor_id = vendor_ids[db_invoice.vendor_name]
+
+    results: List[Result[Invoice, str]] = []
+    saved: List[Invoice] = []
+    # A failure may come from a cached vendor id that no longer exists - see caching_vendor_ids
+    failed_user_ids = set()
+    for db_invoice in db_invoices:
+        try:
+            with db.begin_nested():
+                db.add(db_invoice)
+                db.flush()
+        except sa.exc.DBAPIError as e:
+            log.warning(f"Failed to save an invoice for user {db_invoice.user_id}: {e.orig}")
+            failed_user_ids.add(db_invoice.user_id)
+            results.append(Err(str(e.orig)))
+            continue
+        saved.append(db_invoice)
+        results.append(Ok(db_invoice))
+
+    for user_id, delta in sum_invoice_stats_deltas(saved).items():
+        bump_invoice_stats(db, user_id, **delta)
+    for db_invoice in saved:
+        record_invoice_change(
+            db, db_invoice.user_id, db_invoice.id, InvoiceChangeEnum.created, invoice_change_data(db_invoice)
+        )
+    db.commit()
+
+    for user_id, vendor_ids in vendor_ids_by_user.items():
+        if user_id in failed_user_ids:
+            forget_vendor_ids(user_id, vendor_ids)
+        else:
+            remember_vendor_ids(user_id, vendor_ids)
+    return results
+
+
 def query_invoices(
     db: Session,
     *,
@@ -63,6 +292,10 @@ def query_invoices(
     due_date: datetime = None,
     due_after: datetime = None,
     due_before: datetime = None,
+    modified_after: datetime = None,
+    cursor: str = None,
+    options: Sequence[Load] = (),
+    columns: Sequence[sa.sql.ColumnElement] = None,
 ) -> List[Invoice]:
     """Retrieves invoices from db
 
@@ -74,6 +307,12 @@ def query_invoices(
         desc (bool, optional): Indicates if results should be sorted in a desc fashion or not (i.e. asc). Defaults to False.
         limit (int, optional): Max number of results to be returned. Defaults to 100.
         offset (int, optional): Offset to allow for pagination. Defaults to 0.
+        modified_after (datetime, optional): Only invoices created or updated after this time.
+        cursor (str, optional): Opaque cursor from invoice_page_cursor - seeks past the previous page instead of
+            using offset. Must be used with the same order_by and desc it was issued for.
+        options (Sequence[Load], optional): Loader options applied to the query - pass PUBLIC_INVOICE_LOAD_OPTIONS
+            when the results will be serialized with PublicInvoice.from_orm.
+        columns (Sequence[ColumnElement], optional): Select these columns as plain rows instead of Invoice objects.
 
     NOTE: Either one of or both of vendor_id and user_id must be provided
 
@@ -83,7 +322,7 @@ def query_invoices(
     if not user_id and not vendor_id:
         raise Exception("At least on of user_id and vendor_id must be provided")
 
-    invoices_query = db.query(Invoice)
+    invoices_query = db.query(*columns) if columns else db.query(Invoice).options(*options)
 
     if user_id:
         invoices_query = invoices_query.filter_by(user_id=user_id)
@@ -107,19 +346,35 @@ def query_invoices(
     if due_before:
         invoices_query = invoices_query.filter(Invoice.due_date <= due_before)
 
+    if modified_after:
+        invoices_query = invoices_query.filter(invoice_modified_on > modified_after)
+
     try:
         order_by_stmt = getattr(Invoice, order_by)
     except AttributeError as e:
         return []
 
-    if desc:
-        order_by_stmt = sa.desc(order_by_stmt)
+    if cursor:
+        after = decode_cursor(cursor, order_by_stmt, order_by, desc)
+        invoices_query = apply_keyset(invoices_query, order_by_stmt, Invoice.id, desc, after=after)
+    else:
+        invoices_query = apply_keyset(invoices_query, order_by_stmt, Invoice.id, desc).offset(offset)
 
-    invoices_query = invoices_query.order_by(order_by_stmt)
-    invoices_query = invoices_query.limit(limit).offset(offset)
+    invoices_query = invoices_query.limit(limit)
     return invoices_query.all()
 
 
+def invoice_page_cursor(invoices: List[Invoice], order_by: str, desc: bool, limit: Optional[int]) -> Optional[str]:
+    """Returns the cursor for the page after `invoices`, or None if this was the last page
+
+    Works on Invoice objects or rows that include the order_by column.
+    """
+    if not limit or len(invoices) < limit:
+        return None
+    last = invoices[-1]
+    return encode_cursor(order_by, desc, getattr(last, order_by), last.id)
+
+
 def get_invoices_by_user(
     db: Session,
     user_id: str,
@@ -129,6 +384,10 @@ def get_invoices_by_user(
     offset: int = 0,
     desc: bool = False,
     due_after: datetime = None,
+    modified_after: datetime = None,
+    cursor: str = None,
+    options: Sequence[Load] = (),
+    columns: Sequence[sa.sql.ColumnElement] = None,
 ) -> List[Invoice]:
     return query_invoices(
         db,
@@ -139,40 +398,217 @@ def get_invoices_by_user(
         offset=offset,
         desc=desc,
         due_after=due_after,
+        modified_after=modified_after,
+        cursor=cursor,
+        options=options,
+        columns=columns,
     )
 
 
+def get_invoices_version(db: Session, user_id: str) -> Tuple[int, Optional[datetime]]:
+    """Count and latest modification time of a user's invoices - changes whenever one is added, edited or deleted"""
+    return tuple(db.query(func.count(Invoice.id), func.max(invoice_modified_on)).filter_by(user_id=user_id).one())
+
+
+def touch_invoice(db: Session, invoice_id: str) -> None:
+    """Bumps updated_on for changes that live outside the invoices row (e.g. categories) - doesn't commit"""
+    db.query(Invoice).filter_by(id=invoice_id).update({"updated_on": func.now()}, synchronize_session=False)
+
+
+def get_invoices_due_between(db: Session, user_id: str, start: datetime, end: datetime) -> List[Invoice]:
+    """Retrieves every invoice due in [start, end) with categories eager loaded - used by the calendar"""
+    return (
+        db.query(Invoice)
+        .options(*PUBLIC_INVOICE_LOAD_OPTIONS)
+        .filter_by(user_id=user_id)
+        .filter(Invoice.due_date >= start)
+        .filter(Invoice.due_date < end)
+        .order_by(Invoice.due_date)
+        .all()
+    )
+
+
+def load_public_invoice(db: Session, invoice_id: str) -> Optional[PublicInvoice]:
+    invoice = get_invoice_by_id(db, invoice_id, options=PUBLIC_INVOICE_LOAD_OPTIONS)
+    if not invoice:
+        return None
+    return PublicInvoice.from_orm(invoice)
+
+
+def load_public_invoice_page(
+    db: Session, user_id: str, *, order_by: str = "due_date", desc: bool = False, limit: int = 100, **kwargs
+) -> Tuple[Dict[str, Dict], Optional[str]]:
+    """Serializes a page of a user's invoices keyed by id along with the next page's cursor
+
+    Selects plain rows and serializes them with PublicInvoiceRowSerializer - same output as PublicInvoice.from_orm.
+    Accepts the same kwargs as get_invoices_by_user.
+    """
+    columns = PUBLIC_INVOICE_COLUMNS
+    if order_by not in {c.key for c in columns} and isinstance(getattr(Invoice, order_by, None), InstrumentedAttribute):
+        # The cursor needs the sort key of the last row
+        columns = (*columns, getattr(Invoice, order_by))
+
+    rows = get_invoices_by_user(db, user_id, order_by=order_by, desc=desc, limit=limit, columns=columns, **kwargs)
+    next_cursor = invoice_page_cursor(rows, order_by, desc, limit)
+    categories = get_category_names_by_invoice_id(db, [row.id for row in rows])
+    return {i["id"]: i for i in PublicInvoiceRowSerializer().serialize_many(rows, categories)}, next_cursor
+
+
+def get_category_names_by_invoice_id(db: Session, invoice_ids: List[str]) -> Dict[str, str]:
+    """Maps each invoice to a category name - one per invoice like PublicInvoice.from_orm's category_links[0]"""
+    if not invoice_ids:
+        return {}
+
+    rows = (
+        db.query(CategoryInvoiceAssociation.invoice_id, Category.name)
+        .join(Category, CategoryInvoiceAssociation.category_id == Category.id)
+        .filter(CategoryInvoiceAssociation.invoice_id.in_(invoice_ids))
+    )
+    names = {}
+    for invoice_id, name in rows:
+        names.setdefault(invoice_id, name)
+    return names
+
+
 def update_paid_status_invoice(db: Session, invoice_id: str, is_paid: bool) -> Invoice:
-    invoice = get_invoice_by_id(db, invoice_id)
+    # Row lock so two concurrent flips can't both move the invoice between the paid and unpaid stats
+    invoice = db.query(Invoice).filter_by(id=invoice_id).with_for_update().first()
     if not invoice:
         raise ValueError("Could not find Invoice with provided Invoice.id")
-    invoice.is_paid = is_paid
+
+    if bool(invoice.is_paid) != is_paid:
+        bump_invoice_stats(db, invoice.user_id, **invoice_stats_delta(invoice, sign=-1))
+        invoice.is_paid = is_paid
+        bump_invoice_stats(db, invoice.user_id, **invoice_stats_delta(invoice))
+        record_invoice_change(db, invoice.user_id, invoice.id, InvoiceChangeEnum.paid_status, {"is_paid": is_paid})
+
     db.commit()
     return invoice
 
 
-def get_num_due_soon(db: sa.orm.Session, user_id: str) -> int:
-    return (
-        db.query(func.count(Invoice.id))
-        .filter_by(user_id=user_id, is_paid=False)
-        .filter(Invoice.due_date > datetime.utcnow())
-        .scalar()
-        or 0
+def invoice_stats_delta(invoice: Invoice, sign: int = 1) -> Dict[str, Any]:
+    """The change to its owner's invoice_stats row from adding (sign=1) or removing (sign=-1) an invoice"""
+    amount = (invoice.amount_due or 0) * sign
+    if invoice.is_paid:
+        return {"num_paid": sign, "amount_paid": amount}
+    return {"num_unpaid": sign, "amount_unpaid": amount}
+
+
+def sum_invoice_stats_deltas(invoices: List[Invoice], sign: int = 1) -> Dict[str, Dict[str, Any]]:
+    """Combines the stats deltas of many invoices into one delta per user"""
+    deltas: Dict[str, Dict[str, Any]] = defaultdict(lambda: defaultdict(int))
+    for invoice in invoices:
+        for k, v in invoice_stats_delta(invoice, sign=sign).items():
+            deltas[invoice.user_id][k] += v
+    return {user_id: dict(delta) for user_id, delta in deltas.items()}
+
+
+def bump_invoice_stats(
+    db: Session, user_id: str, *, num_paid: int = 0, num_unpaid: int = 0, amount_paid=0, amount_unpaid=0
+) -> None:
+    """Applies a delta to a user's invoice_stats row as an upsert.
+
+    Doesn't commit - call it inside the transaction that writes the invoices so the two can't diverge.
+    """
+    if not user_id:
+        return
+
+    values = {
+        "num_paid": num_paid,
+        "num_unpaid": num_unpaid,
+        "amount_paid": amount_paid,
+        "amount_unpaid": amount_unpaid,
+    }
+    stmt = pg_insert(InvoiceStats).values(user_id=user_id, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[InvoiceStats.user_id],
+        set_={**{k: getattr(InvoiceStats, k) + stmt.excluded[k] for k in values}, "updated_on": func.now()},
     )
+    db.execute(stmt)
 
 
-def get_num_overdue(db: sa.orm.Session, user_id: str) -> int:
-    return (
-        db.query(func.count(Invoice.id))
-        .filter_by(user_id=user_id, is_paid=False)
-        .filter(Invoice.due_date < datetime.utcnow())
-        .scalar()
-        or 0
+def get_invoice_stats(db: Session, user_id: str) -> Optional[InvoiceStats]:
+    return db.query(InvoiceStats).filter_by(user_id=user_id).first()
+
+
+def reconcile_invoice_stats(db: Session) -> int:
+    """Recomputes every invoice_stats row from the invoices table and returns how many rows had drifted
+
+    Catches anything the incremental updates missed - writes outside db_utils, manual fixes, races.
+    """
+    paid = sa.func.coalesce(Invoice.is_paid, False)
+    amount = sa.func.coalesce(Invoice.amount_due, 0)
+    actual = (
+        db.query(
+            Invoice.user_id.label("user_id"),
+            func.count(Invoice.id).filter(paid).label("num_paid"),
+            func.count(Invoice.id).filter(sa.not_(paid)).label("num_unpaid"),
+            sa.func.coalesce(func.sum(amount).filter(paid), 0).label("amount_paid"),
+            sa.func.coalesce(func.sum(amount).filter(sa.not_(paid)), 0).label("amount_unpaid"),
+        )
+        .filter(Invoice.user_id.isnot(None))
+        .group_by(Invoice.user_id)
+        .subquery()
+    )
+    columns = ("num_paid", "num_unpaid", "amount_paid", "amount_unpaid")
+
+    # Rows whose user no longer has invoices are zeroed rather than deleted
+    drifted = (
+        db.query(
+            InvoiceStats.user_id,
+            *[sa.func.coalesce(actual.c[k], 0).label(k) for k in columns],
+        )
+        .outerjoin(actual, actual.c.user_id == InvoiceStats.user_id)
+        .filter(sa.or_(*[InvoiceStats.__table__.c[k] != sa.func.coalesce(actual.c[k], 0) for k in columns]))
+    )
+    missing = (
+        db.query(actual)
+        .outerjoin(InvoiceStats, InvoiceStats.user_id == actual.c.user_id)
+        .filter(InvoiceStats.user_id.is_(None))
     )
 
+    rows = drifted.all() + missing.all()
+    for row in rows:
+        stmt = pg_insert(InvoiceStats).values(**row._asdict())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[InvoiceStats.user_id],
+            set_={**{k: stmt.excluded[k] for k in columns}, "updated_on": func.now()},
+        )
+        db.execute(stmt)
 
-def get_num_paid(db: sa.orm.Session, user_id: str) -> int:
-    return db.query(func.count(Invoice.id)).filter_by(user_id=user_id, is_paid=True).scalar() or 0
+    db.commit()
+    return len(rows)
+
+
+def get_dashboard_counters(db: Session, user_id: str, now: datetime = None) -> Dict[str, Any]:
+    """Every dashboard counter and total for a user.
+
+    Paid/unpaid totals come from the invoice_stats row. Due soon vs overdue depends on the current time so
+    it can't be kept incrementally - that's one conditional aggregation over the user's unpaid invoices,
+    which is an index range scan on ix_invoices_user_id_is_paid_due_date_id.
+    """
+    now = now or datetime.utcnow()
+    due_soon = Invoice.due_date > now
+    overdue = Invoice.due_date < now
+    unpaid = (
+        db.query(
+            func.count(Invoice.id).filter(due_soon).label("num_due_soon"),
+            func.count(Invoice.id).filter(overdue).label("num_overdue"),
+            sa.func.coalesce(func.sum(Invoice.amount_due).filter(due_soon), 0).label("amount_due_soon"),
+            sa.func.coalesce(func.sum(Invoice.amount_due).filter(overdue), 0).label("amount_overdue"),
+        )
+        .filter_by(user_id=user_id, is_paid=False)
+        .one()
+    )
+
+    stats = get_invoice_stats(db, user_id)
+    return {
+        **unpaid._asdict(),
+        "num_paid": stats.num_paid if stats else 0,
+        "num_unpaid": stats.num_unpaid if stats else 0,
+        "amount_paid": stats.amount_paid if stats else 0,
+        "amount_unpaid": stats.amount_unpaid if stats else 0,
+    }
 
 
 def get_invoice_links_by_category_name(db: sa.orm.Session, name: str, user_id: str) -> List[CategoryInvoiceAssociation]:
@@ -186,29 +622,13 @@ def get_category_by_name(db: sa.orm.Session, name: str, user_id: str) -> Optiona
     return db.query(Category).filter_by(user_id=user_id, name=name).first()
 
 
-# TODO: Gotta do these upserts right
 # TODO: user_id should translate to organization id
 def ensure_category_by_name(db: sa.orm.Session, name: str, user_id: str, commit: bool = True) -> Category:
     name = name.strip()
-
-    existing = db.query(Category).filter_by(name=name, user_id=user_id).first()
-    if existing:
-        return existing
-
-    new = Category(
-        name=name,
-        user_id=user_id,
-    )
-
-    db.add(new)
-
+    category_id = upsert_ids_by_name(db, Category, user_id, [name])[name]
     if commit:
         db.commit()
-    else:
-        db.flush()
-
-    db.refresh(new)
-    return new
+    return db.query(Category).get(category_id)
 
 
 def get_category_link_by_invoice_id_and_name(
@@ -237,6 +657,8 @@ def add_category_to_invoice(
     new_link = CategoryInvoiceAssociation(invoice_id=invoice_id, category_id=category.id)
 
     db.add(new_link)
+    touch_invoice(db, invoice_id)
+    record_invoice_change(db, user_id, invoice_id, InvoiceChangeEnum.category, {"category": category.name})
     db.commit()
     db.refresh(new_link)
     return new_link
@@ -249,6 +671,8 @@ def remove_category_from_invoice(db: sa.orm.Session, user_id: str, invoice_id: s
         return existing_link
 
     db.delete(existing_link)
+    touch_invoice(db, invoice_id)
+    record_invoice_change(db, user_id, invoice_id, InvoiceChangeEnum.category, {"category": None})
     db.commit()
 
 
@@ -256,14 +680,187 @@ def delete_invoice(db: sa.orm.Session, invoice_id: str) -> None:
     # Delete category links
     db.query(CategoryInvoiceAssociation).filter_by(invoice_id=invoice_id).delete()
     # Delete invoice
-    db.query(Invoice).filter_by(id=invoice_id).delete()
+    invoice = db.query(Invoice).filter_by(id=invoice_id).with_for_update().first()
+    if invoice:
+        bump_invoice_stats(db, invoice.user_id, **invoice_stats_delta(invoice, sign=-1))
+        record_invoice_change(db, invoice.user_id, invoice_id, InvoiceChangeEnum.deleted)
+        db.query(Invoice).filter_by(id=invoice_id).delete()
+    db.commit()
+
+
+def invoice_change_data(invoice: Invoice) -> Dict[str, Any]:
+    """JSON safe snapshot of an invoice's own columns for the change log"""
+    return {
+        "id": invoice.id,
+        "vendor_id": invoice.vendor_id,
+        "is_paid": bool(invoice.is_paid),
+        "vendor_name": invoice.vendor_name,
+        "amount_due": None if invoice.amount_due is None else str(invoice.amount_due),
+        "currency": invoice.currency,
+        "due_date": invoice.due_date.isoformat() if invoice.due_date else None,
+        "invoice_id": invoice.invoice_id,
+        "image_uri": invoice.image_uri,
+    }
+
+
+def record_invoice_change(
+    db: Session, user_id: str, invoice_id: str, operation: InvoiceChangeEnum, data: Dict[str, Any] = None
+) -> None:
+    """Appends to the invoice change log - doesn't commit, call it inside the transaction making the change"""
+    if not user_id:
+        return
+    db.add(InvoiceChange(user_id=user_id, invoice_id=invoice_id, operation=operation.value, data=data))
+
+
+def record_invoice_changes(
+    db: Session, user_id: str, invoice_ids: List[str], operation: InvoiceChangeEnum, data: Dict[str, Any] = None
+) -> None:
+    """record_invoice_change for many invoices as a single insert"""
+    if not user_id or not invoice_ids:
+        return
+    db.execute(
+        sa.insert(InvoiceChange),
+        [{"user_id": user_id, "invoice_id": i, "operation": operation.value, "data": data} for i in invoice_ids],
+    )
+
+
+def encode_change_cursor(change: InvoiceChange) -> str:
+    return base64.urlsafe_b64encode(f"{change.txid}:{change.id}".encode()).decode()
+
+
+def decode_change_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        txid, change_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(txid), int(change_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+
+def query_invoice_changes(db: Session, user_id: str, cursor: str = None, limit: int = 100) -> List[InvoiceChange]:
+    """Reads a user's invoice changes after `cursor` in commit safe order.
+
+    Changes from transactions at or above the oldest one still running are held back - they may sit behind
+    changes that already committed, and handing those out first would move the cursor past them.
+
+    That horizon is database wide: while any write transaction is open, for any user or table, nothing newer is
+    returned to anyone. Writers must therefore keep transactions short and never hold one open across OCR,
+    rendering or storage calls - see backfill_derivatives and the per step commits in ingestion. Check
+    pg_stat_activity for long `idle in transaction` sessions if the feed stalls.
+    """
+    query = (
+        db.query(InvoiceChange)
+        .filter_by(user_id=user_id)
+        .filter(InvoiceChange.txid < func.txid_snapshot_xmin(func.txid_current_snapshot()))
+    )
+    if cursor:
+        query = query.filter(sa.tuple_(InvoiceChange.txid, InvoiceChange.id) > sa.tuple_(*decode_change_cursor(cursor)))
+
+    return query.order_by(InvoiceChange.txid, InvoiceChange.id).limit(limit).all()
+
+
+def _lock_owned_invoices(db: Session, user_id: str, invoice_ids: List[str]) -> List[Row]:
+    """Locks the user's invoices among invoice_ids and returns (id, user_id, is_paid, amount_due) for each"""
+    return (
+        db.query(Invoice.id, Invoice.user_id, Invoice.is_paid, Invoice.amount_due)
+        .filter(Invoice.user_id == user_id, Invoice.id.in_(invoice_ids))
+        .with_for_update()
+        .all()
+    )
+
+
+def _bulk_results(
+    invoice_ids: List[str], statuses: Dict[str, BulkInvoiceStatusEnum]
+) -> Dict[str, BulkInvoiceStatusEnum]:
+    return {i: statuses.get(i, BulkInvoiceStatusEnum.not_found) for i in dict.fromkeys(invoice_ids)}
+
+
+def bulk_update_paid_status(
+    db: Session, user_id: str, invoice_ids: List[str], is_paid: bool
+) -> Dict[str, BulkInvoiceStatusEnum]:
+    """Sets is_paid on many of a user's invoices with one UPDATE and returns each id's outcome"""
+    owned = _lock_owned_invoices(db, user_id, invoice_ids)
+    changing = [row for row in owned if bool(row.is_paid) != is_paid]
+    changing_ids = [row.id for row in changing]
+
+    if changing_ids:
+        db.execute(
+            sa.update(Invoice)
+            .where(Invoice.id.in_(changing_ids))
+            .values(is_paid=is_paid, updated_on=func.now())
+            .execution_options(synchronize_session=False)
+        )
+        # Every changing invoice moves from one side of the stats to the other
+        count = len(changing)
+        amount = sum((row.amount_due or 0) for row in changing)
+        sign = 1 if is_paid else -1
+        bump_invoice_stats(
+            db,
+            user_id,
+            num_paid=sign * count,
+            num_unpaid=-sign * count,
+            amount_paid=sign * amount,
+            amount_unpaid=-sign * amount,
+        )
+        record_invoice_changes(db, user_id, changing_ids, InvoiceChangeEnum.paid_status, {"is_paid": is_paid})
+    db.commit()
+
+    statuses = {row.id: BulkInvoiceStatusEnum.unchanged for row in owned}
+    statuses.update({i: BulkInvoiceStatusEnum.updated for i in changing_ids})
+    return _bulk_results(invoice_ids, statuses)
+
+
+def bulk_categorize_invoices(
+    db: Session, user_id: str, invoice_ids: List[str], category_name: str
+) -> Dict[str, BulkInvoiceStatusEnum]:
+    """Assigns one category to many of a user's invoices, replacing their existing category, in one transaction"""
+    owned_ids = [row.id for row in _lock_owned_invoices(db, user_id, invoice_ids)]
+
+    if owned_ids:
+        category = ensure_category_by_name(db, category_name, user_id, commit=False)
+        db.query(CategoryInvoiceAssociation).filter(CategoryInvoiceAssociation.invoice_id.in_(owned_ids)).delete(
+            synchronize_session=False
+        )
+        db.execute(
+            sa.insert(CategoryInvoiceAssociation),
+            [{"invoice_id": i, "category_id": category.id} for i in owned_ids],
+        )
+        db.query(Invoice).filter(Invoice.id.in_(owned_ids)).update(
+            {"updated_on": func.now()}, synchronize_session=False
+        )
+        record_invoice_changes(db, user_id, owned_ids, InvoiceChangeEnum.category, {"category": category.name})
     db.commit()
 
+    return _bulk_results(invoice_ids, {i: BulkInvoiceStatusEnum.updated for i in owned_ids})
+
+
+def bulk_delete_invoices(db: Session, user_id: str, invoice_ids: List[str]) -> Dict[str, BulkInvoiceStatusEnum]:
+    """Deletes many of a user's invoices and their category links in one transaction"""
+    owned = _lock_owned_invoices(db, user_id, invoice_ids)
+    owned_ids = [row.id for row in owned]
+
+    if owned_ids:
+        db.query(CategoryInvoiceAssociation).filter(CategoryInvoiceAssociation.invoice_id.in_(owned_ids)).delete(
+            synchronize_session=False
+        )
+        db.query(Invoice).filter(Invoice.id.in_(owned_ids)).delete(synchronize_session=False)
+        for stats_user_id, delta in sum_invoice_stats_deltas(owned, sign=-1).items():
+            bump_invoice_stats(db, stats_user_id, **delta)
+        record_invoice_changes(db, user_id, owned_ids, InvoiceChangeEnum.deleted)
+    db.commit()
+
+    return _bulk_results(invoice_ids, {i: BulkInvoiceStatusEnum.deleted for i in owned_ids})
+
 
 def get_aging_report_by_id(db: Session, report_id: str) -> Optional[AgingReport]:
     return db.query(AgingReport).filter_by(id=report_id).first()
 
 
+def get_aging_reports_version(db: Session, user_id: str) -> Tuple[int, Optional[datetime]]:
+    return tuple(
+        db.query(func.count(AgingReport.id), func.max(AgingReport.created_on)).filter_by(user_id=user_id).one()
+    )
+
+
 def query_aging_reports(
     db: Session, user_id: str, *, order_by: str, limit: int = 100, offset: int = 0, desc: bool = False
 ) -> List[AgingReport]:
@@ -280,3 +877,123 @@ def query_aging_reports(
     query = query.order_by(order_by_stmt)
     query = query.limit(limit).offset(offset)
     return query.all()
+
+
+def create_ingestion_job(
+    db: Session,
+    user_id: str,
+    content_type: str,
+    file_data: bytes = None,
+    content_hash: str = None,
+    storage_key: str = None,
+    status: str = "queued",
+) -> IngestionJob:
+    job = IngestionJob(
+        user_id=user_id,
+        content_type=content_type,
+        content_hash=content_hash,
+        file_data=file_data,
+        storage_key=storage_key,
+        status=status,
+        attempts=0,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_ingestion_job_by_id(db: Session, job_id: str) -> Optional[IngestionJob]:
+    return db.query(IngestionJob).filter_by(id=job_id).first()
+
+
+def claim_ingestion_jobs(db: Session, limit: int) -> List[str]:
+    """Marks up to `limit` queued jobs as processing and returns their ids.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED so several app processes can poll the same table without
+    claiming the same job twice.
+    """
+    jobs = (
+        db.query(IngestionJob)
+        .filter_by(status="queued")
+        .order_by(IngestionJob.created_on)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for job in jobs:
+        job.status = "processing"
+        job.attempts += 1
+    db.commit()
+    return [job.id for job in jobs]
+
+
+def heartbeat_ingestion_jobs(db: Session, job_ids: List[str]) -> None:
+    """Bumps updated_on for jobs a worker is still processing so they aren't mistaken for abandoned ones"""
+    if not job_ids:
+        return
+    db.execute(
+        sa.update(IngestionJob)
+        .where(IngestionJob.id.in_(job_ids), IngestionJob.status == "processing")
+        .values(updated_on=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def requeue_stale_ingestion_jobs(db: Session, timeout: timedelta, max_attempts: int) -> Tuple[int, int]:
+    """Requeues processing jobs that haven't had a heartbeat or step update within `timeout`.
+
+    Those are jobs whose app process died mid-job - live workers heartbeat theirs, see heartbeat_ingestion_jobs.
+    A job that has already been claimed `max_attempts` times is failed instead, so one that takes its worker down
+    with it isn't retried forever. Returns (requeued, failed).
+    """
+    stale = (
+        db.query(IngestionJob)
+        .filter_by(status="processing")
+        .filter(IngestionJob.updated_on < datetime.utcnow() - timeout)
+    )
+    num_failed = stale.filter(IngestionJob.attempts >= max_attempts).update(
+        {"status": "failed", "error": f"Processing stopped unexpectedly {max_attempts} times"},
+        synchronize_session=False,
+    )
+    num_requeued = stale.update({"status": "queued", "step": None}, synchronize_session=False)
+    db.commit()
+    return num_requeued, num_failed
+
+
+def release_ingestion_jobs(db: Session, job_ids: List[str]) -> None:
+    """Puts claimed jobs that never reached a worker back in the queue, without counting the attempt"""
+    if not job_ids:
+        return
+    db.query(IngestionJob).filter(IngestionJob.id.in_(job_ids), IngestionJob.status == "processing").update(
+        {"status": "queued", "attempts": IngestionJob.attempts - 1}, synchronize_session=False
+    )
+    db.commit()
+
+
+def fail_abandoned_direct_uploads(db: Session, timeout: timedelta) -> List[str]:
+    """Fails direct upload jobs still awaiting their file after `timeout` and returns their storage keys.
+
+    The caller deletes whatever was uploaded under those keys. A single UPDATE ... RETURNING, so when several
+    app processes sweep at once each job is only returned to one of them.
+    """
+    rows = db.execute(
+        sa.update(IngestionJob)
+        .where(
+            IngestionJob.status == "awaiting_upload",
+            IngestionJob.created_on < datetime.utcnow() - timeout,
+        )
+        .values(status="failed", error="Upload was never completed")
+        .returning(IngestionJob.storage_key)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return [row.storage_key for row in rows if row.storage_key]
+
+
+def update_ingestion_job(db: Session, job: IngestionJob, **values) -> IngestionJob:
+    for k, v in values.items():
+        setattr(job, k, v)
+    db.commit()
+    return job
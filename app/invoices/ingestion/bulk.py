@@ -0,0 +1,191 @@
+import mimetypes
+import os
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import UploadFile
+from loguru import logger as log
+from result import Result
+
+from app.db.session import SessionLocal
+from app.invoices.config import config
+from app.invoices.db_utils import get_invoice_by_content_hash, save_invoices
+from app.invoices.models import CreateInvoice
+from app.storage.config import config as storage_config
+from app.users.db_utils import get_organization_id_by_user_id
+
+from .models import BulkUploadResult, IngestionStatusEnum
+from .pipeline import ALLOWED_CONTENT_TYPES, hash_content, prepare_invoice
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+# (filename, content_type, reader, error) - reader is only called once a worker slot is free, error is set for
+# files that couldn't be opened at all
+UploadEntry = Tuple[str, str, Callable[[], bytes], Optional[str]]
+
+
+def is_zip_upload(file: UploadFile) -> bool:
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+def upload_too_large_error(num_bytes: int) -> Optional[str]:
+    if num_bytes > storage_config.max_upload_bytes:
+        return f"File must be at most {storage_config.max_upload_bytes // (1024 * 1024)} MB"
+    return None
+
+
+def zip_limits_error(infos: List[zipfile.ZipInfo]) -> Optional[str]:
+    if len(infos) > config.bulk_upload_max_zip_entries:
+        return f"Archive must contain at most {config.bulk_upload_max_zip_entries} files"
+    # Entries too large on their own are failed one by one, so they don't count towards the archive's total
+    total_bytes = sum(i.file_size for i in infos if i.file_size <= storage_config.max_upload_bytes)
+    if total_bytes > config.bulk_upload_max_zip_bytes:
+        return f"Archive must be at most {config.bulk_upload_max_zip_bytes // (1024 * 1024)} MB uncompressed"
+    return None
+
+
+def iter_upload_entries(files: List[UploadFile]) -> Iterator[UploadEntry]:
+    """Yields every invoice in the upload - ZIP archives are expanded one entry at a time.
+
+    UploadFile.file is a spooled temporary file so zipfile can seek the central directory and decompress
+    entries lazily without the whole archive being held in memory.
+    """
+    for file in files:
+        if not is_zip_upload(file):
+            file.file.seek(0, os.SEEK_END)
+            error = upload_too_large_error(file.file.tell())
+            file.file.seek(0)
+            yield file.filename, file.content_type, file.file.read, error
+            continue
+
+        try:
+            archive = zipfile.ZipFile(file.file)
+            infos = archive.infolist()
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError, ValueError) as e:
+            log.warning(f"Failed to open {file.filename} as a zip archive: {e}")
+            yield file.filename, file.content_type, file.file.read, f"Not a readable .zip archive: {e}"
+            continue
+
+        # zipfile never returns more than an entry's declared file_size, so the directory is enough to refuse
+        # archives that would expand into more than we are willing to hold
+        infos = [info for info in infos if not info.is_dir()]
+        error = zip_limits_error(infos)
+        if error:
+            yield file.filename, file.content_type, file.file.read, error
+            continue
+
+        for info in infos:
+            content_type, _ = mimetypes.guess_type(info.filename)
+            error = upload_too_large_error(info.file_size)
+            yield info.filename, content_type, lambda info=info: archive.read(info), error
+
+
+def ingest_bulk_upload(user_id: str, files: List[UploadFile]) -> List[BulkUploadResult]:
+    """OCRs every uploaded invoice with bounded concurrency then saves them in batched transactions
+
+    Blocking - run it off the event loop.
+    """
+    results: List[BulkUploadResult] = []
+    futures: List[Tuple[BulkUploadResult, Future]] = []
+    # Results for files repeated within this upload, paired with the first occurrence's result
+    repeats: List[Tuple[BulkUploadResult, BulkUploadResult]] = []
+    first_seen: Dict[str, BulkUploadResult] = {}
+
+    # Caps how many file bodies are in memory at once, not just how many are being processed
+    slots = threading.BoundedSemaphore(config.bulk_upload_concurrency)
+
+    with SessionLocal() as db, ThreadPoolExecutor(
+        config.bulk_upload_concurrency, thread_name_prefix="bulk-upload"
+    ) as executor:
+        organization_id = get_organization_id_by_user_id(db, user_id)
+
+        for filename, content_type, read, error in iter_upload_entries(files):
+            result = BulkUploadResult(filename=filename, status=IngestionStatusEnum.queued)
+            results.append(result)
+
+            if error:
+                result.status = IngestionStatusEnum.failed
+                result.error = error
+                continue
+
+            if content_type not in ALLOWED_CONTENT_TYPES:
+                result.status = IngestionStatusEnum.failed
+                result.error = "File must be a .png, .jpg, or .pdf"
+                continue
+
+            slots.acquire()
+            try:
+                file_data = read()
+                content_hash = hash_content(file_data)
+
+                if content_hash in first_seen:
+                    slots.release()
+                    repeats.append((result, first_seen[content_hash]))
+                    continue
+
+                existing = get_invoice_by_content_hash(db, user_id, organization_id, content_hash)
+                if existing:
+                    slots.release()
+                    result.status = IngestionStatusEnum.done
+                    result.invoice_id = existing.id
+                    continue
+
+                first_seen[content_hash] = result
+                future = executor.submit(prepare_invoice, user_id, file_data, content_type, content_hash)
+            except Exception as e:
+                slots.release()
+                result.status = IngestionStatusEnum.failed
+                result.error = str(e)
+                continue
+
+            future.add_done_callback(lambda _: slots.release())
+            futures.append((result, future))
+
+    prepared: List[Tuple[BulkUploadResult, CreateInvoice]] = []
+    for result, future in futures:
+        try:
+            parse_result: Result = future.result()
+        except Exception as e:
+            log.exception(f"Failed to process {result.filename}")
+            result.status = IngestionStatusEnum.failed
+            result.error = str(e)
+            continue
+
+        if parse_result.is_err():
+            result.status = IngestionStatusEnum.failed
+            result.error = parse_result.err()
+            continue
+
+        prepared.append((result, parse_result.ok()))
+
+    batch_size = config.bulk_insert_batch_size
+    for start in range(0, len(prepared), batch_size):
+        batch = prepared[start : start + batch_size]
+        with SessionLocal() as db:
+            try:
+                save_results = save_invoices(db, [invoice for _, invoice in batch])
+            except Exception as e:
+                # Only what the whole batch shares (vendors, stats) gets here - single invoices fail on their own
+                log.exception("Failed to save bulk upload batch")
+                db.rollback()
+                for result, _ in batch:
+                    result.status = IngestionStatusEnum.failed
+                    result.error = str(e)
+                continue
+
+            for (result, _), save_result in zip(batch, save_results):
+                if save_result.is_err():
+                    result.status = IngestionStatusEnum.failed
+                    result.error = save_result.err()
+                    continue
+                result.status = IngestionStatusEnum.done
+                result.invoice_id = save_result.ok().id
+
+    for result, original in repeats:
+        result.status = original.status
+        result.invoice_id = original.invoice_id
+        result.error = original.error
+
+    return results
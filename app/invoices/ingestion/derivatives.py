@@ -0,0 +1,201 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from typing import Dict, Optional
+
+from loguru import logger as log
+from PIL import Image
+
+from app.db.session import SessionLocal
+from app.invoices.config import config
+from app.invoices.db_utils import (claim_invoices_missing_derivatives,
+                                   set_invoice_derivatives)
+from app.invoices.models import CreateInvoice
+from app.storage.backends import storage
+
+# Derivative name -> longest side in px. Each becomes a `<name>_uri` column on Invoice
+DERIVATIVE_SIZES = {"preview": config.preview_max_size, "thumbnail": config.thumbnail_max_size}
+DERIVATIVE_FORMATS = {"webp": ("WEBP", "webp", "image/webp"), "jpeg": ("JPEG", "jpg", "image/jpeg")}
+# What _render_derivatives raises for an image Pillow can't decode (UnidentifiedImageError is an OSError) - it does
+# no other I/O, so these won't go away by trying again
+IMAGE_DECODE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Decoding multi megabyte page images and resampling them is CPU bound - same reasoning as rasterize
+            _pool = ProcessPoolExecutor(config.derivative_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Drops a pool that lost a worker - a broken pool fails every later submit, so the next call starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown_derivative_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _render_derivatives(image: bytes, sizes: Dict[str, int], image_format: str, quality: int) -> Dict[str, bytes]:
+    with Image.open(io.BytesIO(image)) as original:
+        # Lets JPEG decoding skip straight to roughly the largest size needed
+        original.draft("RGB", (max(sizes.values()),) * 2)
+        current = original.convert("RGB")
+
+    rendered = {}
+    # Largest first so each smaller derivative is resampled from the previous one rather than the original
+    for name, max_size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        current = current.copy()
+        current.thumbnail((max_size, max_size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        current.save(buffer, format=image_format, quality=quality)
+        rendered[name] = buffer.getvalue()
+    return rendered
+
+
+def derivative_key(image_key: str, name: str) -> str:
+    """Derivatives sit next to the original - abc.png gets abc-thumbnail.webp"""
+    extension = DERIVATIVE_FORMATS[config.derivative_format][1]
+    return f"{os.path.splitext(image_key)[0]}-{name}.{extension}"
+
+
+def render_derivatives(image: bytes) -> Dict[str, bytes]:
+    """Renders every derivative of an invoice image on the derivative pool - see IMAGE_DECODE_ERRORS"""
+    image_format = DERIVATIVE_FORMATS[config.derivative_format][0]
+    pool = _get_pool()
+    try:
+        future = pool.submit(_render_derivatives, image, DERIVATIVE_SIZES, image_format, config.derivative_quality)
+        return future.result()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
+def store_derivatives(rendered: Dict[str, bytes], image_uri: str) -> Dict[str, str]:
+    """Uploads rendered derivatives next to the invoice image - returns column values"""
+    image_key = storage.key_from_uri(image_uri)
+    if image_key is None:
+        raise ValueError(f"{image_uri} isn't managed by the configured storage backend")
+
+    content_type = DERIVATIVE_FORMATS[config.derivative_format][2]
+    return {
+        f"{name}_uri": storage.upload_bytes(derivative_key(image_key, name), data, content_type=content_type)
+        for name, data in rendered.items()
+    }
+
+
+def create_derivatives(image: bytes, image_uri: str) -> Dict[str, str]:
+    """Renders and stores every derivative of an invoice image - returns column values"""
+    return store_derivatives(render_derivatives(image), image_uri)
+
+
+def attach_derivatives(invoice: CreateInvoice, image: bytes) -> None:
+    """Sets the derivative uris on an invoice about to be saved - a failure leaves them for the backfill"""
+    try:
+        for column, uri in create_derivatives(image, invoice.image_uri).items():
+            setattr(invoice, column, uri)
+    except Exception:
+        log.exception(f"Failed to create derivatives of {invoice.image_uri}")
+
+
+def backfill_derivatives(batch_size: int) -> int:
+    """Creates derivatives for one batch of invoices that don't have them yet - returns how many were visited.
+
+    The rows are only claimed in one short transaction and updated in another. Rendering and storage calls run
+    with no transaction open, so they don't hold locks against edits or hold back the change feed.
+
+    Images that can't be decoded get empty uris so they aren't retried. Anything else (storage errors, a crashed
+    pool worker) leaves the invoice as is to be claimed again once its claim times out.
+    """
+    with SessionLocal() as db:
+        rows = claim_invoices_missing_derivatives(db, batch_size, timedelta(seconds=config.derivative_claim_timeout))
+
+    uris_by_id = {}
+    for invoice_id, image_uri in rows:
+        try:
+            image_key = storage.key_from_uri(image_uri)
+            if image_key is None:
+                raise ValueError(f"{image_uri} isn't managed by the configured storage backend")
+            image = storage.download_bytes(image_key)
+            try:
+                rendered = render_derivatives(image)
+            except IMAGE_DECODE_ERRORS:
+                log.exception(f"Invoice {invoice_id} has an image that can't be decoded")
+                # Empty rather than NULL so a broken image isn't retried forever - views fall back to image_uri
+                uris_by_id[invoice_id] = {f"{name}_uri": "" for name in DERIVATIVE_SIZES}
+                continue
+            uris_by_id[invoice_id] = store_derivatives(rendered, image_uri)
+        except Exception:
+            log.exception(f"Failed to backfill derivatives of invoice {invoice_id}, retrying once the claim expires")
+
+    if uris_by_id:
+        with SessionLocal() as db:
+            for invoice_id, uris in uris_by_id.items():
+                set_invoice_derivatives(db, invoice_id, **uris)
+            db.commit()
+    return len(rows)
+
+
+class DerivativeBackfiller:
+    """Works through invoices saved before derivatives existed, a batch at a time, then exits"""
+
+    def __init__(self, batch_size: int, interval: float) -> None:
+        self._batch_size = batch_size
+        self._interval = interval
+        self._thread: threading.Thread = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._thread or self._batch_size <= 0:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="derivative-backfiller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self._thread:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        num_visited = 0
+        while not self._stop.is_set():
+            try:
+                num_in_batch = backfill_derivatives(self._batch_size)
+            except Exception:
+                log.exception("Failed to backfill invoice derivatives")
+                num_in_batch = None
+
+            if num_in_batch == 0:
+                break
+            num_visited += num_in_batch or 0
+            # Spaces batches out so the backfill doesn't compete with ingestion for the pool and storage
+            self._stop.wait(self._interval)
+
+        if num_visited:
+            log.info(f"Backfilled derivatives for {num_visited} invoices")
+
+
+derivative_backfiller = DerivativeBackfiller(config.derivative_backfill_batch_size, config.derivative_backfill_interval)
@@ -0,0 +1,60 @@
+from datetime import datetime
+from enum import Enum
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class IngestionStatusEnum(str, Enum):
+    awaiting_upload = "awaiting_upload"
+    queued = "queued"
+    processing = "processing"
+    done = "done"
+    failed = "failed"
+
+
+class IngestionStepEnum(str, Enum):
+    downloading = "downloading"
+    rasterizing = "rasterizing"
+    ocr = "ocr"
+    uploading = "uploading"
+    saving = "saving"
+
+
+class PublicIngestionJob(BaseModel):
+    id: str
+    status: IngestionStatusEnum
+    step: IngestionStepEnum = None
+    invoice_id: str = None
+    error: str = None
+    attempts: int = 0
+    created_on: datetime = None
+    updated_on: datetime = None
+
+    class Config:
+        orm_mode = True
+
+
+class DirectUploadRequest(BaseModel):
+    content_type: str
+    content_length: int  # bytes - the upload url only accepts a file of this size
+
+
+class DirectUpload(BaseModel):
+    """Where the browser should PUT the file - then it calls complete_url to queue processing, or cancel_url if it
+    gives up so the upload doesn't linger until it's swept
+    """
+
+    job_id: str
+    url: str
+    method: str = "PUT"
+    headers: Dict[str, str]
+    complete_url: str
+    cancel_url: str
+
+
+class BulkUploadResult(BaseModel):
+    filename: str
+    status: IngestionStatusEnum
+    invoice_id: str = None
+    error: str = None
@@ -0,0 +1,170 @@
+import hashlib
+from typing import Optional
+
+import ulid
+from loguru import logger as log
+from result import Err, Ok, Result
+from sqlalchemy.exc import IntegrityError
+
+from app.db.models import IngestionJob
+from app.db.session import SessionLocal
+from app.invoices.config import config
+from app.invoices.db_utils import (get_ingestion_job_by_id,
+                                   get_invoice_by_content_hash,
+                                   get_invoice_image_uri, save_invoice,
+                                   update_ingestion_job)
+from app.invoices.models import CreateInvoice
+from app.invoices.ocr.cache import OcrResultCache
+from app.invoices.ocr.textract import InvoiceImageProcessor, textract_client
+from app.invoices.s3_utils import get_object_uri, upload_bytes_to_s3
+from app.storage.backends import storage
+from app.users.db_utils import get_organization_id_by_user_id
+
+from .derivatives import attach_derivatives
+from .models import IngestionStatusEnum, IngestionStepEnum
+from .rasterize import rasterize_pages
+
+ALLOWED_CONTENT_TYPES = ("image/png", "image/jpeg", "image/jpg", "application/pdf")
+
+processor = InvoiceImageProcessor(
+    textract_client,
+    cache=OcrResultCache(config.ocr_cache_dir) if config.ocr_cache_dir else None,
+    max_page_concurrency=config.ocr_page_concurrency,
+)
+
+
+def hash_content(file_data: bytes) -> str:
+    return hashlib.sha256(file_data).hexdigest()
+
+
+def image_extension(content_type: str) -> str:
+    # PDFs are rasterized to PNGs before being stored
+    if content_type == "application/pdf":
+        return "png"
+    return content_type.split("/")[1]
+
+
+def upload_extension(content_type: str) -> str:
+    """Extension for the file as uploaded - unlike image_extension PDFs stay PDFs"""
+    return content_type.split("/")[1]
+
+
+def upload_is_invoice_image(job: IngestionJob) -> bool:
+    """A directly uploaded image is stored as is and becomes the invoice image - PDFs are rasterized first"""
+    return bool(job.storage_key) and job.content_type != "application/pdf"
+
+
+def prepare_invoice(
+    user_id: str, file_data: bytes, content_type: str, content_hash: str = None
+) -> Result[CreateInvoice, str]:
+    """Runs rasterize -> OCR -> upload without touching the database"""
+    pages = rasterize_pages(file_data, content_type)
+
+    parse_result: Result = processor.apply_pages(pages, content_hash=content_hash)
+    if parse_result.is_err():
+        return Err(parse_result.err())
+
+    formatted_invoice = CreateInvoice.from_raw_parse(user_id, parse_result.ok())
+    formatted_invoice.content_hash = content_hash
+    extension = image_extension(content_type)
+    # Only the first page is stored as the invoice image
+    formatted_invoice.image_uri = upload_bytes_to_s3(
+        pages[0], f"{str(ulid.ulid())}", extension, content_type=f"image/{extension}"
+    )
+    attach_derivatives(formatted_invoice, pages[0])
+    return Ok(formatted_invoice)
+
+
+def find_duplicate_invoice_id(db, user_id: str, content_hash: str = None) -> Optional[str]:
+    """Returns the id of an invoice the user (or their organization) already stored for this file, if any"""
+    if not content_hash:
+        return None
+
+    organization_id = get_organization_id_by_user_id(db, user_id)
+    existing = get_invoice_by_content_hash(db, user_id, organization_id, content_hash)
+    return existing.id if existing else None
+
+
+def load_job_file(db, job: IngestionJob) -> bytes:
+    """The job's file - direct uploads are read back from storage and hashed here rather than trusting the client"""
+    if not job.storage_key:
+        return job.file_data
+
+    update_ingestion_job(db, job, step=IngestionStepEnum.downloading.value)
+    file_data = storage.download_bytes(job.storage_key)
+    content_hash = hash_content(file_data)
+    if job.content_hash != content_hash:
+        update_ingestion_job(db, job, content_hash=content_hash)
+    return file_data
+
+
+def run_ingestion_job(db, job: IngestionJob) -> Result[str, str]:
+    """Runs rasterize -> OCR -> upload -> save for a job, recording the current step as it goes"""
+    file_data = load_job_file(db, job)
+
+    # A duplicate may have been saved while this job was queued
+    duplicate_id = find_duplicate_invoice_id(db, job.user_id, job.content_hash)
+    if duplicate_id:
+        return Ok(duplicate_id)
+
+    update_ingestion_job(db, job, step=IngestionStepEnum.rasterizing.value)
+    pages = rasterize_pages(file_data, job.content_type)
+
+    update_ingestion_job(db, job, step=IngestionStepEnum.ocr.value)
+    parse_result: Result = processor.apply_pages(pages, content_hash=job.content_hash)
+    if parse_result.is_err():
+        return Err(parse_result.err())
+
+    formatted_invoice = CreateInvoice.from_raw_parse(job.user_id, parse_result.ok())
+    formatted_invoice.content_hash = job.content_hash
+
+    update_ingestion_job(db, job, step=IngestionStepEnum.uploading.value)
+    if upload_is_invoice_image(job):
+        formatted_invoice.image_uri = get_object_uri(job.storage_key)
+    else:
+        extension = image_extension(job.content_type)
+        formatted_invoice.image_uri = upload_bytes_to_s3(
+            pages[0], f"{str(ulid.ulid())}", extension, content_type=f"image/{extension}"
+        )
+    attach_derivatives(formatted_invoice, pages[0])
+
+    update_ingestion_job(db, job, step=IngestionStepEnum.saving.value)
+    try:
+        db_invoice = save_invoice(db, formatted_invoice)
+    except IntegrityError:
+        # Lost a race with another job for the same file
+        db.rollback()
+        duplicate_id = find_duplicate_invoice_id(db, job.user_id, job.content_hash)
+        if not duplicate_id:
+            raise
+        return Ok(duplicate_id)
+    return Ok(db_invoice.id)
+
+
+def process_ingestion_job(job_id: str) -> None:
+    """Entrypoint for workers - must stay a module level function so it can be pickled for process pools"""
+    with SessionLocal() as db:
+        job = get_ingestion_job_by_id(db, job_id)
+        if not job:
+            log.warning(f"Ingestion job {job_id} no longer exists")
+            return
+
+        try:
+            result = run_ingestion_job(db, job)
+        except Exception as e:
+            log.exception(f"Ingestion job {job_id} failed")
+            db.rollback()
+            result = Err(str(e))
+
+        if result.is_err():
+            update_ingestion_job(db, job, status=IngestionStatusEnum.failed.value, error=result.err())
+            return
+
+        # Raw bytes are only needed until the image has been stored
+        update_ingestion_job(
+            db, job, status=IngestionStatusEnum.done.value, step=None, invoice_id=result.ok(), file_data=None
+        )
+
+        # Likewise a direct upload, unless it became the invoice image
+        if job.storage_key and get_invoice_image_uri(db, result.ok()) != get_object_uri(job.storage_key):
+            storage.delete(job.storage_key)
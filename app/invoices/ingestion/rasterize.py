@@ -0,0 +1,62 @@
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+
+import fitz
+
+from app.invoices.config import config
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # PyMuPDF rendering is CPU bound and holds the GIL so pages are rendered in separate processes
+            _pool = ProcessPoolExecutor(config.rasterize_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_rasterize_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _render_pages(file_data: bytes, page_numbers: Iterable[int], dpi: int) -> List[bytes]:
+    doc = fitz.open(stream=file_data, filetype="pdf")
+    zoom = dpi / 72  # PDF user space is 72 dpi
+    matrix = fitz.Matrix(zoom, zoom)
+    return [doc.load_page(n).get_pixmap(matrix=matrix).tobytes(output="PNG") for n in page_numbers]
+
+
+def rasterize_pages(file_data: bytes, content_type: str, dpi: int = None) -> List[bytes]:
+    """Converts every page of a pdf to a png - images are passed through untouched as a single page"""
+    if content_type != "application/pdf":
+        return [file_data]
+
+    dpi = dpi or config.pdf_dpi
+    page_count = fitz.open(stream=file_data, filetype="pdf").page_count
+    if page_count == 0:
+        raise ValueError("PDF has no pages")
+
+    if page_count == 1 or config.rasterize_workers <= 1:
+        return _render_pages(file_data, range(page_count), dpi)
+
+    # One contiguous chunk of pages per worker so the pdf bytes are only sent to each process once
+    chunk_size = math.ceil(page_count / min(config.rasterize_workers, page_count))
+    chunks = [range(i, min(i + chunk_size, page_count)) for i in range(0, page_count, chunk_size)]
+
+    pool = _get_pool()
+    futures = [pool.submit(_render_pages, file_data, chunk, dpi) for chunk in chunks]
+
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
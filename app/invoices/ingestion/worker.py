@@ -0,0 +1,178 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import (Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from datetime import timedelta
+from typing import Dict, List
+
+from loguru import logger as log
+
+from app.db.session import SessionLocal
+from app.invoices.config import config
+from app.invoices.db_utils import (claim_ingestion_jobs,
+                                   fail_abandoned_direct_uploads,
+                                   heartbeat_ingestion_jobs,
+                                   release_ingestion_jobs,
+                                   requeue_stale_ingestion_jobs)
+from app.storage.backends import storage
+
+from .pipeline import process_ingestion_job
+
+
+class IngestionWorkerPool:
+    """Polls the ingestion_jobs table and fans claimed jobs out to a thread or process pool.
+
+    A single dispatcher thread claims at most as many jobs as there are idle workers, so jobs stay queued
+    in Postgres (and visible to other app processes) until a worker is actually free. It also heartbeats the jobs
+    in flight, so any app process can requeue jobs whose process died without waiting for a restart.
+    """
+
+    def __init__(self, num_workers: int, executor: str = "thread", poll_interval: float = 2.0) -> None:
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be one of 'thread' or 'process'")
+
+        self._num_workers = num_workers
+        self._executor_type = executor
+        self._poll_interval = poll_interval
+
+        self._executor: Executor = None
+        self._dispatcher: threading.Thread = None
+        self._in_flight: Dict[Future, str] = {}  # future -> job id
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._dispatcher:
+            return
+
+        self._executor = self._create_executor()
+
+        self._stop.clear()
+        self._dispatcher = threading.Thread(target=self._run, name="ingestion-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _create_executor(self) -> Executor:
+        if self._executor_type == "process":
+            # Spawn so children don't inherit the parent's db connections or event loop threads
+            return ProcessPoolExecutor(self._num_workers, mp_context=multiprocessing.get_context("spawn"))
+        return ThreadPoolExecutor(self._num_workers, thread_name_prefix="ingestion")
+
+    def stop(self) -> None:
+        if not self._dispatcher:
+            return
+
+        self._stop.set()
+        self._wake.set()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+        self._dispatcher = None
+
+    def notify(self) -> None:
+        """Wakes the dispatcher early - call after enqueueing a job"""
+        self._wake.set()
+
+    def _on_done(self, future: Future) -> None:
+        with self._lock:
+            job_id = self._in_flight.pop(future, None)
+        # A cancelled future raises from exception() - its job is left processing and requeued once stale
+        if future.cancelled():
+            log.warning(f"Ingestion job {job_id} was cancelled")
+        elif future.exception():
+            log.error(f"Ingestion job {job_id} raised: {future.exception()}")
+        self._wake.set()
+
+    def _heartbeat(self) -> None:
+        with self._lock:
+            job_ids = list(self._in_flight.values())
+        with SessionLocal() as db:
+            heartbeat_ingestion_jobs(db, job_ids)
+
+    def _requeue_stale_jobs(self) -> None:
+        with SessionLocal() as db:
+            num_requeued, num_failed = requeue_stale_ingestion_jobs(
+                db, timedelta(seconds=config.ingestion_job_timeout), config.ingestion_max_attempts
+            )
+        if num_requeued:
+            log.warning(f"Requeued {num_requeued} abandoned ingestion jobs")
+        if num_failed:
+            log.error(f"Failed {num_failed} ingestion jobs abandoned {config.ingestion_max_attempts} times")
+
+    def _submit(self, job_ids: List[str]) -> None:
+        for idx, job_id in enumerate(job_ids):
+            try:
+                future = self._executor.submit(process_ingestion_job, job_id)
+            except Exception:
+                # A process pool is broken for good once one of its children dies - replace it and give back the
+                # jobs it didn't take so they don't sit in processing until they go stale
+                log.exception("Failed to submit ingestion jobs, restarting the executor")
+                self._executor.shutdown(wait=False)
+                self._executor = self._create_executor()
+                self._release(job_ids[idx:])
+                return
+
+            with self._lock:
+                self._in_flight[future] = job_id
+            future.add_done_callback(self._on_done)
+
+    def _release(self, job_ids: List[str]) -> None:
+        try:
+            with SessionLocal() as db:
+                release_ingestion_jobs(db, job_ids)
+        except Exception:
+            log.exception(f"Failed to release ingestion jobs {job_ids}, they are requeued once stale")
+
+    def _sweep_abandoned_uploads(self) -> None:
+        """Fails direct uploads the browser never completed and deletes anything they left in storage"""
+        with SessionLocal() as db:
+            storage_keys = fail_abandoned_direct_uploads(db, timedelta(seconds=config.direct_upload_timeout))
+        for storage_key in storage_keys:
+            try:
+                storage.delete(storage_key)
+            except Exception:
+                log.exception(f"Failed to delete abandoned upload {storage_key}")
+        if storage_keys:
+            log.warning(f"Failed {len(storage_keys)} direct uploads that were never completed")
+
+    def _run_maintenance(self) -> None:
+        # Heartbeat first so this process' own long running jobs are never the ones requeued
+        tasks = [
+            (self._heartbeat, "Failed to heartbeat ingestion jobs"),
+            (self._requeue_stale_jobs, "Failed to requeue stale ingestion jobs"),
+            (self._sweep_abandoned_uploads, "Failed to sweep abandoned uploads"),
+        ]
+        for task, error in tasks:
+            try:
+                task()
+            except Exception:
+                log.exception(error)
+
+    def _run(self) -> None:
+        next_maintenance = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() >= next_maintenance:
+                self._run_maintenance()
+                next_maintenance = time.monotonic() + config.ingestion_maintenance_interval
+
+            with self._lock:
+                capacity = self._num_workers - len(self._in_flight)
+
+            job_ids = []
+            if capacity > 0:
+                try:
+                    with SessionLocal() as db:
+                        job_ids = claim_ingestion_jobs(db, capacity)
+                except Exception:
+                    log.exception("Failed to claim ingestion jobs")
+
+            self._submit(job_ids)
+
+            if not job_ids:
+                self._wake.wait(self._poll_interval)
+                self._wake.clear()
+
+
+ingestion_pool = IngestionWorkerPool(
+    config.ingestion_workers, executor=config.ingestion_executor, poll_interval=config.ingestion_poll_interval
+)
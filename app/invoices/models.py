@@ -1,11 +1,9 @@
-import io
 from datetime import datetime, timedelta
 from decimal import Decimal
 from enum import Enum
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 import humanize
-import pandas as pd
 from loguru import logger as log
 from pydantic import BaseModel, validator
 
@@ -14,6 +12,12 @@ from app.invoices.ocr.models import RawInvoiceBody
 from app.utils import format_date_american
 
 
+def format_amount(v: Decimal) -> Optional[str]:
+    if not v:
+        return None
+    return f"{Decimal(v):.2f}"
+
+
 class InvoiceStatusEnum(str, Enum):
     due = "due"
     overdue = "overdue"
@@ -21,14 +25,14 @@ class InvoiceStatusEnum(str, Enum):
     unknown = "unknown"
 
     @classmethod
-    def get_status(cls, is_paid: bool, due_date: datetime = None) -> "InvoiceStatusEnum":
+    def get_status(cls, is_paid: bool, due_date: datetime = None, now: datetime = None) -> "InvoiceStatusEnum":
         if is_paid:
             return cls.paid
 
         if not due_date:
             return cls.unknown
 
-        if datetime.utcnow() > due_date:
+        if (now or datetime.utcnow()) > due_date:
             return cls.overdue
 
         return cls.due
@@ -44,6 +48,9 @@ class CreateInvoice(BaseModel):
     due_date: datetime = None
     invoice_id: str = None
     image_uri: str = None
+    thumbnail_uri: str = None
+    preview_uri: str = None
+    content_hash: str = None
 
     raw_vendor_name: str = None
     raw_amount_due: str = None
@@ -77,6 +84,8 @@ class PublicInvoice(BaseModel):
     due_date: datetime = None
     invoice_id: str = None
     image_uri: str = None
+    thumbnail_uri: str = None
+    preview_uri: str = None
     humanized_due_date: Union[str, datetime] = None
     american_due_date: Union[str, datetime] = None
     category: str = None
@@ -92,9 +101,7 @@ class PublicInvoice(BaseModel):
 
     @validator("amount_due")
     def enforce_two_decimal_places(cls, v: Decimal) -> Optional[str]:
-        if not v:
-            return None
-        return f"{Decimal(v):.2f}"
+        return format_amount(v)
 
     @classmethod
     def from_orm(cls, db_invoice: Invoice) -> "PublicInvoice":
@@ -110,6 +117,35 @@ class PublicInvoice(BaseModel):
         )
 
 
+class InvoiceChangeEnum(str, Enum):
+    created = "created"
+    paid_status = "paid_status"
+    category = "category"
+    deleted = "deleted"
+
+
+class PublicInvoiceChange(BaseModel):
+    invoice_id: str
+    operation: InvoiceChangeEnum
+    data: Optional[Dict[str, Any]] = None
+    created_on: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class BulkInvoiceStatusEnum(str, Enum):
+    updated = "updated"
+    unchanged = "unchanged"
+    deleted = "deleted"
+    not_found = "not_found"
+
+
+class BulkInvoiceResult(BaseModel):
+    invoice_id: str
+    status: BulkInvoiceStatusEnum
+
+
 class PublicAgingReport(BaseModel):
     id: str
     csv_uri: str
@@ -123,21 +159,6 @@ class PublicAgingReport(BaseModel):
             **db_report.__dict__,
         )
 
-    @property
-    def as_df(self) -> pd.DataFrame:
-        import numpy as np
-        import requests
-
-        res = requests.get(self.csv_uri)
-        data = res.content.decode("utf8")
-        df = pd.read_csv(io.StringIO(data), header=2)
-        df = df.fillna("")
-        df.replace(np.nan, 0, inplace=True)
-        return df
-
-    def csv_html(self) -> str:
-        return self.as_df.to_html(index=False)
-
 
 class CategoryEnum(str, Enum):
     purchases = "purchases"
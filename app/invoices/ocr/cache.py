@@ -0,0 +1,41 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from loguru import logger as log
+
+
+class OcrResultCache:
+    """Disk cache of raw Textract summary fields keyed by the uploaded file's content hash.
+
+    The raw fields are cached (rather than RawInvoiceBody) so a change to how they are parsed can be
+    re-applied to previously seen invoices without paying for another Textract call.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self._directory, content_hash[:2], f"{content_hash}.json")
+
+    def get(self, content_hash: str) -> Optional[List[Dict]]:
+        try:
+            with open(self._path(content_hash)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            log.exception(f"Failed to read cached OCR result for {content_hash}")
+            return None
+
+    def set(self, content_hash: str, summary_fields: List[Dict]) -> None:
+        path = self._path(content_hash)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so concurrent readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(summary_fields, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            log.exception(f"Failed to cache OCR result for {content_hash}")
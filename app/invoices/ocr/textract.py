@@ -1,10 +1,12 @@
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 
 import boto3
 from loguru import logger as log
 from result import Err, Ok, Result
 
 from app.config import config as global_config
+from app.invoices.ocr.cache import OcrResultCache
 from app.invoices.ocr.models import RawInvoiceBody
 
 textract_client = boto3.client(
@@ -16,31 +18,63 @@ textract_client = boto3.client(
 
 
 class InvoiceImageProcessor:
-    def __init__(self, client: Any) -> None:
+    def __init__(self, client: Any, cache: Optional[OcrResultCache] = None, max_page_concurrency: int = 4) -> None:
         self._client = client
+        self._cache = cache
+        self._max_page_concurrency = max_page_concurrency
 
-    def apply(self, image_data: bytes) -> Result[RawInvoiceBody, str]:
-        res = self._client.analyze_expense(Document={"Bytes": image_data})
+    def apply(self, image_data: bytes, content_hash: str = None) -> Result[RawInvoiceBody, str]:
+        return self.apply_pages([image_data], content_hash=content_hash)
 
-        status_code = res["ResponseMetadata"]["HTTPStatusCode"]
-        if status_code != 200:
-            msg = f"Failed to parse with status code {status_code}"
-            log.exception(msg)
-            return Err(msg)
+    def apply_pages(self, pages: List[bytes], content_hash: str = None) -> Result[RawInvoiceBody, str]:
+        """Parses a (possibly multi-page) invoice - pages are sent to Textract concurrently and merged"""
+        if self._cache and content_hash:
+            summary_fields = self._cache.get(content_hash)
+            if summary_fields is not None:
+                log.debug(f"Using cached OCR result for {content_hash}")
+                return Ok(self._parse_texract_summary_fields(summary_fields))
 
-        # Only parse one document at a time
-        summary_fields = res["ExpenseDocuments"][0]["SummaryFields"]
+        if len(pages) == 1:
+            page_results = [self._analyze_page(pages[0], 1)]
+        else:
+            with ThreadPoolExecutor(min(self._max_page_concurrency, len(pages))) as executor:
+                page_results = list(executor.map(self._analyze_page, pages, range(1, len(pages) + 1)))
+
+        summary_fields = []
+        for page_result in page_results:
+            if page_result.is_err():
+                return page_result
+            summary_fields.extend(page_result.ok())
+
+        if self._cache and content_hash:
+            self._cache.set(content_hash, summary_fields)
 
         invoice_body = self._parse_texract_summary_fields(summary_fields)
         if not invoice_body.is_complete_parse():
-            log.warning(f"Not a complete parse: \n{invoice_body.dict()}\n \n{res}")
+            log.warning(f"Not a complete parse: \n{invoice_body.dict()}\n \n{summary_fields}")
 
         return Ok(invoice_body)
 
-    def _parse_texract_summary_fields(self, fields: Dict) -> RawInvoiceBody:
+    def _analyze_page(self, image_data: bytes, page_number: int) -> Result[List[Dict], str]:
+        res = self._client.analyze_expense(Document={"Bytes": image_data})
+
+        status_code = res["ResponseMetadata"]["HTTPStatusCode"]
+        if status_code != 200:
+            msg = f"Failed to parse page {page_number} with status code {status_code}"
+            log.exception(msg)
+            return Err(msg)
+
+        # Each call only sees one page so Textract always reports page 1
+        summary_fields = []
+        for document in res["ExpenseDocuments"]:
+            for field in document["SummaryFields"]:
+                summary_fields.append({**field, "PageNumber": page_number})
+        return Ok(summary_fields)
+
+    def _parse_texract_summary_fields(self, fields: List[Dict]) -> RawInvoiceBody:
         """
         Args:
-            fields (Dict): Example - {
+            fields (List[Dict]): Fields from every page, example - {
                "Type":{
                   "Text":"VENDOR_NAME",
                   "Confidence":99.35572814941406
@@ -52,6 +86,21 @@ class InvoiceImageProcessor:
                },
                "PageNumber":1
             }
+
+        When a field type is found more than once (e.g. a subtotal on page 1 and the total on the last page)
+        the value Textract is most confident in wins.
         """
-        dict_to_parse = {f["Type"]["Text"]: f["ValueDetection"]["Text"] for f in fields}
+        best_fields: Dict[str, Dict] = {}
+        for f in fields:
+            field_type = f["Type"]["Text"]
+            existing = best_fields.get(field_type)
+            if existing is None or self._field_confidence(f) > self._field_confidence(existing):
+                best_fields[field_type] = f
+
+        dict_to_parse = {t: f["ValueDetection"]["Text"] for t, f in best_fields.items()}
         return RawInvoiceBody(**dict_to_parse)
+
+    @staticmethod
+    def _field_confidence(field: Dict) -> float:
+        # A field is only as trustworthy as the weaker of its label and value detections
+        return min(field["Type"].get("Confidence", 0), field["ValueDetection"].get("Confidence", 0))
@@ -1,11 +1,8 @@
-import calendar
-import io
+import os
 from datetime import datetime, timedelta
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-import fitz
 import ulid
-from dateutil.relativedelta import relativedelta
 from fastapi import APIRouter, Depends, File, Request, Response, UploadFile
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
@@ -14,25 +11,50 @@ from loguru import logger as log
 from pydantic import BaseModel
 from result import Result
 from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from starlette.status import HTTP_302_FOUND
 
 from app.auth.utils import requires_authentication
-from app.db.models import AgingReport
-from app.db.session import SessionLocal
+from app.db.pagination import InvalidCursor
+from app.db.session import get_async_db
 from app.frontend.templates import template_response
-from app.invoices.aging_report.processor import AgingReportProcessor
-from app.invoices.ocr.textract import InvoiceImageProcessor, textract_client
-
-from .db_utils import (add_category_to_invoice, delete_invoice,
-                       get_aging_report_by_id, get_invoice_by_id,
-                       get_invoices_by_user, query_aging_reports,
+from app.invoices.aging_report.viewer import get_report_html
+from app.invoices.aging_report.writer import create_aging_report
+from app.invoices.calendar_view import (load_calendar_month,
+                                        resolve_calendar_month)
+from app.invoices.ingestion.bulk import ingest_bulk_upload
+from app.invoices.ingestion.models import (DirectUpload, DirectUploadRequest,
+                                           IngestionStatusEnum,
+                                           PublicIngestionJob)
+from app.invoices.ingestion.pipeline import (ALLOWED_CONTENT_TYPES,
+                                             upload_extension)
+from app.invoices.ingestion.worker import ingestion_pool
+from app.invoices.s3_utils import new_object_key
+from app.storage.backends import storage
+from app.storage.config import config as storage_config
+
+from .db_utils import (add_category_to_invoice, create_ingestion_job,
+                       delete_invoice, get_aging_report_by_id,
+                       get_ingestion_job_by_id, get_invoice_by_id,
+                       get_invoices_by_user, load_public_invoice,
+                       load_public_invoice_page, query_aging_reports,
                        query_invoices, remove_category_from_invoice,
-                       save_invoice, update_paid_status_invoice)
+                       update_ingestion_job, update_paid_status_invoice)
 from .models import CreateInvoice, PublicAgingReport, PublicInvoice
-from .s3_utils import upload_bytes_to_s3, upload_string_to_s3
 
 router = APIRouter()
-processor = InvoiceImageProcessor(textract_client)
+
+
+def upload_too_large_message() -> str:
+    return f"File must be at most {storage_config.max_upload_bytes // (1024 * 1024)} MB"
+
+
+async def load_invoice_page(db: AsyncSession, user_id: str, **kwargs) -> Tuple[Dict[str, Dict], Optional[str]]:
+    try:
+        return await db.run_sync(load_public_invoice_page, user_id, **kwargs)
+    except InvalidCursor as e:
+        raise HTTPException(400, detail=str(e))
 
 
 @router.get("/inbox", response_class=HTMLResponse)
@@ -44,13 +66,15 @@ async def get_home(
     desc: bool = True,
     limit: int = 100,
     offset: int = 0,
+    cursor: str = None,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    with SessionLocal() as db:
-        invoices = get_invoices_by_user(
-            db, user_id, filter_by=filter_by, order_by=order_by, limit=limit, offset=offset, desc=desc
-        )
-        invoices = {i.id: PublicInvoice.from_orm(i).dict() for i in invoices}
-    return template_response("./invoices/inbox.html", {"request": request, "invoices": invoices})
+    invoices, next_cursor = await load_invoice_page(
+        db, user_id, filter_by=filter_by, order_by=order_by, limit=limit, offset=offset, desc=desc, cursor=cursor
+    )
+    return template_response(
+        "./invoices/inbox.html", {"request": request, "invoices": invoices, "next_cursor": next_cursor}
+    )
 
 
 @router.get("/invoice-list", response_class=HTMLResponse)
@@ -62,29 +86,38 @@ async def get_home(
     desc: bool = True,
     limit: int = 100,
     offset: int = 0,
+    cursor: str = None,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    with SessionLocal() as db:
-        invoices = get_invoices_by_user(
-            db, user_id, filter_by=filter_by, order_by=order_by, limit=limit, offset=offset, desc=desc
-        )
-        invoices = {i.id: PublicInvoice.from_orm(i).dict() for i in invoices}
-    return template_response("./invoices/invoice-list.html", {"request": request, "invoices": invoices})
+    invoices, next_cursor = await load_invoice_page(
+        db, user_id, filter_by=filter_by, order_by=order_by, limit=limit, offset=offset, desc=desc, cursor=cursor
+    )
+    return template_response(
+        "./invoices/invoice-list.html", {"request": request, "invoices": invoices, "next_cursor": next_cursor}
+    )
 
 
 @router.get("/invoices/{invoice_id}", response_class=HTMLResponse)
-async def get_single_invoice(request: Request, invoice_id: str, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        invoice = get_invoice_by_id(db, invoice_id)
-        if not invoice:
-            return Response("404 Invoice not Found", status_code=404)
-        invoice = PublicInvoice.from_orm(invoice)
+async def get_single_invoice(
+    request: Request,
+    invoice_id: str,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    invoice = await db.run_sync(load_public_invoice, invoice_id)
+    if not invoice:
+        return Response("404 Invoice not Found", status_code=404)
     return template_response("./invoices/single-invoice.html", {"request": request, "data": jsonable_encoder(invoice)})
 
 
 @router.post("/invoices/{invoice_id}")
-async def post_single_invoice(invoice_id: str, paid: bool, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        update_paid_status_invoice(db, invoice_id, is_paid=paid)
+async def post_single_invoice(
+    invoice_id: str,
+    paid: bool,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await db.run_sync(update_paid_status_invoice, invoice_id, is_paid=paid)
     return RedirectResponse(f"/invoices/{invoice_id}", status_code=HTTP_302_FOUND)
 
 
@@ -94,41 +127,115 @@ async def get_register(request: Request):
 
 
 @router.post("/upload-invoice")
-async def post_upload_invoice(file: UploadFile = File(...), user_id: str = Depends(requires_authentication)):
-    allow_list = ("image/png", "image/jpeg", "image/jpg", "application/pdf")
-    if file.content_type not in allow_list:
+async def post_upload_invoice(
+    file: UploadFile = File(...),
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Form upload fallback for clients that can't upload directly - see post_direct_upload"""
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(422, detail="File must be a .png, .jpg, or .pdf")
 
-    file_data = await file.read()
-    if file.content_type == "application/pdf":
-        doc = fitz.open(stream=file_data, filetype="pdf")
-        page = doc.load_page(0)  # number of page
-        file_data = page.get_pixmap().tobytes(output="PNG")
+    file.file.seek(0, os.SEEK_END)
+    if file.file.tell() > storage_config.max_upload_bytes:
+        raise HTTPException(413, detail=upload_too_large_message())
+    file.file.seek(0)
+
+    # Streamed from starlette's spooled temp file to storage, so the file is never held in memory as a whole
+    storage_key = new_object_key(upload_extension(file.content_type))
+    await storage.upload_fileobj_async(storage_key, file.file, content_type=file.content_type)
+
+    # Hashing, duplicate checks, rasterize, OCR and save happen on the ingestion worker pool
+    job = await db.run_sync(create_ingestion_job, user_id, file.content_type, storage_key=storage_key)
+    ingestion_pool.notify()
+
+    return RedirectResponse("/inbox", status_code=HTTP_302_FOUND, headers={"X-Ingestion-Job-Id": job.id})
+
+
+@router.post("/upload-invoice/direct", response_model=DirectUpload)
+async def post_direct_upload(
+    body: DirectUploadRequest,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Starts an upload that goes from the browser straight to storage - the file never passes through the app"""
+    if body.content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(422, detail="File must be a .png, .jpg, or .pdf")
+    if body.content_length <= 0:
+        raise HTTPException(422, detail="File is empty")
+    if body.content_length > storage_config.max_upload_bytes:
+        raise HTTPException(413, detail=upload_too_large_message())
+
+    storage_key = new_object_key(upload_extension(body.content_type))
+    url = await storage.presign_upload_url_async(storage_key, body.content_type, body.content_length)
+    job = await db.run_sync(
+        create_ingestion_job,
+        user_id,
+        body.content_type,
+        storage_key=storage_key,
+        status=IngestionStatusEnum.awaiting_upload.value,
+    )
+    return DirectUpload(
+        job_id=job.id,
+        url=url,
+        headers={"Content-Type": body.content_type},
+        complete_url=f"/upload-invoice/direct/{job.id}/complete",
+        cancel_url=f"/upload-invoice/direct/{job.id}/cancel",
+    )
+
+
+@router.post("/upload-invoice/direct/{job_id}/complete")
+async def post_direct_upload_complete(
+    job_id: str, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    """Called once the browser's PUT succeeds - queues the uploaded file for processing"""
+    job = await db.run_sync(get_ingestion_job_by_id, job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(404, detail="Ingestion job not found")
+
+    if job.status == IngestionStatusEnum.awaiting_upload.value:
+        if not await storage.exists_async(job.storage_key):
+            raise HTTPException(409, detail="File has not been uploaded")
+        await db.run_sync(update_ingestion_job, job, status=IngestionStatusEnum.queued.value)
+        ingestion_pool.notify()
 
-    parse_result: Result = processor.apply(file_data)
-    if not parse_result.is_ok:
-        return parse_result.err()
+    return jsonable_encoder(PublicIngestionJob.from_orm(job))
 
-    raw_parse = parse_result.ok()
-    formatted_invoice = CreateInvoice.from_raw_parse(user_id, raw_parse)
 
-    # Upload image to S3
-    extension = file.content_type.split("/")[1]
-    formatted_invoice.image_uri = upload_bytes_to_s3(file_data, f"{str(ulid.ulid())}", extension)
+@router.post("/upload-invoice/direct/{job_id}/cancel")
+async def post_direct_upload_cancel(
+    job_id: str, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    """Called when the browser gives up on a direct upload - fails the job and deletes whatever was uploaded"""
+    job = await db.run_sync(get_ingestion_job_by_id, job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(404, detail="Ingestion job not found")
+
+    if job.status == IngestionStatusEnum.awaiting_upload.value:
+        await db.run_sync(
+            update_ingestion_job, job, status=IngestionStatusEnum.failed.value, error="Upload was cancelled"
+        )
+        await storage.delete_async(job.storage_key)
 
-    with SessionLocal() as db:
-        # TODO: Use file data to upsert based on image md5 hash
-        db_invoice = save_invoice(db, formatted_invoice)
+    return jsonable_encoder(PublicIngestionJob.from_orm(job))
 
-    return RedirectResponse(f"/invoices/{db_invoice.id}", status_code=HTTP_302_FOUND)
 
+@router.post("/upload-invoices")
+async def post_bulk_upload_invoices(
+    files: List[UploadFile] = File(...), user_id: str = Depends(requires_authentication)
+):
+    results = await run_in_threadpool(ingest_bulk_upload, user_id, files)
+    return jsonable_encoder(results)
 
-class CalendarDay(BaseModel):
-    year: int
-    month: int
-    day: int
-    active: bool
-    invoices_due: List[PublicInvoice] = []
+
+@router.get("/ingestion-jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: str, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    job = await db.run_sync(get_ingestion_job_by_id, job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(404, detail="Ingestion job not found")
+    return jsonable_encoder(PublicIngestionJob.from_orm(job))
 
 
 @router.get("/calendar", response_class=HTMLResponse)
@@ -139,70 +246,47 @@ async def get_register(
     next: bool = False,
     previous: bool = False,
     user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    # Validate combindations
-    if next and previous:
-        raise HTTPException(400, "Can't specify previous and next.")
-
-    # Build datetime from query params or default to now
-    if not (month and year):
-        month = datetime.utcnow().month
-        year = datetime.utcnow().year
-    current_dt = datetime(year, month, 1)
-
-    # Make adjustments if indicated
-    if next:
-        current_dt = current_dt + relativedelta(months=1)
-    if previous:
-        current_dt = current_dt - relativedelta(months=1)
-
-    # Ensure theser are up to date after any adjustments
-    month, year = current_dt.month, current_dt.year
-
-    with SessionLocal() as db:
-        calendar_days = []
-        calendar_view = calendar.Calendar(firstweekday=6)
-
-        for date in calendar_view.itermonthdates(year, month):
-            due_this_date = query_invoices(db, due_date=date, user_id=user_id)
-            calendar_days.append(
-                CalendarDay(
-                    year=date.year,
-                    month=date.month,
-                    day=date.day,
-                    active=month == date.month,
-                    invoices_due=[PublicInvoice.from_orm(i) for i in due_this_date],
-                )
-            )
+    current_dt = resolve_calendar_month(year, month, next=next, previous=previous)
+    calendar_days = await db.run_sync(load_calendar_month, user_id, current_dt.year, current_dt.month)
 
     return template_response(
         "./invoices/calendar.html",
         {
             "request": request,
             "date_string": current_dt.strftime("%B %Y"),
-            "month": month,
-            "year": year,
+            "month": current_dt.month,
+            "year": current_dt.year,
             "days": jsonable_encoder(calendar_days),
         },
     )
 
 
 @router.get("/aging-reports/{report_id}", response_class=HTMLResponse)
-async def get_aging_reports(request: Request, report_id: str, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        report = get_aging_report_by_id(db, report_id)
-        report = PublicAgingReport.from_orm(report)
+async def get_aging_reports(
+    request: Request,
+    report_id: str,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    report = await db.run_sync(get_aging_report_by_id, report_id)
+    if not report:
+        return Response("404 Aging Report not Found", status_code=404)
+    report = PublicAgingReport.from_orm(report)
+    report_html = await get_report_html(report)
     return template_response(
         "./invoices/single-aging-report.html",
-        {"request": request, "report_html": report.csv_html(), "report": jsonable_encoder(report)},
+        {"request": request, "report_html": report_html, "report": jsonable_encoder(report)},
     )
 
 
 @router.get("/aging-reports", response_class=HTMLResponse)
-async def get_aging_reports(request: Request, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        reports = query_aging_reports(db, user_id, order_by="created_on", desc=True)
-        reports = [PublicAgingReport.from_orm(r) for r in reports]
+async def get_aging_reports(
+    request: Request, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    reports = await db.run_sync(query_aging_reports, user_id, order_by="created_on", desc=True)
+    reports = [PublicAgingReport.from_orm(r) for r in reports]
     return template_response(
         "./invoices/aging-reports.html", {"request": request, "reports": jsonable_encoder(reports)}
     )
@@ -210,21 +294,8 @@ async def get_aging_reports(request: Request, user_id: str = Depends(requires_au
 
 @router.post("/aging-reports/create", response_class=RedirectResponse)
 async def post_generate_aging_report(user_id: str = Depends(requires_authentication)):
-
-    with SessionLocal() as db:
-        data = AgingReportProcessor.fetch_data(db, user_id)
-        df = AgingReportProcessor().apply(data)
-
-        # Convert DF to buffer and save to S3
-        stream = io.StringIO()
-        stream.write(f'{datetime.utcnow().strftime("%m/%d/%Y")} - Accounts Payable Aging Report,\n,\n')
-        df.to_csv(stream, index=False)
-        s3_uri = upload_string_to_s3(stream.getvalue(), f"aging-report-{datetime.utcnow()}-{ulid.ulid()}", "csv")
-
-        # Save report
-        new_report = AgingReport(user_id=user_id, csv_uri=s3_uri)
-        db.add(new_report)
-        db.commit()
+    # Streams from a server side cursor into S3 - blocking so it runs on the threadpool with a sync session
+    await run_in_threadpool(create_aging_report, user_id)
 
     return RedirectResponse("/aging-reports", status_code=HTTP_302_FOUND)
 
@@ -236,24 +307,48 @@ class AddCategoryBody(BaseModel):
     category_name: str
 
 
+@router.get("/calendar/json")
+async def get_calendar_json(
+    year: int = None,
+    month: int = None,
+    next: bool = False,
+    previous: bool = False,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    current_dt = resolve_calendar_month(year, month, next=next, previous=previous)
+    calendar_days = await db.run_sync(load_calendar_month, user_id, current_dt.year, current_dt.month)
+
+    return {"year": current_dt.year, "month": current_dt.month, "days": jsonable_encoder(calendar_days)}
+
+
 @router.put("/invoices/{invoice_id}/categories")
-async def put_single_invoice(invoice_id: str, body: AddCategoryBody, user_id: str = Depends(requires_authentication)):
+async def put_single_invoice(
+    invoice_id: str,
+    body: AddCategoryBody,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
     # Add categories
-    with SessionLocal() as db:
-        add_category_to_invoice(db, user_id, invoice_id, body.category_name)
+    await db.run_sync(add_category_to_invoice, user_id, invoice_id, body.category_name)
     return Response(status_code=201)
 
 
 @router.delete("/invoices/{invoice_id}/categories")
-async def put_single_invoice(invoice_id: str, category_name: str, user_id: str = Depends(requires_authentication)):
+async def put_single_invoice(
+    invoice_id: str,
+    category_name: str,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
     # Add categories
-    with SessionLocal() as db:
-        remove_category_from_invoice(db, user_id, invoice_id, category_name)
+    await db.run_sync(remove_category_from_invoice, user_id, invoice_id, category_name)
     return Response(status_code=200)
 
 
 @router.delete("/invoices/{invoice_id}")
-async def delete_single_invoice(invoice_id: str, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        delete_invoice(db, invoice_id)
+async def delete_single_invoice(
+    invoice_id: str, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    await db.run_sync(delete_invoice, invoice_id)
     return Response(status_code=200)
@@ -1,34 +1,22 @@
-import io
-import time
+import ulid
 
-import boto3
-from loguru import logger as log
+from app.storage.backends import storage
 
-from app.config import config as global_config
+# Despite the module name these go through whichever storage backend is configured - see app.storage
 
-from .config import config
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=global_config.aws_access_key,
-    aws_secret_access_key=global_config.aws_secret_key,
-    region_name=global_config.aws_region_name,
-)
+def new_object_key(extension: str) -> str:
+    return f"{ulid.ulid()}.{extension}"
 
 
-def get_object_uri(image_name: str, extension: str):
-    return f"https://{config.s3_bucket_name}.s3.amazonaws.com/{image_name}.{extension}"
+def get_object_uri(image_name: str, extension: str = None) -> str:
+    """Public uri of a stored object - pass a full key (see new_object_key) or a name and extension"""
+    return storage.uri(f"{image_name}.{extension}" if extension else image_name)
 
 
-def upload_bytes_to_s3(object: bytes, filename: str, extension: str) -> str:
-    start = time.time()
-    s3_client.upload_fileobj(io.BytesIO(object), config.s3_bucket_name, f"{filename}.{extension}")
-    log.debug(f"Uploaded {filename}.{extension} to s3 in {round(time.time() - start, ndigits=2)}")
-    return get_object_uri(filename, extension)
+def upload_bytes_to_s3(object: bytes, filename: str, extension: str, content_type: str = None) -> str:
+    return storage.upload_bytes(f"{filename}.{extension}", object, content_type=content_type)
 
 
-def upload_string_to_s3(object: str, filename: str, extension: str) -> str:
-    start = time.time()
-    s3_client.put_object(Bucket=config.s3_bucket_name, Body=object, Key=f"{filename}.{extension}")
-    log.debug(f"Uploaded {filename}.{extension} to s3 in {round(time.time() - start, ndigits=2)}")
-    return get_object_uri(filename, extension)
+def upload_string_to_s3(object: str, filename: str, extension: str, content_type: str = None) -> str:
+    return storage.upload_bytes(f"{filename}.{extension}", object.encode("utf8"), content_type=content_type)
@@ -0,0 +1,78 @@
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import humanize
+
+from app.db.models import Invoice
+from app.utils import format_date_american
+
+from .models import InvoiceStatusEnum, format_amount
+
+# Just the columns PublicInvoice exposes, selected as plain tuples so no ORM identity map or lazy loads are involved.
+# Category names are fetched for the whole page separately - see db_utils.get_category_names_by_invoice_id
+PUBLIC_INVOICE_COLUMNS = (
+    Invoice.id,
+    Invoice.is_paid,
+    Invoice.vendor_name,
+    Invoice.amount_due,
+    Invoice.currency,
+    Invoice.due_date,
+    Invoice.invoice_id,
+    Invoice.image_uri,
+    Invoice.thumbnail_uri,
+    Invoice.preview_uri,
+)
+
+
+class PublicInvoiceRowSerializer:
+    """Turns rows selected with PUBLIC_INVOICE_COLUMNS into the same dicts as PublicInvoice.from_orm(...).dict()
+
+    Skips pydantic entirely. One instance is meant to serve one request - "now" is fixed when it's created so
+    every row's status and humanized date agree, and date formatting is memoized since pages tend to have many
+    invoices due on the same day.
+    """
+
+    def __init__(self, now: datetime = None) -> None:
+        self.now = now or datetime.utcnow()
+        self._american_dates: Dict[date, Optional[str]] = {}
+        self._humanized_dates: Dict[datetime, str] = {}
+
+    def american_date(self, dt: Optional[datetime]) -> Optional[str]:
+        if dt is None:
+            return None
+        key = dt.date()
+        if key not in self._american_dates:
+            self._american_dates[key] = format_date_american(dt)
+        return self._american_dates[key]
+
+    def humanized_date(self, dt: Optional[datetime]) -> str:
+        if dt is None:
+            return "unknown"
+        if dt not in self._humanized_dates:
+            self._humanized_dates[dt] = humanize.naturaltime(self.now - dt)
+        return self._humanized_dates[dt]
+
+    def serialize(self, row: Any, category: str = None) -> Dict[str, Any]:
+        due_date = row.due_date
+        amount_due = row.amount_due
+        return {
+            "id": row.id,
+            "is_paid": row.is_paid,
+            "vendor_name": row.vendor_name,
+            # PublicInvoice coerces the Decimal to str before formatting so 0 becomes "0.00" rather than None
+            "amount_due": None if amount_due is None else format_amount(str(amount_due)),
+            "status": InvoiceStatusEnum.get_status(row.is_paid, due_date, now=self.now).value,
+            "currency": row.currency,
+            "due_date": due_date,
+            "invoice_id": row.invoice_id,
+            "image_uri": row.image_uri,
+            "thumbnail_uri": row.thumbnail_uri,
+            "preview_uri": row.preview_uri,
+            "humanized_due_date": self.humanized_date(due_date),
+            "american_due_date": self.american_date(due_date),
+            "category": category,
+        }
+
+    def serialize_many(self, rows: Iterable[Any], categories: Dict[str, str] = None) -> List[Dict[str, Any]]:
+        categories = categories or {}
+        return [self.serialize(row, category=categories.get(row.id)) for row in rows]
@@ -0,0 +1,61 @@
+import threading
+
+import sqlalchemy as sa
+from loguru import logger as log
+
+from app.db.session import SessionLocal
+from app.invoices.config import config
+from app.invoices.db_utils import reconcile_invoice_stats
+
+# Arbitrary advisory lock key so only one app process reconciles at a time
+RECONCILE_LOCK_KEY = 0x1F0C_57A7
+
+
+class InvoiceStatsReconciler:
+    """Periodically recomputes invoice_stats from the invoices table.
+
+    Writes keep the table up to date incrementally, this only catches drift (races, writes that bypass
+    db_utils) so it runs rarely.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._thread: threading.Thread = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._thread or self._interval <= 0:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="invoice-stats-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self._thread:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reconcile(self) -> int:
+        with SessionLocal() as db:
+            # Transaction scoped - released by the commit in reconcile_invoice_stats
+            if not db.execute(sa.select(sa.func.pg_try_advisory_xact_lock(RECONCILE_LOCK_KEY))).scalar():
+                return 0
+            return reconcile_invoice_stats(db)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                num_fixed = self.reconcile()
+            except Exception:
+                log.exception("Failed to reconcile invoice stats")
+                continue
+
+            if num_fixed:
+                log.warning(f"Reconciled {num_fixed} drifted invoice_stats rows")
+
+
+invoice_stats_reconciler = InvoiceStatsReconciler(config.invoice_stats_reconcile_interval)
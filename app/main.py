@@ -1,3 +1,5 @@
+import os
+
 import rollbar
 from fastapi import APIRouter, Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,14 +9,26 @@ from rollbar.contrib.fastapi import ReporterMiddleware as RollbarMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.status import HTTP_302_FOUND
 
-from app.auth.utils import optional_authentication
+from app.auth.config import config as auth_config
+from app.auth.session_store import (MemorySessionBackend,
+                                    PostgresSessionBackend,
+                                    ServerSessionMiddleware)
+from app.auth.utils import optional_authentication, shutdown_password_hash_pool
 
 from .admin.router import router as admin_router
+from .api.router import router as api_router
 from .auth.router import router as auth_router
 from .config import config as global_config
+from .invoices.ingestion.derivatives import (derivative_backfiller,
+                                             shutdown_derivative_pool)
+from .invoices.ingestion.rasterize import shutdown_rasterize_pool
+from .invoices.ingestion.worker import ingestion_pool
 from .invoices.router import router as invoices_router
+from .invoices.stats_reconciler import invoice_stats_reconciler
 from .marketing.router import router as marketing_router
 from .payments.router import router as payments_router
+from .storage.backends import LocalStorageBackend, storage
+from .storage.router import router as storage_router
 from .users.router import router as users_router
 from .vendors.router import router as vendors_router
 
@@ -27,8 +41,31 @@ else:
     app = FastAPI()
 
 app.mount("/static", StaticFiles(directory="app/frontend/static"), name="static")
+if isinstance(storage, LocalStorageBackend):
+    # Stands in for the S3 bucket's public urls
+    os.makedirs(storage.directory, exist_ok=True)
+    app.mount(storage.url_path, StaticFiles(directory=storage.directory), name="storage")
+
+if auth_config.session_backend == "cookie":
+    app.add_middleware(SessionMiddleware, secret_key=global_config.session_secret, max_age=auth_config.session_max_age)
+else:
+    if auth_config.session_backend == "memory":
+        # Already in memory so the per process cache in front of it would only duplicate entries
+        session_backend = MemorySessionBackend(auth_config.session_cache_size, auth_config.session_max_age)
+        session_cache_size = 0
+    elif auth_config.session_backend == "postgres":
+        session_backend = PostgresSessionBackend()
+        session_cache_size = auth_config.session_cache_size
+    else:
+        raise ValueError("session_backend must be one of 'cookie', 'memory' or 'postgres'")
 
-app.add_middleware(SessionMiddleware, secret_key=global_config.session_secret)
+    app.add_middleware(
+        ServerSessionMiddleware,
+        backend=session_backend,
+        max_age=auth_config.session_max_age,
+        cache_size=session_cache_size,
+        cache_ttl=auth_config.session_cache_ttl,
+    )
 app.add_middleware(CORSMiddleware)
 
 app.include_router(auth_router)
@@ -38,6 +75,8 @@ app.include_router(payments_router)
 app.include_router(users_router)
 app.include_router(vendors_router)
 app.include_router(admin_router)
+app.include_router(api_router)
+app.include_router(storage_router)
 
 
 global_router = APIRouter()
@@ -56,3 +95,21 @@ def get_index(user_id: str = Depends(optional_authentication)):
 
 
 app.include_router(global_router)
+
+
+@app.on_event("startup")
+def start_background_workers():
+    ingestion_pool.start()
+    invoice_stats_reconciler.start()
+    derivative_backfiller.start()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    ingestion_pool.stop()
+    invoice_stats_reconciler.stop()
+    derivative_backfiller.stop()
+    shutdown_rasterize_pool()
+    shutdown_derivative_pool()
+    shutdown_password_hash_pool()
+    storage.shutdown()
@@ -0,0 +1,415 @@
+import asyncio
+import hashlib
+import hmac
+import io
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, AsyncIterator, Callable, Optional
+from urllib.parse import urlencode
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotocoreConfig
+from botocore.exceptions import ClientError
+from loguru import logger as log
+
+from app.config import config as global_config
+
+from .config import config
+
+
+class StorageBackend:
+    """Blocking object storage operations plus `_async` variants that run them on a bounded thread pool.
+
+    Objects are addressed by key. `uri` is the public address stored on rows (invoice image_uri, report csv_uri)
+    and `key_from_uri` maps those back, returning None for uris this backend didn't produce.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def uri(self, key: str) -> str:
+        raise NotImplementedError
+
+    def key_from_uri(self, uri: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def upload_bytes(self, key: str, data: bytes, content_type: str = None) -> str:
+        """Stores data under key and returns its uri"""
+        return self.upload_fileobj(key, io.BytesIO(data), content_type=content_type)
+
+    def upload_fileobj(self, key: str, fileobj: IO[bytes], content_type: str = None) -> str:
+        """Like upload_bytes but streams from a binary file object instead of holding the whole object"""
+        raise NotImplementedError
+
+    def download_bytes(self, key: str) -> bytes:
+        buffer = io.BytesIO()
+        self.download_fileobj(key, buffer)
+        return buffer.getvalue()
+
+    def download_fileobj(self, key: str, fileobj: IO[bytes]) -> None:
+        """Like download_bytes but streams into a binary file object instead of returning the whole object"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def presign_url(self, key: str, expires_in: int = None) -> str:
+        """Time limited url to read the object without credentials"""
+        raise NotImplementedError
+
+    def presign_upload_url(self, key: str, content_type: str, content_length: int, expires_in: int = None) -> str:
+        """Time limited url a client can PUT the object to directly.
+
+        The client must send content_type as Content-Type and a body of at most content_length bytes.
+        """
+        raise NotImplementedError
+
+    def open_writer(self, key: str) -> IO[str]:
+        """Context manager for writing a text object incrementally - see S3MultipartWriter"""
+        raise NotImplementedError
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix="storage")
+        return self._executor
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    async def _run(self, fn: Callable, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+
+    async def upload_bytes_async(self, key: str, data: bytes, content_type: str = None) -> str:
+        return await self._run(self.upload_bytes, key, data, content_type)
+
+    async def upload_fileobj_async(self, key: str, fileobj: IO[bytes], content_type: str = None) -> str:
+        return await self._run(self.upload_fileobj, key, fileobj, content_type)
+
+    async def download_bytes_async(self, key: str) -> bytes:
+        return await self._run(self.download_bytes, key)
+
+    async def download_fileobj_async(self, key: str, fileobj: IO[bytes]) -> None:
+        return await self._run(self.download_fileobj, key, fileobj)
+
+    async def exists_async(self, key: str) -> bool:
+        return await self._run(self.exists, key)
+
+    async def delete_async(self, key: str) -> None:
+        return await self._run(self.delete, key)
+
+    async def presign_url_async(self, key: str, expires_in: int = None) -> str:
+        return await self._run(self.presign_url, key, expires_in)
+
+    async def presign_upload_url_async(
+        self, key: str, content_type: str, content_length: int, expires_in: int = None
+    ) -> str:
+        return await self._run(self.presign_upload_url, key, content_type, content_length, expires_in)
+
+
+class S3StorageBackend(StorageBackend):
+    def __init__(self, bucket_name: str, client: Any, transfer_config: TransferConfig, max_workers: int) -> None:
+        super().__init__(max_workers)
+        self.bucket_name = bucket_name
+        self.client = client
+        self.transfer_config = transfer_config
+
+    def uri(self, key: str) -> str:
+        return f"https://{self.bucket_name}.s3.amazonaws.com/{key}"
+
+    def key_from_uri(self, uri: str) -> Optional[str]:
+        prefix = self.uri("")
+        return uri[len(prefix) :] if uri.startswith(prefix) else None
+
+    def upload_fileobj(self, key: str, fileobj: IO[bytes], content_type: str = None) -> str:
+        start = time.time()
+        extra_args = {"ContentType": content_type} if content_type else None
+        self.client.upload_fileobj(fileobj, self.bucket_name, key, ExtraArgs=extra_args, Config=self.transfer_config)
+        log.debug(f"Uploaded {key} to s3 in {round(time.time() - start, ndigits=2)}")
+        return self.uri(key)
+
+    def download_fileobj(self, key: str, fileobj: IO[bytes]) -> None:
+        self.client.download_fileobj(self.bucket_name, key, fileobj, Config=self.transfer_config)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def presign_url(self, key: str, expires_in: int = None) -> str:
+        # Signed locally - no request is made
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket_name, "Key": key},
+            ExpiresIn=expires_in or config.presigned_url_expires_in,
+        )
+
+    def presign_upload_url(self, key: str, content_type: str, content_length: int, expires_in: int = None) -> str:
+        # Browsers PUT straight to the bucket, which needs a CORS rule allowing PUT from the app's origin.
+        # Content-Length is a signed header so S3 rejects a body of any other size
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket_name,
+                "Key": key,
+                "ContentType": content_type,
+                "ContentLength": content_length,
+            },
+            ExpiresIn=expires_in or config.presigned_url_expires_in,
+        )
+
+    def open_writer(self, key: str) -> "S3MultipartWriter":
+        return S3MultipartWriter(self, key)
+
+
+class S3MultipartWriter:
+    """File like object that uploads to S3 in fixed size parts as it is written to.
+
+    At most one part is buffered at a time so memory stays bounded no matter how much is written. Use as a
+    context manager - the upload is completed on a clean exit and aborted if an exception is raised.
+    """
+
+    def __init__(self, backend: S3StorageBackend, key: str, part_size: int = None) -> None:
+        # S3 requires every part but the last to be at least 5MB
+        self._part_size = max(part_size or config.s3_multipart_part_size, 5 * 1024 * 1024)
+        self._backend = backend
+        self._key = key
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = None
+        self._start = None
+
+    def __enter__(self) -> "S3MultipartWriter":
+        self._start = time.time()
+        res = self._backend.client.create_multipart_upload(Bucket=self._backend.bucket_name, Key=self._key)
+        self._upload_id = res["UploadId"]
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        client = self._backend.client
+        if exc_type:
+            client.abort_multipart_upload(Bucket=self._backend.bucket_name, Key=self._key, UploadId=self._upload_id)
+            return
+
+        self._upload_part()
+        client.complete_multipart_upload(
+            Bucket=self._backend.bucket_name,
+            Key=self._key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+        log.debug(f"Uploaded {self._key} to s3 in {len(self._parts)} parts in {round(time.time() - self._start, 2)}")
+
+    @property
+    def uri(self) -> str:
+        return self._backend.uri(self._key)
+
+    def write(self, data: str) -> int:
+        self._buffer.extend(data.encode("utf8"))
+        if len(self._buffer) >= self._part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self) -> None:
+        # The final part may be empty when nothing has been written yet - S3 still needs one part
+        if not self._buffer and self._parts:
+            return
+
+        part_number = len(self._parts) + 1
+        res = self._backend.client.upload_part(
+            Bucket=self._backend.bucket_name,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer),
+        )
+        self._parts.append({"ETag": res["ETag"], "PartNumber": part_number})
+        self._buffer = bytearray()
+
+
+# Where the local backend accepts presigned uploads - kept apart from url_path, which is a read only static mount
+LOCAL_UPLOAD_PATH = "/storage-uploads"
+
+
+class LocalStorageBackend(StorageBackend):
+    """Objects as files in a local directory, served by the app under url_path - for running without AWS"""
+
+    def __init__(self, directory: str, url_path: str, max_workers: int, upload_secret: str = None) -> None:
+        super().__init__(max_workers)
+        self.directory = directory
+        self.url_path = url_path.rstrip("/")
+        # Signs presigned upload urls - see app.storage.router
+        self._upload_secret = (upload_secret or "local-storage").encode()
+
+    def path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep):
+            raise ValueError(f"Invalid storage key {key}")
+        return path
+
+    def uri(self, key: str) -> str:
+        return f"{self.url_path}/{key}"
+
+    def key_from_uri(self, uri: str) -> Optional[str]:
+        prefix = self.uri("")
+        return uri[len(prefix) :] if uri.startswith(prefix) else None
+
+    def upload_fileobj(self, key: str, fileobj: IO[bytes], content_type: str = None) -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.uri(key)
+
+    def download_bytes(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def download_fileobj(self, key: str, fileobj: IO[bytes]) -> None:
+        with open(self.path(key), "rb") as f:
+            shutil.copyfileobj(f, fileobj)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def presign_url(self, key: str, expires_in: int = None) -> str:
+        # Served without authentication so the plain uri already works
+        return self.uri(key)
+
+    def _upload_signature(self, key: str, content_type: str, content_length: int, expires: int) -> str:
+        message = f"{key}\n{content_type}\n{content_length}\n{expires}".encode()
+        return hmac.new(self._upload_secret, message, hashlib.sha256).hexdigest()
+
+    def presign_upload_url(self, key: str, content_type: str, content_length: int, expires_in: int = None) -> str:
+        expires = int(time.time()) + (expires_in or config.presigned_url_expires_in)
+        signature = self._upload_signature(key, content_type, content_length, expires)
+        params = {"content_length": content_length, "expires": expires, "signature": signature}
+        return f"{LOCAL_UPLOAD_PATH}/{key}?{urlencode(params)}"
+
+    def verify_upload(self, key: str, content_type: str, content_length: int, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._upload_signature(key, content_type, content_length, expires), signature)
+
+    async def upload_stream_async(self, key: str, chunks: AsyncIterator[bytes]) -> str:
+        """Writes a request body to key as it arrives - the local stand in for a presigned PUT to S3"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        f = await self._run(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await self._run(f.write, chunk)
+            await self._run(f.close)
+            await self._run(os.replace, tmp_path, path)
+        except BaseException:
+            f.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.uri(key)
+
+    def open_writer(self, key: str) -> "LocalFileWriter":
+        return LocalFileWriter(self, key)
+
+
+class LocalFileWriter:
+    """Same interface as S3MultipartWriter for the local backend"""
+
+    def __init__(self, backend: LocalStorageBackend, key: str) -> None:
+        self._backend = backend
+        self._key = key
+        self._file: Optional[IO[str]] = None
+        self._tmp_path: Optional[str] = None
+
+    def __enter__(self) -> "LocalFileWriter":
+        path = self._backend.path(self._key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._tmp_path, "w", encoding="utf8")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._file.close()
+        if exc_type:
+            os.remove(self._tmp_path)
+            return
+        os.replace(self._tmp_path, self._backend.path(self._key))
+
+    @property
+    def uri(self) -> str:
+        return self._backend.uri(self._key)
+
+    def write(self, data: str) -> int:
+        return self._file.write(data)
+
+
+def create_storage_backend() -> StorageBackend:
+    if config.storage_backend == "local":
+        return LocalStorageBackend(
+            config.local_storage_dir,
+            config.local_storage_url_path,
+            config.storage_workers,
+            upload_secret=global_config.session_secret,
+        )
+
+    if config.storage_backend != "s3":
+        raise ValueError("storage_backend must be one of 's3' or 'local'")
+
+    client = boto3.client(
+        "s3",
+        aws_access_key_id=global_config.aws_access_key,
+        aws_secret_access_key=global_config.aws_secret_key,
+        region_name=global_config.aws_region_name,
+        config=BotocoreConfig(
+            max_pool_connections=config.s3_max_pool_connections,
+            connect_timeout=config.s3_connect_timeout,
+            read_timeout=config.s3_read_timeout,
+            retries={"max_attempts": config.s3_max_attempts, "mode": "standard"},
+            # SigV2 presigned urls don't sign Content-Length - see S3StorageBackend.presign_upload_url
+            signature_version="s3v4",
+        ),
+    )
+    transfer_config = TransferConfig(
+        multipart_threshold=config.s3_multipart_threshold,
+        multipart_chunksize=config.s3_multipart_part_size,
+        max_concurrency=config.s3_transfer_concurrency,
+    )
+    return S3StorageBackend(config.s3_bucket_name, client, transfer_config, config.storage_workers)
+
+
+# boto3 clients are thread safe - one per process keeps a single connection pool
+storage = create_storage_backend()
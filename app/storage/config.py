@@ -0,0 +1,32 @@
+from pydantic import BaseSettings
+
+
+class StorageSettings(BaseSettings):
+    # Where invoice images and aging reports are kept - "s3" or "local" (a directory served by the app itself)
+    storage_backend: str = "s3"
+    # Blocking storage calls made from async code run on a pool of this many threads
+    storage_workers: int = 16
+    presigned_url_expires_in: int = 3600  # seconds
+    # Largest file a client may upload - presigned uploads are signed for the exact size the client declared
+    max_upload_bytes: int = 20 * 1024 * 1024
+
+    s3_bucket_name: str = "aap-invoice-images"
+    # Shared by every thread using the client - keep at least storage_workers * s3_transfer_concurrency
+    s3_max_pool_connections: int = 64
+    s3_connect_timeout: float = 5  # seconds
+    s3_read_timeout: float = 60  # seconds
+    s3_max_attempts: int = 3
+    # Managed transfers - objects above the threshold are sent as concurrent multipart uploads
+    s3_multipart_threshold: int = 8 * 1024 * 1024  # bytes
+    s3_multipart_part_size: int = 8 * 1024 * 1024  # bytes
+    s3_transfer_concurrency: int = 4  # threads per transfer
+
+    local_storage_dir: str = ".storage"
+    local_storage_url_path: str = "/storage"
+
+    class Config:
+        env_file = ".env"
+        case_sensitive = False
+
+
+config = StorageSettings()
@@ -0,0 +1,39 @@
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Request, Response
+from fastapi.exceptions import HTTPException
+
+from .backends import LOCAL_UPLOAD_PATH, LocalStorageBackend, storage
+from .config import config
+
+router = APIRouter()
+
+
+async def limit_body(chunks: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    """Passes a request body through, failing with 413 as soon as it goes over max_bytes"""
+    num_bytes = 0
+    async for chunk in chunks:
+        num_bytes += len(chunk)
+        if num_bytes > max_bytes:
+            raise HTTPException(413, detail="Upload is larger than declared or allowed")
+        yield chunk
+
+
+@router.put(LOCAL_UPLOAD_PATH + "/{key:path}")
+async def put_local_upload(key: str, content_length: int, expires: int, signature: str, request: Request):
+    """Receives presigned uploads for the local storage backend - S3 takes these directly"""
+    if not isinstance(storage, LocalStorageBackend):
+        raise HTTPException(404, detail="Not found")
+
+    content_type = request.headers.get("content-type", "")
+    if not storage.verify_upload(key, content_type, content_length, expires, signature):
+        raise HTTPException(403, detail="Upload url is invalid or has expired")
+
+    # The signed length was checked against max_upload_bytes when the url was issued - both are enforced here
+    max_bytes = min(content_length, config.max_upload_bytes)
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise HTTPException(413, detail="Upload is larger than declared or allowed")
+
+    # Anything written so far is discarded if the body runs over
+    await storage.upload_stream_async(key, limit_body(request.stream(), max_bytes))
+    return Response(status_code=200)
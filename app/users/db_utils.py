@@ -3,7 +3,21 @@ from typing import Optional
 import sqlalchemy as sa
 
 import app.db.models as db_models
+from app.db.cache import create_cache
+from app.db.config import config
+
+# Users never move between organizations so entries only age out
+organization_id_cache = create_cache("organization_id_by_user", config.id_cache_size, config.id_cache_ttl)
 
 
 def get_user_by_id(db: sa.orm.Session, user_id: int) -> Optional[db_models.User]:
     return db.query(db_models.User).filter_by(id=user_id).first()
+
+
+def get_organization_id_by_user_id(db: sa.orm.Session, user_id: str) -> Optional[str]:
+    organization_id = organization_id_cache.get(user_id)
+    if organization_id is None:
+        organization_id = db.query(db_models.User.organization_id).filter_by(id=user_id).scalar()
+        if organization_id is not None:
+            organization_id_cache.set(user_id, organization_id)
+    return organization_id
@@ -1,14 +1,19 @@
+from decimal import Decimal
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_302_FOUND
 
 import app.invoices.db_utils as invoice_utils
 from app.auth.utils import requires_authentication
-from app.db.session import SessionLocal
+from app.db.session import SessionLocal, get_async_db
 from app.frontend.templates import template_response
+from app.invoices.models import format_amount
 from app.users.db_utils import get_user_by_id
 
 from .models import User
@@ -20,16 +25,23 @@ class DashboardData(BaseModel):
     num_due_soon: int
     num_overdue: int
     num_paid: int
+    num_unpaid: int
+    amount_due_soon: Optional[str]
+    amount_overdue: Optional[str]
+    amount_paid: Optional[str]
+    amount_unpaid: Optional[str]
 
+    @validator("amount_due_soon", "amount_overdue", "amount_paid", "amount_unpaid", pre=True)
+    def enforce_two_decimal_places(cls, v: Decimal) -> Optional[str]:
+        return format_amount(v)
 
-@router.get("/dashboard", response_class=HTMLResponse)
-async def get_dashboard(request: Request, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        num_due_soon = invoice_utils.get_num_due_soon(db, user_id)
-        num_overdue = invoice_utils.get_num_overdue(db, user_id)
-        num_paid = invoice_utils.get_num_paid(db, user_id)
 
-    data = DashboardData(num_due_soon=num_due_soon, num_overdue=num_overdue, num_paid=num_paid)
+@router.get("/dashboard", response_class=HTMLResponse)
+async def get_dashboard(
+    request: Request, user_id: str = Depends(requires_authentication), db: AsyncSession = Depends(get_async_db)
+):
+    counters = await db.run_sync(invoice_utils.get_dashboard_counters, user_id)
+    data = DashboardData(**counters)
 
     return template_response("./users/dashboard.html", {"request": request, "data": jsonable_encoder(data)})
 
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
 
@@ -6,3 +6,10 @@ def format_date_american(dt: datetime = None) -> Optional[str]:
     if not dt:
         return None
     return dt.strftime("%B %-d, %Y")
+
+
+def to_naive_utc(dt: datetime) -> datetime:
+    """Timestamp columns are naive UTC - aware datetimes (e.g. from query params with an offset) are converted"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,8 +1,9 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import sqlalchemy as sa
-from sqlalchemy.sql import desc, func
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import case, func
 
 import app.db.models as db_models
 from app.invoices.db_utils import query_invoices
@@ -12,29 +13,99 @@ def get_vendors_by_user(db: sa.orm.Session, user_id: int) -> List[db_models.Vend
     return db.query(db_models.Vendor).filter_by(user_id=user_id).all()
 
 
-def get_vendor_by_id(db: sa.orm.Session, id: str) -> Optional[db_models.Vendor]:
-    return db.query(db_models.Vendor).filter_by(id=id).first()
+def get_vendors_version(db: sa.orm.Session, user_id: str) -> Tuple[int, Optional[datetime]]:
+    """Count and latest modification time of a user's vendors - their invoice aggregates are versioned separately"""
+    modified_on = func.coalesce(db_models.Vendor.updated_on, db_models.Vendor.created_on)
+    return tuple(db.query(func.count(db_models.Vendor.id), func.max(modified_on)).filter_by(user_id=user_id).one())
 
 
-def get_total_paid_by_vendor(db: sa.orm.Session, vendor_id: str) -> int:
-    return db.query(func.sum(db_models.Invoice.amount_due)).filter_by(vendor_id=vendor_id, is_paid=True).scalar() or 0
-
+def get_vendor_by_id(db: sa.orm.Session, id: str) -> Optional[db_models.Vendor]:
+    return db.query(db_models.Vendor).filter_by(id=id).first()
 
-def get_total_due_by_vendor(db: sa.orm.Session, vendor_id: str) -> int:
-    return db.query(func.sum(db_models.Invoice.amount_due)).filter_by(vendor_id=vendor_id, is_paid=False).scalar() or 0
 
+VENDOR_AGGREGATE_COLUMNS = ("total_paid", "total_due", "total_invoice_count", "last_added_on")
 
-def get_total_invoice_count_by_vendor(db: sa.orm.Session, vendor_id: str) -> int:
-    return db.query(func.count(db_models.Invoice.id)).filter_by(vendor_id=vendor_id).scalar() or 0
 
+def _vendor_aggregates_query(db: sa.orm.Session, user_id: str = None) -> sa.orm.Query:
+    """Computes total paid, total due, invoice count and last added on for every vendor in one GROUP BY pass
 
-def get_invoice_last_added_on_by_vendor(db: sa.orm.Session, vendor_id: str) -> Optional[datetime]:
-    res = (
-        db.query(db_models.Invoice).filter_by(vendor_id=vendor_id).order_by(desc(db_models.Invoice.created_on)).first()
+    Pass user_id to only aggregate that user's invoices - otherwise every invoice in the table is grouped.
+    """
+    Invoice = db_models.Invoice
+    query = db.query(
+        Invoice.vendor_id.label("vendor_id"),
+        func.coalesce(func.sum(case((Invoice.is_paid == True, Invoice.amount_due), else_=0)), 0).label("total_paid"),
+        func.coalesce(func.sum(case((Invoice.is_paid == False, Invoice.amount_due), else_=0)), 0).label("total_due"),
+        func.count(Invoice.id).label("total_invoice_count"),
+        func.max(Invoice.created_on).label("last_added_on"),
     )
-    if not res:
-        return None
-    return res.created_on
+    if user_id:
+        query = query.filter(Invoice.user_id == user_id)
+    return query.group_by(Invoice.vendor_id)
+
+
+def get_vendor_aggregates(db: sa.orm.Session, vendor_ids: List[str]) -> Dict[str, Row]:
+    """Retrieves the aggregate metrics for a set of vendors - vendors without invoices are not included"""
+    if not vendor_ids:
+        return {}
+
+    rows = _vendor_aggregates_query(db).filter(db_models.Invoice.vendor_id.in_(vendor_ids)).all()
+    return {row.vendor_id: row for row in rows}
+
+
+def query_vendors_with_aggregates(
+    db: sa.orm.Session,
+    user_id: str,
+    *,
+    order_by: str = "name",
+    desc: bool = False,
+    limit: int = 100,
+    offset: int = 0,
+) -> List[Row]:
+    """Retrieves a page of a user's vendors joined with their aggregate metrics
+
+    Args:
+        db (Session): SessionLocal object
+        user_id (str): User to pull vendors from.
+        order_by (str, optional): Vendor column or one of VENDOR_AGGREGATE_COLUMNS to sort by. Defaults to "name".
+        desc (bool, optional): Indicates if results should be sorted in a desc fashion or not (i.e. asc). Defaults to False.
+        limit (int, optional): Max number of results to be returned. Defaults to 100.
+        offset (int, optional): Offset to allow for pagination. Defaults to 0.
+
+    Returns:
+        List[Row]: (Vendor, total_paid, total_due, total_invoice_count, last_added_on) rows
+    """
+    Vendor = db_models.Vendor
+    aggregates = _vendor_aggregates_query(db, user_id).subquery()
+
+    columns = {
+        "total_paid": func.coalesce(aggregates.c.total_paid, 0),
+        "total_due": func.coalesce(aggregates.c.total_due, 0),
+        "total_invoice_count": func.coalesce(aggregates.c.total_invoice_count, 0),
+        "last_added_on": aggregates.c.last_added_on,
+    }
+
+    if order_by in columns:
+        order_by_stmt = columns[order_by]
+    else:
+        try:
+            order_by_stmt = getattr(Vendor, order_by)
+        except AttributeError as e:
+            return []
+
+    if desc:
+        order_by_stmt = sa.desc(order_by_stmt).nulls_last()
+
+    query = (
+        db.query(Vendor, *[c.label(name) for name, c in columns.items()])
+        .outerjoin(aggregates, aggregates.c.vendor_id == Vendor.id)
+        .filter(Vendor.user_id == user_id)
+        # Vendor.id keeps pages stable when many vendors share the same metric value
+        .order_by(order_by_stmt, Vendor.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    return query.all()
 
 
 def update_vendor_contact_email(db: sa.orm.Session, vendor_id: str, email: str) -> Optional[db_models.Vendor]:
@@ -1,4 +1,5 @@
 from datetime import datetime
+from decimal import Decimal
 from locale import currency
 from typing import List, Optional
 
@@ -8,10 +9,7 @@ from pydantic import BaseModel
 from app.db.models import Vendor
 from app.utils import format_date_american
 
-from .db_utils import (get_invoice_last_added_on_by_vendor,
-                       get_total_due_by_vendor,
-                       get_total_invoice_count_by_vendor,
-                       get_total_paid_by_vendor)
+from .db_utils import get_vendor_aggregates
 
 
 class PublicVendorView(BaseModel):
@@ -31,11 +29,40 @@ class PublicVendorView(BaseModel):
 
     @classmethod
     def load(cls, db: sa.orm.Session, vendor: Vendor) -> "PublicVendorView":
-        total_due = get_total_due_by_vendor(db, vendor.id)
-        total_paid = get_total_paid_by_vendor(db, vendor.id)
-        total_invoice_count = get_total_invoice_count_by_vendor(db, vendor.id)
-        last_added_on = get_invoice_last_added_on_by_vendor(db, vendor.id)
+        return cls.load_many(db, [vendor])[0]
 
+    @classmethod
+    def load_many(cls, db: sa.orm.Session, vendors: List[Vendor]) -> List["PublicVendorView"]:
+        """Loads views for many vendors with a single aggregate query"""
+        aggregates_by_vendor = get_vendor_aggregates(db, [v.id for v in vendors])
+
+        views = []
+        for vendor in vendors:
+            aggregates = aggregates_by_vendor.get(vendor.id)
+            if not aggregates:
+                views.append(cls.from_aggregates(vendor))
+                continue
+
+            views.append(
+                cls.from_aggregates(
+                    vendor,
+                    total_due=aggregates.total_due,
+                    total_paid=aggregates.total_paid,
+                    total_invoice_count=aggregates.total_invoice_count,
+                    last_added_on=aggregates.last_added_on,
+                )
+            )
+        return views
+
+    @classmethod
+    def from_aggregates(
+        cls,
+        vendor: Vendor,
+        total_due: Decimal = 0,
+        total_paid: Decimal = 0,
+        total_invoice_count: int = 0,
+        last_added_on: datetime = None,
+    ) -> "PublicVendorView":
         # TODO: Allow for multiple currencies
         return cls(
             currency="$",
@@ -1,42 +1,76 @@
+from typing import List, Optional, Tuple
+
+import sqlalchemy as sa
 from fastapi import APIRouter, Depends, Request, Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_302_FOUND
 
 import app.invoices.db_utils as invoice_utils
 from app.auth.utils import requires_authentication
-from app.db.session import SessionLocal
+from app.db.session import get_async_db
 from app.frontend.templates import template_response
-from app.invoices.db_utils import query_invoices
+from app.invoices.db_utils import PUBLIC_INVOICE_LOAD_OPTIONS, query_invoices
 from app.invoices.models import PublicInvoice
 
 from .db_utils import (get_vendor_by_id, get_vendors_by_user,
+                       query_vendors_with_aggregates,
                        update_vendor_contact_email)
 from .models import PublicVendorView
 
 router = APIRouter()
 
 
+def load_single_vendor(db: sa.orm.Session, vendor_id: str) -> Tuple[Optional[PublicVendorView], List[PublicInvoice]]:
+    vendor = get_vendor_by_id(db, vendor_id)
+    if not vendor:
+        return None, []
+
+    invoices = query_invoices(
+        db, vendor_id=vendor_id, order_by="created_on", desc=True, options=PUBLIC_INVOICE_LOAD_OPTIONS
+    )
+    return PublicVendorView.load(db, vendor), [PublicInvoice.from_orm(i) for i in invoices]
+
+
 @router.get("/vendors", response_class=HTMLResponse)
-async def get_vendors(request: Request, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        vendors = get_vendors_by_user(db, user_id)
-        vendors = [PublicVendorView.load(db, v) for v in vendors]
+async def get_vendors(
+    request: Request,
+    user_id: str = Depends(requires_authentication),
+    order_by: str = "name",
+    desc: bool = False,
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_async_db),
+):
+    rows = await db.run_sync(
+        query_vendors_with_aggregates, user_id, order_by=order_by, desc=desc, limit=limit, offset=offset
+    )
+    vendors = [
+        PublicVendorView.from_aggregates(
+            row.Vendor,
+            total_due=row.total_due,
+            total_paid=row.total_paid,
+            total_invoice_count=row.total_invoice_count,
+            last_added_on=row.last_added_on,
+        )
+        for row in rows
+    ]
     return template_response("./vendors/vendors.html", {"request": request, "vendors": jsonable_encoder(vendors)})
 
 
 @router.get("/vendors/{vendor_id}", response_class=HTMLResponse)
-async def get_single_vendor(request: Request, vendor_id: str, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        vendor = get_vendor_by_id(db, vendor_id)
-        if not vendor:
-            return Response("404 Vendor not found.", status_code=404)
-        vendor = PublicVendorView.load(db, vendor)
-        invoices = [
-            PublicInvoice.from_orm(i) for i in query_invoices(db, vendor_id=vendor_id, order_by="created_on", desc=True)
-        ]
+async def get_single_vendor(
+    request: Request,
+    vendor_id: str,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    vendor, invoices = await db.run_sync(load_single_vendor, vendor_id)
+    if not vendor:
+        return Response("404 Vendor not found.", status_code=404)
 
     return template_response(
         "./vendors/single-vendor.html",
@@ -52,7 +86,11 @@ class VendorUpdateBody(BaseModel):
 
 
 @router.put("/vendors/{vendor_id}")
-async def update_vendor(vendor_id: str, body: VendorUpdateBody, user_id: str = Depends(requires_authentication)):
-    with SessionLocal() as db:
-        update_vendor_contact_email(db, vendor_id, body.contact_email)
+async def update_vendor(
+    vendor_id: str,
+    body: VendorUpdateBody,
+    user_id: str = Depends(requires_authentication),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await db.run_sync(update_vendor_contact_email, vendor_id, body.contact_email)
     return Response(status_code=200)
@@ -0,0 +1,104 @@
+"""Aging report build time - the old DataFrame.append processor vs AgingReportProcessor.apply
+
+    PYTHONPATH=. python tests/benchmarks/bench_aging_report.py [--legacy-max 10000]
+
+Doesn't need a database - the input is built in memory. The old processor is quadratic so by default it only
+runs up to 10k invoices; it needs pandas < 2 for DataFrame.append.
+"""
+import argparse
+import time
+import warnings
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List
+
+import pandas as pd
+from bench_utils import report
+
+from app.invoices.aging_report.models import AgingReportInput, InvoiceGroup
+from app.invoices.aging_report.processor import AgingReportProcessor
+from app.invoices.models import PublicInvoice
+
+SIZES = [(1_000, 50), (10_000, 500), (100_000, 5_000)]
+
+
+class LegacyAgingReportProcessor(AgingReportProcessor):
+    """AgingReportProcessor.apply before it was vectorized"""
+
+    def apply(self, data: AgingReportInput) -> pd.DataFrame:
+        df = pd.DataFrame(columns=self.columns)
+
+        for group in data.groups:
+            df = df.append(
+                pd.DataFrame([[group.vendor_name] + [" " for _ in range(len(self.columns) - 1)]], columns=self.columns)
+            )
+            invoice_rows = pd.DataFrame([self.invoice_to_row_dict(i) for i in group.invoice_list])
+            sub_total_row = pd.DataFrame([self.gen_total_row_dict(group.invoice_list, title="subtotals:")])
+            df = df.append(invoice_rows, sort=False)
+            df = df.append(sub_total_row, sort=False)
+            df = df.append(pd.DataFrame([[""] * len(df.columns)], columns=df.columns), sort=False)
+
+        all_invoices = [i for group in data.groups for i in group.invoice_list]
+        df = df.append(pd.DataFrame([self.gen_total_row_dict(all_invoices, title="Totals:")]), sort=False)
+        return df.fillna("")
+
+    def datetime_to_aging_col(self, dt: datetime) -> str:
+        time_from_now = dt - datetime.utcnow()
+        for edge, col in zip(self.aging_edges, self.aging_columns):
+            if time_from_now <= edge:
+                return col
+        return self.aging_columns[-1]
+
+    def invoice_to_row_dict(self, invoice: PublicInvoice) -> Dict:
+        row_dict = {c: 0 for c in self.aging_columns}
+        row_dict["Number"] = invoice.invoice_id
+        row_dict["Due Date"] = invoice.due_date.strftime("%m/%d/%Y")
+        row_dict[self.datetime_to_aging_col(invoice.due_date)] = f"{invoice.amount_due}"
+        return row_dict
+
+    def gen_total_row_dict(self, invoices: List[PublicInvoice], title: str = None) -> Dict:
+        values = {c: [] for c in self.aging_columns}
+        for i in invoices:
+            values[self.datetime_to_aging_col(i.due_date)].append(float(i.amount_due))
+        row_dict = {c: f"{sum(values[c])}" for c in values}
+        row_dict["Due Date"] = title if title else ""
+        return row_dict
+
+
+def build_input(num_invoices: int, num_vendors: int) -> AgingReportInput:
+    now = datetime.utcnow()
+    groups = [InvoiceGroup(vendor_name=f"Vendor {v}", invoice_list=[]) for v in range(num_vendors)]
+    for idx in range(num_invoices):
+        groups[idx % num_vendors].invoice_list.append(
+            PublicInvoice(
+                id=str(idx),
+                invoice_id=f"INV-{idx}",
+                due_date=now + timedelta(days=idx % 120, hours=12),
+                amount_due=Decimal(idx % 1000) + Decimal("0.99"),
+            )
+        )
+    return AgingReportInput(groups=groups)
+
+
+def time_once(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--legacy-max", type=int, default=10_000, help="Largest input to run the old processor on")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore", FutureWarning)
+    for num_invoices, num_vendors in SIZES:
+        data = build_input(num_invoices, num_vendors)
+        name = f"{num_invoices} invoices / {num_vendors} vendors"
+        if num_invoices <= args.legacy_max:
+            report(f"{name}, DataFrame.append", time_once(lambda: LegacyAgingReportProcessor().apply(data)))
+        report(f"{name}, vectorized", time_once(lambda: AgingReportProcessor().apply(data)))
+
+
+if __name__ == "__main__":
+    main()
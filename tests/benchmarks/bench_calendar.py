@@ -0,0 +1,59 @@
+"""Calendar month for a user with 10k invoices - one query per visible day vs load_calendar_month's range query
+
+    TEST_DATABASE_URL=postgresql://... PYTHONPATH=. python tests/benchmarks/bench_calendar.py
+
+The per day loop is the old /calendar handler. Its due_date filter only ever matched invoices due exactly at
+midnight, so it's reproduced here with a whole day range - otherwise it would skip the per invoice lazy loads.
+"""
+import calendar
+from datetime import datetime, timedelta
+
+from bench_utils import measure, report, rolled_back_session, seed_invoices
+
+from app.db.models import Invoice
+from app.invoices.calendar_view import CalendarDay, load_calendar_month
+from app.invoices.models import PublicInvoice
+
+
+def load_calendar_month_per_day(db, user_id: str, year: int, month: int):
+    calendar_days = []
+    for date in calendar.Calendar(firstweekday=6).itermonthdates(year, month):
+        start = datetime.combine(date, datetime.min.time())
+        due_this_date = (
+            db.query(Invoice)
+            .filter_by(user_id=user_id)
+            .filter(Invoice.due_date >= start, Invoice.due_date < start + timedelta(days=1))
+            .order_by(Invoice.due_date)
+            .all()
+        )
+        calendar_days.append(
+            CalendarDay(
+                year=date.year,
+                month=date.month,
+                day=date.day,
+                active=month == date.month,
+                invoices_due=[PublicInvoice.from_orm(i) for i in due_this_date],
+            )
+        )
+    return calendar_days
+
+
+def main() -> None:
+    with rolled_back_session() as db:
+        # Spread over two months so the benchmarked one is full whatever today's date is
+        user_id = seed_invoices(db, 10_000, days=60)
+        month = datetime.utcnow() + timedelta(days=30)
+
+        days = load_calendar_month(db, user_id, month.year, month.month)
+        assert days == load_calendar_month_per_day(db, user_id, month.year, month.month)
+        print(f"{sum(len(d.invoices_due) for d in days)} of 10000 invoices fall in {month:%B %Y}")
+
+        report(
+            "per day queries + lazy loads",
+            *measure(db, lambda: load_calendar_month_per_day(db, user_id, month.year, month.month), repeat=3),
+        )
+        report("load_calendar_month", *measure(db, lambda: load_calendar_month(db, user_id, month.year, month.month)))
+
+
+if __name__ == "__main__":
+    main()
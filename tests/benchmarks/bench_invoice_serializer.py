@@ -0,0 +1,30 @@
+"""Invoice list page serialization - PublicInvoice.from_orm over ORM rows vs PublicInvoiceRowSerializer over plain rows
+
+    TEST_DATABASE_URL=postgresql://... PYTHONPATH=. python tests/benchmarks/bench_invoice_serializer.py
+"""
+from bench_utils import measure, report, rolled_back_session, seed_invoices
+
+from app.invoices.db_utils import (PUBLIC_INVOICE_LOAD_OPTIONS,
+                                   get_invoices_by_user,
+                                   load_public_invoice_page)
+from app.invoices.models import PublicInvoice
+
+
+def main() -> None:
+    for num_rows in (1_000, 10_000):
+        with rolled_back_session() as db:
+            user_id = seed_invoices(db, num_rows)
+
+            def orm_page():
+                invoices = get_invoices_by_user(db, user_id, limit=num_rows, options=PUBLIC_INVOICE_LOAD_OPTIONS)
+                return {i.id: PublicInvoice.from_orm(i).dict() for i in invoices}
+
+            def row_page():
+                return load_public_invoice_page(db, user_id, limit=num_rows)
+
+            report(f"{num_rows} rows, PublicInvoice.from_orm", *measure(db, orm_page))
+            report(f"{num_rows} rows, PublicInvoiceRowSerializer", *measure(db, row_page))
+
+
+if __name__ == "__main__":
+    main()
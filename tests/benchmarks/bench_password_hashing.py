@@ -0,0 +1,70 @@
+"""Concurrent logins - bcrypt verify on the event loop vs on the password hash pool
+
+    PYTHONPATH=. python tests/benchmarks/bench_password_hashing.py [--logins 32]
+
+Reports logins/second and the longest the event loop went without running a 1ms ticker, i.e. how long every
+other request would have waited. Uses password_hash_rounds, password_hash_workers and password_hash_executor
+from auth config.
+"""
+import argparse
+import asyncio
+import time
+
+from app.auth.config import config
+from app.auth.utils import (pswd_context, shutdown_password_hash_pool,
+                            verify_and_update_pswd,
+                            verify_and_update_pswd_async)
+
+
+async def measure_logins(verify, num_logins: int, pswd_hash: str):
+    longest_stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal longest_stall
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest_stall = max(longest_stall, now - last)
+            last = now
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[verify("hunter2", pswd_hash) for _ in range(num_logins)])
+    elapsed = time.perf_counter() - start
+    done = True
+    await ticker_task
+
+    assert all(is_valid for is_valid, _ in results)
+    return elapsed, longest_stall
+
+
+async def verify_on_loop(pswd: str, pswd_hash: str):
+    # How the login route verified before the pool
+    return verify_and_update_pswd(pswd, pswd_hash)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=32, help="Concurrent logins per run")
+    args = parser.parse_args()
+
+    print(
+        f"rounds={config.password_hash_rounds} workers={config.password_hash_workers} "
+        f"executor={config.password_hash_executor}"
+    )
+    pswd_hash = pswd_context.hash("hunter2")
+    try:
+        runs = [("on the event loop", verify_on_loop), ("password hash pool", verify_and_update_pswd_async)]
+        for name, verify in runs:
+            elapsed, longest_stall = asyncio.run(measure_logins(verify, args.logins, pswd_hash))
+            stall_ms = longest_stall * 1000
+            print(f"{name:<24} {args.logins / elapsed:>8.1f} logins/s  longest loop stall {stall_ms:>8.1f} ms")
+    finally:
+        shutdown_password_hash_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""PDF rasterization for 1, 10 and 50 page documents - no OCR
+
+    PYTHONPATH=. python tests/benchmarks/bench_rasterize.py
+
+Compares rendering every page in process with rasterize_pages on its process pool (rasterize_workers, pdf_dpi
+from invoices config). The first run of the pool includes spawning its workers so it's reported separately.
+"""
+import time
+from pathlib import Path
+
+import fitz
+from bench_utils import report
+
+from app.invoices.config import config
+from app.invoices.ingestion.rasterize import (_render_pages, rasterize_pages,
+                                              shutdown_rasterize_pool)
+
+TEST_DATA = Path(__file__).parent.parent / "test_data"
+PAGE_COUNTS = [1, 10, 50]
+
+
+def build_pdf(num_pages: int) -> bytes:
+    """A letter sized pdf with one of the test invoice images on each page"""
+    images = sorted(TEST_DATA.glob("test_invoice_*"))
+    doc = fitz.open()
+    for idx in range(num_pages):
+        page = doc.new_page(width=612, height=792)
+        page.insert_image(page.rect, filename=str(images[idx % len(images)]))
+    return doc.tobytes()
+
+
+def best_of(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    print(f"pdf_dpi={config.pdf_dpi} rasterize_workers={config.rasterize_workers}")
+    pdfs = {num_pages: build_pdf(num_pages) for num_pages in PAGE_COUNTS}
+
+    start = time.perf_counter()
+    rasterize_pages(pdfs[PAGE_COUNTS[-1]], "application/pdf")
+    report("pool start up + first 50 page run", time.perf_counter() - start)
+
+    try:
+        for num_pages, pdf in pdfs.items():
+            report(
+                f"{num_pages} pages, in process",
+                best_of(lambda: _render_pages(pdf, range(num_pages), config.pdf_dpi)),
+            )
+            report(f"{num_pages} pages, rasterize_pages", best_of(lambda: rasterize_pages(pdf, "application/pdf")))
+    finally:
+        shutdown_rasterize_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Iterator, List, Tuple
+
+import sqlalchemy as sa
+import ulid
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.db.models import (Base, Category, CategoryInvoiceAssociation, Invoice,
+                           User, Vendor)
+
+# Same database the tests use - see tests/helpers.py. Everything a benchmark writes is rolled back.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@contextmanager
+def rolled_back_session() -> Iterator[Session]:
+    """A session inside a transaction that is rolled back afterwards - tables are created in it too"""
+    if not TEST_DATABASE_URL:
+        sys.exit("Set TEST_DATABASE_URL to a Postgres database to run the benchmarks")
+
+    engine = sa.create_engine(TEST_DATABASE_URL)
+    connection = engine.connect()
+    transaction = connection.begin()
+    Base.metadata.create_all(connection)
+    db = Session(bind=connection)
+    try:
+        yield db
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
+
+
+def seed_invoices(db: Session, num_invoices: int, num_vendors: int = 50, days: int = 30) -> str:
+    """Adds a user with invoices spread over the next `days` days, each with a vendor and a category.
+
+    Uses core inserts so seeding 100k rows takes seconds. Returns the user's id.
+    """
+    user_id = ulid.ulid()
+    db.execute(sa.insert(User), [{"id": user_id, "email": f"{user_id}@example.com", "password_hash": "x"}])
+
+    vendors = [{"id": ulid.ulid(), "user_id": user_id, "name": f"Vendor {i}"} for i in range(num_vendors)]
+    db.execute(sa.insert(Vendor), vendors)
+    categories = [{"id": ulid.ulid(), "user_id": user_id, "name": f"Category {i}"} for i in range(5)]
+    db.execute(sa.insert(Category), categories)
+
+    now = datetime.utcnow()
+    invoices, links = [], []
+    for idx in range(num_invoices):
+        vendor = vendors[idx % num_vendors]
+        invoice_id = ulid.ulid()
+        invoices.append(
+            {
+                "id": invoice_id,
+                "user_id": user_id,
+                "vendor_id": vendor["id"],
+                "vendor_name": vendor["name"],
+                "invoice_id": f"INV-{idx}",
+                "amount_due": Decimal(idx % 1000) + Decimal("0.99"),
+                "currency": "USD",
+                "due_date": now + timedelta(minutes=idx * days * 24 * 60 // num_invoices),
+                "is_paid": idx % 4 == 0,
+            }
+        )
+        links.append({"category_id": categories[idx % len(categories)]["id"], "invoice_id": invoice_id})
+
+    for start in range(0, num_invoices, 5000):
+        db.execute(sa.insert(Invoice), invoices[start : start + 5000])
+        db.execute(sa.insert(CategoryInvoiceAssociation), links[start : start + 5000])
+    db.execute(sa.text("ANALYZE invoices"))
+    db.execute(sa.text("ANALYZE category_invoice_associations"))
+    return user_id
+
+
+def measure(db: Session, fn: Callable[[], Any], repeat: int = 5) -> Tuple[float, int]:
+    """Best wall time over `repeat` runs, and how many statements one run executes.
+
+    The identity map is cleared before every run so nothing is served from a previous one.
+    """
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    connection = db.connection()
+    best = float("inf")
+    for _ in range(repeat):
+        db.expunge_all()
+        statements.clear()
+        event.listen(connection, "before_cursor_execute", before_cursor_execute)
+        try:
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            event.remove(connection, "before_cursor_execute", before_cursor_execute)
+    return best, len(statements)
+
+
+def report(name: str, seconds: float, num_statements: int = None) -> None:
+    queries = "" if num_statements is None else f"  {num_statements:>6} queries"
+    print(f"{name:<48} {seconds * 1000:>10.1f} ms{queries}")
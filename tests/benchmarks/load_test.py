@@ -0,0 +1,91 @@
+"""Closed loop load test against a running server - requests/second and latency at several concurrency levels
+
+    python tests/benchmarks/load_test.py http://localhost:8000/api/v1/invoices --cookie "session=..." \
+        --concurrency 1,8,32,64 --duration 10
+
+Each simulated client keeps one connection open and sends its next request as soon as the last one finishes.
+To compare two versions of the app run it against each with the same database and POOL_SIZE / MAX_OVERFLOW.
+Not run by `make bench` since it needs a server.
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+
+def run_client(url: str, headers: Dict[str, str], deadline: float) -> Tuple[List[float], Counter]:
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+
+    latencies, statuses = [], Counter()
+    connection = connection_class(parts.netloc, timeout=60)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                statuses[response.status] += 1
+            except (OSError, http.client.HTTPException) as e:
+                statuses[type(e).__name__] += 1
+                connection.close()
+                connection = connection_class(parts.netloc, timeout=60)
+                continue
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connection.close()
+    return latencies, statuses
+
+
+def run_level(url: str, headers: Dict[str, str], concurrency: int, duration: float) -> None:
+    start_barrier = threading.Barrier(concurrency)
+
+    def client() -> Tuple[List[float], Counter]:
+        start_barrier.wait()
+        return run_client(url, headers, time.perf_counter() + duration)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: client(), range(concurrency)))
+
+    latencies = sorted(l for client_latencies, _ in results for l in client_latencies)
+    statuses = sum((s for _, s in results), Counter())
+    if not latencies:
+        print(f"{concurrency:>6} clients: no successful requests {dict(statuses)}")
+        return
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(
+        f"{concurrency:>6} clients: {len(latencies) / duration:>8.1f} req/s"
+        f"  p50 {quantiles[49] * 1000:>7.1f} ms  p95 {quantiles[94] * 1000:>7.1f} ms"
+        f"  p99 {quantiles[98] * 1000:>7.1f} ms  {dict(statuses)}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url")
+    parser.add_argument("--cookie", help="Cookie header to send, e.g. the session cookie of a logged in user")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="Comma separated numbers of clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run each concurrency level")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of load before measuring")
+    args = parser.parse_args()
+
+    headers = {"Cookie": args.cookie} if args.cookie else {}
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    if args.warmup:
+        run_client(args.url, headers, time.perf_counter() + args.warmup)
+    print(f"GET {args.url}")
+    for concurrency in levels:
+        run_level(args.url, headers, concurrency, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import csv
+import io
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+import sqlalchemy as sa
+from helpers import DatabaseTestCase
+
+from app.db.models import Invoice, User
+from app.invoices.aging_report.processor import AgingReportProcessor
+from app.invoices.aging_report.writer import iter_aging_report_rows
+
+# Time until due -> the aging column the invoice belongs in. Each column's upper edge is inclusive.
+BUCKET_EDGES = [
+    (timedelta(0), "0-30"),
+    (timedelta(days=30), "0-30"),
+    (timedelta(days=30, microseconds=1), "31-60"),
+    (timedelta(days=60), "31-60"),
+    (timedelta(days=60, microseconds=1), "61-90"),
+    (timedelta(days=90), "61-90"),
+    (timedelta(days=90, microseconds=1), "90+"),
+    (timedelta(days=400), "90+"),
+]
+
+
+class AgingBucketEdgeTest(unittest.TestCase):
+    def test_apply_frame_buckets(self) -> None:
+        now = datetime(2022, 5, 1, 12, 30)
+        invoices = pd.DataFrame(
+            [("Acme", f"inv-{idx}", now + until_due, "1.00") for idx, (until_due, _) in enumerate(BUCKET_EDGES)],
+            columns=AgingReportProcessor.frame_columns,
+        )
+
+        report = AgingReportProcessor().apply_frame(invoices, now=now)
+
+        detail = report[report["Number"].str.startswith("inv")].set_index("Number")
+        for idx, (until_due, column) in enumerate(BUCKET_EDGES):
+            with self.subTest(until_due=until_due):
+                self.assertEqual(detail.loc[f"inv-{idx}", column], "1.00")
+        subtotals = report[report["Due Date"] == "subtotals:"].iloc[0]
+        self.assertEqual(list(subtotals[AgingReportProcessor.aging_columns]), ["2.00", "2.00", "2.00", "2.00"])
+
+
+class AgingReportParityTest(DatabaseTestCase):
+    """fetch_aggregated + apply_aggregated and the streamed csv must match the report fetch_data + apply builds"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = User(email="aging@example.com", password_hash="x")
+        other_user = User(email="other@example.com", password_hash="x")
+        self.db.add_all([self.user, other_user])
+        self.db.flush()
+
+        # Whole days plus half a day keeps every due date well clear of a bucket edge
+        now = datetime.utcnow()
+        due = lambda days: now + timedelta(days=days, hours=12)
+        rows = [
+            # Same due date across vendors, and within a vendor, so order falls back to id
+            ("inv-01", "Acme", due(5), Decimal("100.00")),
+            ("inv-02", "Beta", due(5), Decimal("20.50")),
+            ("inv-03", "Acme", due(5), Decimal("3.25")),
+            ("inv-04", "Beta", due(45), Decimal("400.00")),
+            ("inv-05", None, due(75), Decimal("12.00")),
+            ("inv-06", "", due(10), Decimal("7.77")),
+            ("inv-07", None, due(120), Decimal("1000.10")),
+            ("inv-08", "Acme", due(100), None),
+            ("inv-09", "Gamma", due(29), Decimal("0.01")),
+            # Beta's lowest id, but not its first invoice - Beta still comes after Acme
+            ("inv-00", "Beta", due(200), Decimal("5.00")),
+        ]
+        # Inserted back to front so ties aren't broken by insertion order by accident
+        for id, vendor, due_date, amount in reversed(rows):
+            self.db.add(
+                Invoice(
+                    id=id, user_id=self.user.id, vendor_name=vendor, invoice_id=id, due_date=due_date, amount_due=amount
+                )
+            )
+            self.db.flush()
+        # None of these belong in the report
+        self.db.add_all(
+            [
+                Invoice(id="paid", user_id=self.user.id, vendor_name="Acme", due_date=due(5), is_paid=True),
+                Invoice(id="past", user_id=self.user.id, vendor_name="Acme", due_date=now - timedelta(days=3)),
+                Invoice(id="theirs", user_id=other_user.id, vendor_name="Acme", due_date=due(5)),
+            ]
+        )
+        self.db.flush()
+
+    def test_aggregated_matches_reference(self) -> None:
+        # The (user_id, due_date, id) index would return ties in id order regardless of ORDER BY
+        self.db.execute(sa.text("SET LOCAL enable_indexscan = off"))
+        self.db.execute(sa.text("SET LOCAL enable_bitmapscan = off"))
+
+        processor = AgingReportProcessor()
+        reference = processor.apply(processor.fetch_data(self.db, self.user.id))
+        aggregated = processor.apply_aggregated(*processor.fetch_aggregated(self.db, self.user.id))
+
+        pd.testing.assert_frame_equal(reference, aggregated)
+        self.assertEqual(
+            list(reference["Number"][reference["Number"].str.startswith("inv")]),
+            ["inv-01", "inv-03", "inv-08", "inv-02", "inv-04", "inv-00", "inv-06", "inv-05", "inv-07", "inv-09"],
+        )
+        self.assertEqual(self.streamed_csv(self.user.id), reference.to_csv(index=False))
+
+    def streamed_csv(self, user_id: str) -> str:
+        # What write_aging_report_csv writes after its title preamble
+        stream = io.StringIO()
+        csv.writer(stream, lineterminator="\n").writerows(iter_aging_report_rows(self.db, user_id))
+        return stream.getvalue()
+
+    def test_empty(self) -> None:
+        processor = AgingReportProcessor()
+        reference = processor.apply(processor.fetch_data(self.db, "nobody"))
+        aggregated = processor.apply_aggregated(*processor.fetch_aggregated(self.db, "nobody"))
+
+        pd.testing.assert_frame_equal(reference, aggregated)
+        self.assertEqual(self.streamed_csv("nobody"), reference.to_csv(index=False))
+
+    def test_aggregated_buckets(self) -> None:
+        # Postgres has to put the edges in the same columns as apply_frame
+        now = datetime.utcnow() + timedelta(days=1)
+        for idx, (until_due, _) in enumerate(BUCKET_EDGES):
+            self.db.add(
+                Invoice(id=f"edge-{idx}", user_id=self.user.id, invoice_id=f"edge-{idx}", due_date=now + until_due)
+            )
+        self.db.flush()
+
+        invoices, _, _ = AgingReportProcessor.fetch_aggregated(self.db, self.user.id, now=now)
+
+        buckets = dict(zip(invoices["invoice_id"], invoices["bucket"]))
+        for idx, (until_due, column) in enumerate(BUCKET_EDGES):
+            with self.subTest(until_due=until_due):
+                self.assertEqual(AgingReportProcessor.aging_columns[buckets[f"edge-{idx}"]], column)
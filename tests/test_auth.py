@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from contextlib import nullcontext
+from unittest import mock
+
+from fastapi import Request
+from helpers import DatabaseTestCase
+from passlib.context import CryptContext
+
+from app.auth.config import config
+from app.auth.router import post_login
+from app.auth.utils import (pswd_context, shutdown_password_hash_pool,
+                            verify_and_update_pswd,
+                            verify_and_update_pswd_async)
+from app.db.models import User
+
+# Hashes made before password_hash_rounds was raised - also cheap enough to make in a test
+cheap_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+
+def rounds(pswd_hash: str) -> int:
+    return int(pswd_hash.split("$")[2])
+
+
+class VerifyAndUpdateTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        shutdown_password_hash_pool()
+
+    def test_rehashes_other_cost(self) -> None:
+        is_valid, new_hash = verify_and_update_pswd("hunter2", cheap_context.hash("hunter2"))
+
+        self.assertTrue(is_valid)
+        self.assertEqual(rounds(new_hash), config.password_hash_rounds)
+        self.assertTrue(pswd_context.verify("hunter2", new_hash))
+
+    def test_keeps_configured_cost(self) -> None:
+        self.assertEqual(verify_and_update_pswd("hunter2", pswd_context.hash("hunter2")), (True, None))
+
+    def test_wrong_password(self) -> None:
+        self.assertEqual(verify_and_update_pswd("hunter3", cheap_context.hash("hunter2")), (False, None))
+
+    def test_async(self) -> None:
+        is_valid, new_hash = asyncio.run(verify_and_update_pswd_async("hunter2", cheap_context.hash("hunter2")))
+
+        self.assertTrue(is_valid)
+        self.assertEqual(rounds(new_hash), config.password_hash_rounds)
+
+
+class LoginRehashTest(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = User(email="rehash@example.com", password_hash=cheap_context.hash("hunter2"))
+        self.db.add(self.user)
+        self.db.flush()
+
+    def tearDown(self) -> None:
+        shutdown_password_hash_pool()
+        super().tearDown()
+
+    def login(self, password: str) -> Request:
+        request = Request({"type": "http", "session": {}})
+        with mock.patch("app.auth.router.SessionLocal", lambda: nullcontext(self.db)):
+            asyncio.run(post_login(request, email=self.user.email, password=password))
+        return request
+
+    def test_login_rehashes(self) -> None:
+        request = self.login("hunter2")
+
+        self.assertEqual(request.session["user_id"], self.user.id)
+        self.db.refresh(self.user)
+        self.assertEqual(rounds(self.user.password_hash), config.password_hash_rounds)
+
+        # Already at the configured cost - a second login leaves it alone
+        rehashed = self.user.password_hash
+        self.login("hunter2")
+        self.db.refresh(self.user)
+        self.assertEqual(self.user.password_hash, rehashed)
+
+    def test_failed_login_keeps_hash(self) -> None:
+        old_hash = self.user.password_hash
+
+        request = self.login("wrong")
+
+        self.assertNotIn("user_id", request.session)
+        self.db.refresh(self.user)
+        self.assertEqual(self.user.password_hash, old_hash)
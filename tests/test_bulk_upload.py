@@ -0,0 +1,69 @@
+import io
+import unittest
+import zipfile
+from unittest import mock
+
+from fastapi import UploadFile
+
+from app.invoices.config import config
+from app.invoices.ingestion.bulk import iter_upload_entries
+from app.storage.config import config as storage_config
+
+
+def zip_upload(entries) -> UploadFile:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in entries:
+            archive.writestr(name, content)
+    data.seek(0)
+    return UploadFile("invoices.zip", file=data, content_type="application/zip")
+
+
+def entries(files):
+    return [(name, content_type, error) for name, content_type, _, error in iter_upload_entries(files)]
+
+
+class IterUploadEntriesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for settings, name, value in [
+            (storage_config, "max_upload_bytes", 100),
+            (config, "bulk_upload_max_zip_entries", 3),
+            (config, "bulk_upload_max_zip_bytes", 250),
+        ]:
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fails_entries_over_max_upload_bytes_without_reading_them(self) -> None:
+        upload = zip_upload([("a.png", b"a" * 100), ("bomb.pdf", b"\0" * 10_000)])
+
+        with mock.patch.object(zipfile.ZipFile, "read", side_effect=AssertionError("read")):
+            result = entries([upload])
+
+        self.assertEqual(
+            result, [("a.png", "image/png", None), ("bomb.pdf", "application/pdf", "File must be at most 0 MB")]
+        )
+
+    def test_fails_archives_with_too_many_entries(self) -> None:
+        upload = zip_upload([(f"{idx}.png", b"a") for idx in range(4)])
+
+        self.assertEqual(
+            entries([upload]), [("invoices.zip", "application/zip", "Archive must contain at most 3 files")]
+        )
+
+    def test_fails_archives_too_large_uncompressed(self) -> None:
+        upload = zip_upload([(f"{idx}.png", b"a" * 90) for idx in range(3)])
+
+        self.assertEqual(
+            entries([upload]), [("invoices.zip", "application/zip", "Archive must be at most 0 MB uncompressed")]
+        )
+
+    def test_fails_plain_files_over_max_upload_bytes(self) -> None:
+        small = UploadFile("a.png", file=io.BytesIO(b"a" * 100), content_type="image/png")
+        large = UploadFile("b.png", file=io.BytesIO(b"a" * 101), content_type="image/png")
+
+        result = list(iter_upload_entries([small, large]))
+
+        self.assertEqual([error for *_, error in result], [None, "File must be at most 0 MB"])
+        # Still readable from the start after the size check
+        self.assertEqual(result[0][2](), b"a" * 100)
@@ -0,0 +1,95 @@
+import io
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from PIL import Image
+
+from app.invoices.ingestion import derivatives
+from app.invoices.ingestion.derivatives import (IMAGE_DECODE_ERRORS,
+                                                backfill_derivatives,
+                                                render_derivatives,
+                                                shutdown_derivative_pool)
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class RenderDerivativesTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        shutdown_derivative_pool()
+
+    def test_render(self) -> None:
+        rendered = render_derivatives(png())
+
+        self.assertEqual(set(rendered), set(derivatives.DERIVATIVE_SIZES))
+
+    def test_undecodable_image(self) -> None:
+        with self.assertRaises(IMAGE_DECODE_ERRORS):
+            render_derivatives(b"not an image")
+
+    def test_broken_pool_is_replaced(self) -> None:
+        broken_future = Future()
+        broken_future.set_exception(BrokenProcessPool("a worker died"))
+        broken_pool = mock.Mock(**{"submit.return_value": broken_future})
+        derivatives._pool = broken_pool
+
+        with self.assertRaises(BrokenProcessPool):
+            render_derivatives(png())
+
+        broken_pool.shutdown.assert_called_once_with(wait=False)
+        self.assertIsNone(derivatives._pool)
+        # The next call gets a working pool
+        self.assertEqual(set(render_derivatives(png())), set(derivatives.DERIVATIVE_SIZES))
+
+
+class BackfillDerivativesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.claimed = [(name, f"/storage/{name}.png") for name in ["decode", "storage", "ok"]]
+        self.storage = mock.Mock()
+        self.storage.key_from_uri.side_effect = lambda uri: uri[len("/storage/") :]
+        self.storage.download_bytes.side_effect = lambda key: key.encode()
+        self.storage.upload_bytes.side_effect = lambda key, data, content_type: f"/storage/{key}"
+
+        mock.patch.object(derivatives, "SessionLocal").start()
+        mock.patch.object(derivatives, "claim_invoices_missing_derivatives", return_value=self.claimed).start()
+        mock.patch.object(derivatives, "storage", self.storage).start()
+        self.set_invoice_derivatives = mock.patch.object(derivatives, "set_invoice_derivatives").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def saved(self):
+        return {c.args[1]: c.kwargs for c in self.set_invoice_derivatives.call_args_list}
+
+    def render(self, image: bytes):
+        if image == b"decode.png":
+            raise Image.UnidentifiedImageError("cannot identify image file")
+        return {"preview": b"p", "thumbnail": b"t"}
+
+    def test_only_undecodable_images_are_marked_done(self) -> None:
+        def download_bytes(key):
+            if key == "storage.png":
+                raise ConnectionError("storage is down")
+            return key.encode()
+
+        self.storage.download_bytes.side_effect = download_bytes
+        with mock.patch.object(derivatives, "render_derivatives", side_effect=self.render):
+            self.assertEqual(backfill_derivatives(10), 3)
+
+        # storage.png is left unset, to be claimed again once the claim expires
+        self.assertEqual(
+            self.saved(),
+            {
+                "decode": {"preview_uri": "", "thumbnail_uri": ""},
+                "ok": {"preview_uri": "/storage/ok-preview.webp", "thumbnail_uri": "/storage/ok-thumbnail.webp"},
+            },
+        )
+
+    def test_broken_pool_is_not_marked_done(self) -> None:
+        with mock.patch.object(derivatives, "render_derivatives", side_effect=BrokenProcessPool("a worker died")):
+            backfill_derivatives(10)
+
+        self.assertEqual(self.saved(), {})
@@ -0,0 +1,61 @@
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from app.invoices.ingestion.worker import IngestionWorkerPool
+
+
+class IngestionWorkerPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = IngestionWorkerPool(num_workers=2)
+
+    def track(self, job_id: str) -> Future:
+        future = Future()
+        self.pool._in_flight[future] = job_id
+        future.add_done_callback(self.pool._on_done)
+        return future
+
+    def test_done_futures_leave_in_flight(self) -> None:
+        finished, failed, cancelled = self.track("finished"), self.track("failed"), self.track("cancelled")
+
+        finished.set_result(None)
+        failed.set_exception(RuntimeError("ocr failed"))
+        # Future logs (and otherwise swallows) a callback raising, e.g. CancelledError from future.exception()
+        with self.assertNoLogs("concurrent.futures", level="ERROR"):
+            cancelled.cancel()
+
+        self.assertEqual(self.pool._in_flight, {})
+
+    def test_maintenance_heartbeats_in_flight_jobs(self) -> None:
+        self.track("running")
+
+        with mock.patch("app.invoices.ingestion.worker.SessionLocal"), mock.patch(
+            "app.invoices.ingestion.worker.heartbeat_ingestion_jobs"
+        ) as heartbeat, mock.patch(
+            "app.invoices.ingestion.worker.requeue_stale_ingestion_jobs", side_effect=RuntimeError("db went away")
+        ) as requeue, mock.patch(
+            "app.invoices.ingestion.worker.fail_abandoned_direct_uploads", return_value=[]
+        ) as sweep:
+            self.pool._run_maintenance()
+
+        self.assertEqual(heartbeat.call_args[0][1], ["running"])
+        # One failing task doesn't skip the rest
+        requeue.assert_called_once()
+        sweep.assert_called_once()
+
+    def test_broken_executor_is_replaced_and_jobs_released(self) -> None:
+        broken = mock.Mock(**{"submit.side_effect": [Future(), BrokenProcessPool("a worker died")]})
+        self.pool._executor = broken
+
+        with mock.patch("app.invoices.ingestion.worker.SessionLocal"), mock.patch(
+            "app.invoices.ingestion.worker.release_ingestion_jobs"
+        ) as release:
+            self.pool._submit(["a", "b", "c"])
+
+        broken.shutdown.assert_called_once_with(wait=False)
+        self.assertIsInstance(self.pool._executor, ThreadPoolExecutor)
+        self.pool._executor.shutdown()
+        # "a" was submitted before the pool broke, the rest go back in the queue
+        self.assertEqual(list(self.pool._in_flight.values()), ["a"])
+        self.assertEqual(release.call_args[0][1], ["b", "c"])
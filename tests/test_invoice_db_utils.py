@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Tuple
+
+from helpers import DatabaseTestCase
+
+from app.db.models import (IngestionJob, Invoice, InvoiceStats, Organization,
+                           User)
+from app.invoices.db_utils import (fail_abandoned_direct_uploads,
+                                   get_invoice_by_content_hash,
+                                   heartbeat_ingestion_jobs,
+                                   release_ingestion_jobs,
+                                   requeue_stale_ingestion_jobs, save_invoices,
+                                   set_invoice_derivatives)
+from app.invoices.models import CreateInvoice
+
+
+class SaveInvoicesTest(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        organization = Organization(name="Org")
+        self.db.add(organization)
+        self.db.flush()
+        self.user = User(email="bulk@example.com", password_hash="x", organization_id=organization.id)
+        self.db.add(self.user)
+        self.db.flush()
+
+    def test_one_failing_invoice_only_fails_itself(self) -> None:
+        invoices = [
+            CreateInvoice(user_id=self.user.id, vendor_name="Acme", amount_due=Decimal("1.00"), content_hash="a"),
+            # Same file as the first - breaks the organization's unique content hash index
+            CreateInvoice(user_id=self.user.id, vendor_name="Acme", amount_due=Decimal("2.00"), content_hash="a"),
+            CreateInvoice(user_id=self.user.id, vendor_name="Beta", amount_due=Decimal("3.00"), content_hash="b"),
+        ]
+
+        results = save_invoices(self.db, invoices)
+
+        self.assertEqual([r.is_ok() for r in results], [True, False, True])
+        self.assertIn("ix_invoices_organization_id_content_hash", results[1].err())
+        saved_amounts = {i.amount_due for i in self.db.query(Invoice).filter_by(user_id=self.user.id)}
+        self.assertEqual(saved_amounts, {Decimal("1.00"), Decimal("3.00")})
+        # Stats only count what was actually saved
+        stats = self.db.query(InvoiceStats).filter_by(user_id=self.user.id).one()
+        self.assertEqual(stats.num_unpaid, 2)
+        self.assertEqual(stats.amount_unpaid, Decimal("4.00"))
+
+    def test_same_file_fails_for_users_without_organization(self) -> None:
+        solo, other_solo = User(email="solo@example.com", password_hash="x"), User(
+            email="o@example.com", password_hash="x"
+        )
+        self.db.add_all([solo, other_solo])
+        self.db.flush()
+        invoices = [
+            CreateInvoice(user_id=solo.id, vendor_name="Acme", amount_due=Decimal("1.00"), content_hash="a"),
+            CreateInvoice(user_id=solo.id, vendor_name="Acme", amount_due=Decimal("2.00"), content_hash="a"),
+            # Another user's copy of the same file is theirs to keep
+            CreateInvoice(user_id=other_solo.id, vendor_name="Acme", amount_due=Decimal("3.00"), content_hash="a"),
+        ]
+
+        results = save_invoices(self.db, invoices)
+
+        self.assertEqual([r.is_ok() for r in results], [True, False, True])
+        self.assertIn("ix_invoices_user_id_content_hash", results[1].err())
+
+
+class GetInvoiceByContentHashTest(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        organization = Organization(name="Org")
+        self.db.add(organization)
+        self.db.flush()
+        self.member, self.other_member = [
+            User(email=f"member{i}@example.com", password_hash="x", organization_id=organization.id) for i in range(2)
+        ]
+        self.solo, self.other_solo = [User(email=f"solo{i}@example.com", password_hash="x") for i in range(2)]
+        self.db.add_all([self.member, self.other_member, self.solo, self.other_solo])
+        self.db.flush()
+
+    def save(self, user: User) -> Invoice:
+        invoice = Invoice(user_id=user.id, organization_id=user.organization_id, content_hash="same-file")
+        self.db.add(invoice)
+        self.db.flush()
+        return invoice
+
+    def find(self, user: User):
+        return get_invoice_by_content_hash(self.db, user.id, user.organization_id, "same-file")
+
+    def test_shared_within_organization(self) -> None:
+        invoice = self.save(self.member)
+
+        self.assertEqual(self.find(self.other_member), invoice)
+        self.assertIsNone(self.find(self.solo))
+
+    def test_users_without_organization_only_see_their_own(self) -> None:
+        invoice = self.save(self.solo)
+
+        self.assertEqual(self.find(self.solo), invoice)
+        self.assertIsNone(self.find(self.other_solo))
+        self.assertIsNone(self.find(self.member))
+
+
+class FailAbandonedDirectUploadsTest(DatabaseTestCase):
+    def test_only_fails_old_jobs_awaiting_upload(self) -> None:
+        user = User(email="uploads@example.com", password_hash="x")
+        self.db.add(user)
+        self.db.flush()
+        old, recent = datetime.utcnow() - timedelta(hours=3), datetime.utcnow() - timedelta(minutes=5)
+        jobs = {
+            "abandoned": IngestionJob(status="awaiting_upload", storage_key="direct/abandoned", created_on=old),
+            "in_progress": IngestionJob(status="awaiting_upload", storage_key="direct/in_progress", created_on=recent),
+            "queued": IngestionJob(status="queued", storage_key="direct/queued", created_on=old),
+        }
+        for job in jobs.values():
+            job.user_id, job.content_type = user.id, "application/pdf"
+        self.db.add_all(jobs.values())
+        self.db.flush()
+
+        keys = fail_abandoned_direct_uploads(self.db, timedelta(hours=2))
+
+        self.assertEqual(keys, ["direct/abandoned"])
+        for job in jobs.values():
+            self.db.refresh(job)
+        self.assertEqual(
+            {name: (job.status, job.error) for name, job in jobs.items()},
+            {
+                "abandoned": ("failed", "Upload was never completed"),
+                "in_progress": ("awaiting_upload", None),
+                "queued": ("queued", None),
+            },
+        )
+        # Already failed, so a second sweep has nothing to delete
+        self.assertEqual(fail_abandoned_direct_uploads(self.db, timedelta(hours=2)), [])
+
+
+class IngestionJobQueueTest(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = User(email="ingestion@example.com", password_hash="x")
+        self.db.add(self.user)
+        self.db.flush()
+
+    def add_jobs(self, **jobs: IngestionJob) -> Dict[str, IngestionJob]:
+        for job in jobs.values():
+            job.user_id, job.content_type = self.user.id, "application/pdf"
+        self.db.add_all(jobs.values())
+        self.db.flush()
+        return jobs
+
+    def states(self, jobs: Dict[str, IngestionJob]) -> Dict[str, Tuple]:
+        for job in jobs.values():
+            self.db.refresh(job)
+        return {name: (job.status, job.step, job.attempts) for name, job in jobs.items()}
+
+    def test_only_requeues_jobs_without_a_recent_heartbeat(self) -> None:
+        old = datetime.utcnow() - timedelta(hours=1)
+        jobs = self.add_jobs(
+            abandoned=IngestionJob(status="processing", step="ocr", attempts=1, updated_on=old),
+            long_running=IngestionJob(status="processing", step="ocr", attempts=1, updated_on=old),
+            queued=IngestionJob(status="queued", attempts=0, updated_on=old),
+        )
+
+        # Only the queued job isn't processing, so the heartbeat leaves it alone
+        heartbeat_ingestion_jobs(self.db, [jobs["long_running"].id, jobs["queued"].id])
+        counts = requeue_stale_ingestion_jobs(self.db, timedelta(minutes=10), max_attempts=3)
+
+        self.assertEqual(counts, (1, 0))
+        self.assertEqual(
+            self.states(jobs),
+            {
+                "abandoned": ("queued", None, 1),
+                "long_running": ("processing", "ocr", 1),
+                "queued": ("queued", None, 0),
+            },
+        )
+        self.assertEqual(jobs["queued"].updated_on, old)
+
+    def test_fails_jobs_abandoned_max_attempts_times(self) -> None:
+        old = datetime.utcnow() - timedelta(hours=1)
+        jobs = self.add_jobs(
+            retried=IngestionJob(status="processing", step="ocr", attempts=2, updated_on=old),
+            crashing=IngestionJob(status="processing", step="ocr", attempts=3, updated_on=old),
+        )
+
+        counts = requeue_stale_ingestion_jobs(self.db, timedelta(minutes=10), max_attempts=3)
+
+        self.assertEqual(counts, (1, 1))
+        self.assertEqual(self.states(jobs), {"retried": ("queued", None, 2), "crashing": ("failed", "ocr", 3)})
+        self.assertEqual(jobs["crashing"].error, "Processing stopped unexpectedly 3 times")
+
+    def test_release(self) -> None:
+        jobs = self.add_jobs(
+            claimed=IngestionJob(status="processing", attempts=1),
+            done=IngestionJob(status="done", attempts=1),
+        )
+
+        release_ingestion_jobs(self.db, [job.id for job in jobs.values()])
+
+        self.assertEqual(self.states(jobs), {"claimed": ("queued", None, 0), "done": ("done", None, 1)})
+
+
+class SetInvoiceDerivativesTest(DatabaseTestCase):
+    def test_bumps_updated_on(self) -> None:
+        user = User(email="derivatives@example.com", password_hash="x")
+        self.db.add(user)
+        self.db.flush()
+        old = datetime.utcnow() - timedelta(days=1)
+        invoice = Invoice(user_id=user.id, image_uri="/storage/a.png", updated_on=old)
+        self.db.add(invoice)
+        self.db.flush()
+
+        set_invoice_derivatives(self.db, invoice.id, thumbnail_uri="/storage/a-thumbnail.webp", preview_uri="")
+        self.db.refresh(invoice)
+
+        # ETags and since= deltas come from updated_on, so the new uris have to move it
+        self.assertEqual(invoice.thumbnail_uri, "/storage/a-thumbnail.webp")
+        self.assertGreater(invoice.updated_on, old)
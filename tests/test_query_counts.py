@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+from helpers import DatabaseTestCase
+
+from app.api.router import load_owned_invoice
+from app.db.models import (Category, CategoryInvoiceAssociation, Invoice, User,
+                           Vendor)
+from app.invoices.aging_report.processor import AgingReportProcessor
+from app.invoices.calendar_view import load_calendar_month
+from app.invoices.db_utils import load_public_invoice, load_public_invoice_page
+from app.vendors.db_utils import query_vendors_with_aggregates
+from app.vendors.router import load_single_vendor
+
+
+class EndpointQueryCountTest(DatabaseTestCase):
+    """What each endpoint loads must take a fixed number of statements however many invoices there are.
+
+    Each test runs an endpoint's loader - the function it hands to run_sync - with a few invoices and again with
+    ten times as many, and checks the count didn't move and stays under a bound.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = User(email="counts@example.com", password_hash="x")
+        self.db.add(self.user)
+        self.db.flush()
+        self.vendors = [Vendor(user_id=self.user.id, name=f"Vendor {i}") for i in range(3)]
+        self.categories = [Category(user_id=self.user.id, name=f"Category {i}") for i in range(2)]
+        self.db.add_all(self.vendors + self.categories)
+        self.db.flush()
+        self.num_invoices = 0
+
+    def add_invoices(self, num: int) -> None:
+        now = datetime.utcnow()
+        for _ in range(num):
+            idx = self.num_invoices
+            self.num_invoices += 1
+            vendor = self.vendors[idx % len(self.vendors)]
+            invoice = Invoice(
+                user_id=self.user.id,
+                vendor_id=vendor.id,
+                vendor_name=vendor.name,
+                invoice_id=f"INV-{idx}",
+                amount_due=Decimal("10.00") + idx,
+                # Spread over the coming days so they show in the calendar, aging report and listings
+                due_date=now + timedelta(days=idx % 10, hours=1),
+                is_paid=idx % 4 == 0,
+            )
+            self.db.add(invoice)
+            self.db.flush()
+            category = self.categories[idx % len(self.categories)]
+            self.db.add(CategoryInvoiceAssociation(category_id=category.id, invoice_id=invoice.id))
+        self.db.flush()
+        # Nothing may be served from the identity map - every load has to hit the database
+        self.db.expunge_all()
+
+    def count(self, load: Callable[[], Any]) -> int:
+        with self.count_statements() as statements:
+            load()
+        self.db.expunge_all()
+        return len(statements)
+
+    def assert_constant_statements(self, load: Callable[[], Any], max_statements: int) -> None:
+        self.add_invoices(3)
+        few = self.count(load)
+        self.add_invoices(27)
+        many = self.count(load)
+
+        self.assertEqual(few, many, "statement count grows with the number of invoices")
+        self.assertLessEqual(many, max_statements)
+
+    def test_invoice_pages(self) -> None:
+        # /inbox, /invoice-list and /api/v1/invoices
+        self.assert_constant_statements(
+            lambda: load_public_invoice_page(self.db, self.user.id, order_by="due_date", desc=True, limit=100), 2
+        )
+
+    def test_calendar(self) -> None:
+        # /calendar and /calendar/json
+        now = datetime.utcnow()
+        self.assert_constant_statements(lambda: load_calendar_month(self.db, self.user.id, now.year, now.month), 3)
+
+    def test_single_vendor(self) -> None:
+        # /vendors/{vendor_id}
+        self.assert_constant_statements(lambda: load_single_vendor(self.db, self.vendors[0].id), 5)
+
+    def test_vendors(self) -> None:
+        # /vendors and /api/v1/vendors
+        self.assert_constant_statements(lambda: query_vendors_with_aggregates(self.db, self.user.id), 1)
+
+    def test_aging_report(self) -> None:
+        # /aging-reports/create, pandas path
+        self.assert_constant_statements(lambda: AgingReportProcessor.fetch_data(self.db, self.user.id), 3)
+
+    def test_single_invoice(self) -> None:
+        self.add_invoices(30)
+        invoice_id = self.db.query(Invoice.id).filter_by(user_id=self.user.id).first()[0]
+        self.db.expunge_all()
+
+        # /invoices/{invoice_id}
+        self.assertLessEqual(self.count(lambda: load_public_invoice(self.db, invoice_id)), 3)
+        # /api/v1/invoices/{invoice_id}
+        self.assertLessEqual(self.count(lambda: load_owned_invoice(self.db, self.user.id, invoice_id)), 3)
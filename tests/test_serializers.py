@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from helpers import DatabaseTestCase
+
+from app.db.models import Category, CategoryInvoiceAssociation, Invoice, User
+from app.invoices.db_utils import (PUBLIC_INVOICE_LOAD_OPTIONS,
+                                   get_invoices_by_user,
+                                   load_public_invoice_page)
+from app.invoices.models import PublicInvoice
+
+
+class PublicInvoiceRowSerializerTest(DatabaseTestCase):
+    """load_public_invoice_page must produce exactly what PublicInvoice.from_orm(...).dict() does"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = User(email="serializer@example.com", password_hash="x")
+        self.db.add(self.user)
+        self.db.flush()
+        category = Category(user_id=self.user.id, name="travel")
+        self.db.add(category)
+        self.db.flush()
+
+        # Whole days plus half a day so the two paths' clocks can't disagree on a status or humanized date
+        now = datetime.utcnow()
+        due = lambda days: now + timedelta(days=days, hours=12)
+        invoices = [
+            Invoice(user_id=self.user.id, vendor_name="Acme", amount_due=Decimal("12.5"), due_date=due(3)),
+            Invoice(user_id=self.user.id, vendor_name="Acme", amount_due=Decimal("0"), due_date=due(-40)),
+            Invoice(user_id=self.user.id, vendor_name=None, amount_due=None, due_date=None, currency="EUR"),
+            Invoice(user_id=self.user.id, vendor_name="Beta", amount_due=Decimal("7"), due_date=due(-2), is_paid=True),
+            Invoice(
+                user_id=self.user.id,
+                vendor_name="Gamma",
+                amount_due=Decimal("1000.456"),
+                due_date=due(400),
+                invoice_id="INV-1",
+                image_uri="https://example.com/a.png",
+                thumbnail_uri="",
+                preview_uri="https://example.com/a-preview.jpg",
+            ),
+        ]
+        self.db.add_all(invoices)
+        self.db.flush()
+        for invoice in invoices[::2]:
+            self.db.add(CategoryInvoiceAssociation(category_id=category.id, invoice_id=invoice.id))
+        self.db.flush()
+        self.db.expunge_all()
+
+    def test_matches_public_invoice(self) -> None:
+        invoices = get_invoices_by_user(self.db, self.user.id, options=PUBLIC_INVOICE_LOAD_OPTIONS)
+        expected = {i.id: PublicInvoice.from_orm(i).dict() for i in invoices}
+
+        serialized, _ = load_public_invoice_page(self.db, self.user.id)
+
+        self.assertEqual(len(serialized), 5)
+        self.assertEqual(serialized, expected)
@@ -0,0 +1,101 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.auth.session_store import (MemorySessionBackend,
+                                    ServerSessionMiddleware)
+
+MAX_AGE = 1000
+
+
+async def whoami(request: Request) -> JSONResponse:
+    return JSONResponse({"user_id": request.session.get("user_id")})
+
+
+async def login(request: Request) -> JSONResponse:
+    request.session["user_id"] = "user-1"
+    return JSONResponse({})
+
+
+async def logout(request: Request) -> JSONResponse:
+    request.session.clear()
+    return JSONResponse({})
+
+
+def create_worker(backend: MemorySessionBackend) -> TestClient:
+    """One app process - workers sharing a backend stand in for processes sharing the sessions table"""
+    app = Starlette(
+        routes=[
+            Route("/whoami", whoami, methods=["GET", "POST"]),
+            Route("/login", login, methods=["POST"]),
+            Route("/logout", logout, methods=["POST"]),
+        ]
+    )
+    app.add_middleware(ServerSessionMiddleware, backend=backend, max_age=MAX_AGE, cache_size=100, cache_ttl=60)
+    return TestClient(app)
+
+
+class ServerSessionMiddlewareTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.backend = MemorySessionBackend(max_size=100, ttl=MAX_AGE)
+        self.worker = create_worker(self.backend)
+
+    def login(self, worker: TestClient) -> str:
+        response = worker.post("/login")
+        return response.cookies["session"]
+
+    def test_cookie_only_sent_on_change(self) -> None:
+        session_id = self.login(self.worker)
+
+        response = self.worker.get("/whoami", cookies={"session": session_id})
+
+        self.assertEqual(response.json(), {"user_id": "user-1"})
+        self.assertNotIn("set-cookie", response.headers)
+
+    def test_expiry_slides_after_half_max_age(self) -> None:
+        session_id = self.login(self.worker)
+        expires_at = json.loads(self.backend.get(session_id))["expires_at"]
+
+        with mock.patch("time.time", return_value=time.time() + MAX_AGE * 0.4):
+            response = self.worker.get("/whoami", cookies={"session": session_id})
+        self.assertNotIn("set-cookie", response.headers)
+
+        later = time.time() + MAX_AGE * 0.6
+        with mock.patch("time.time", return_value=later):
+            response = self.worker.get("/whoami", cookies={"session": session_id})
+        # Same id, fresh expiry in the cookie and the backend
+        self.assertEqual(response.json(), {"user_id": "user-1"})
+        self.assertEqual(response.cookies["session"], session_id)
+        self.assertIn(f"Max-Age={MAX_AGE}", response.headers["set-cookie"])
+        self.assertEqual(json.loads(self.backend.get(session_id))["expires_at"], later + MAX_AGE)
+        self.assertGreater(later + MAX_AGE, expires_at)
+
+    def test_renews_sessions_stored_without_expiry(self) -> None:
+        self.backend.set("old-session", json.dumps({"user_id": "user-1"}))
+
+        response = self.worker.get("/whoami", cookies={"session": "old-session"})
+
+        self.assertEqual(response.json(), {"user_id": "user-1"})
+        self.assertEqual(response.cookies["session"], "old-session")
+        self.assertEqual(json.loads(self.backend.get("old-session"))["data"], {"user_id": "user-1"})
+
+    def test_logout_applies_to_other_workers_writes(self) -> None:
+        other_worker = create_worker(self.backend)
+        session_id = self.login(self.worker)
+        # The other worker has the session cached
+        self.assertEqual(other_worker.get("/whoami", cookies={"session": session_id}).json(), {"user_id": "user-1"})
+
+        self.worker.post("/logout", cookies={"session": session_id})
+
+        response = other_worker.post("/whoami", cookies={"session": session_id})
+        self.assertEqual(response.json(), {"user_id": None})
+        # Having seen the logout, its cached copy is gone for reads too
+        response = other_worker.get("/whoami", cookies={"session": session_id})
+        self.assertEqual(response.json(), {"user_id": None})
@@ -0,0 +1,180 @@
+import asyncio
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app.storage.backends import LocalStorageBackend
+from app.storage.config import config
+from app.storage.router import router
+
+
+class LocalStorageBackendTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalStorageBackend(self.tmp_dir.name, "/storage/", max_workers=2)
+
+    def tearDown(self) -> None:
+        self.backend.shutdown()
+        self.tmp_dir.cleanup()
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.tmp_dir.name)
+            for root, _, names in os.walk(self.tmp_dir.name)
+            for name in names
+        )
+
+    def test_round_trip(self) -> None:
+        uri = self.backend.upload_bytes("invoices/a.png", b"image", content_type="image/png")
+
+        self.assertEqual(uri, "/storage/invoices/a.png")
+        self.assertEqual(self.backend.key_from_uri(uri), "invoices/a.png")
+        self.assertTrue(self.backend.exists("invoices/a.png"))
+        self.assertEqual(self.backend.download_bytes("invoices/a.png"), b"image")
+        out = io.BytesIO()
+        self.backend.download_fileobj("invoices/a.png", out)
+        self.assertEqual(out.getvalue(), b"image")
+
+    def test_overwrite(self) -> None:
+        self.backend.upload_bytes("a", b"first")
+        self.backend.upload_fileobj("a", io.BytesIO(b"second"))
+
+        self.assertEqual(self.backend.download_bytes("a"), b"second")
+        self.assertEqual(self.files(), ["a"])
+
+    def test_delete(self) -> None:
+        self.backend.upload_bytes("a", b"data")
+        self.backend.delete("a")
+
+        self.assertFalse(self.backend.exists("a"))
+        # Deleting what isn't there is fine, as on S3
+        self.backend.delete("a")
+
+    def test_key_from_foreign_uri(self) -> None:
+        self.assertIsNone(self.backend.key_from_uri("https://bucket.s3.amazonaws.com/a"))
+
+    def test_rejects_keys_outside_directory(self) -> None:
+        for key in ["../escape", "a/../../escape", "/etc/passwd"]:
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                self.backend.upload_bytes(key, b"data")
+
+    def test_failed_upload_leaves_nothing(self) -> None:
+        class BrokenFile(io.BytesIO):
+            def read(self, *args):
+                raise OSError("connection reset")
+
+        self.backend.upload_bytes("a", b"original")
+        with self.assertRaises(OSError):
+            self.backend.upload_fileobj("a", BrokenFile())
+
+        # No partial file and no leftover temp file
+        self.assertEqual(self.backend.download_bytes("a"), b"original")
+        self.assertEqual(self.files(), ["a"])
+
+    def test_writer(self) -> None:
+        with self.backend.open_writer("reports/a.csv") as writer:
+            writer.write("a,b\n")
+            # Nothing visible until the writer is closed
+            self.assertFalse(self.backend.exists("reports/a.csv"))
+            writer.write("1,2\n")
+
+        self.assertEqual(writer.uri, "/storage/reports/a.csv")
+        self.assertEqual(self.backend.download_bytes("reports/a.csv"), b"a,b\n1,2\n")
+
+    def test_failed_writer_leaves_nothing(self) -> None:
+        with self.assertRaises(RuntimeError):
+            with self.backend.open_writer("reports/a.csv") as writer:
+                writer.write("a,b\n")
+                raise RuntimeError("report failed")
+
+        self.assertEqual(self.files(), [])
+
+    def test_async(self) -> None:
+        async def run():
+            await self.backend.upload_bytes_async("a", b"data")
+            self.assertTrue(await self.backend.exists_async("a"))
+            self.assertEqual(await self.backend.download_bytes_async("a"), b"data")
+            await self.backend.delete_async("a")
+            self.assertFalse(await self.backend.exists_async("a"))
+
+        asyncio.run(run())
+
+    def test_upload_stream(self) -> None:
+        async def chunks():
+            for chunk in [b"one ", b"two ", b"three"]:
+                yield chunk
+
+        uri = asyncio.run(self.backend.upload_stream_async("direct/a.pdf", chunks()))
+
+        self.assertEqual(uri, "/storage/direct/a.pdf")
+        self.assertEqual(self.backend.download_bytes("direct/a.pdf"), b"one two three")
+
+
+class LocalPresignedUploadTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalStorageBackend(self.tmp_dir.name, "/storage", max_workers=2, upload_secret="secret")
+        app = FastAPI()
+        app.include_router(router)
+        self.client = TestClient(app)
+        patcher = mock.patch("app.storage.router.storage", self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.backend.shutdown()
+        self.tmp_dir.cleanup()
+
+    def put(self, url: str, data: bytes, content_type: str = "application/pdf"):
+        return self.client.put(url, data=data, headers={"Content-Type": content_type})
+
+    def test_upload(self) -> None:
+        url = self.backend.presign_upload_url("direct/a.pdf", "application/pdf", 5)
+
+        self.assertEqual(self.put(url, b"%PDF-").status_code, 200)
+        self.assertEqual(self.backend.download_bytes("direct/a.pdf"), b"%PDF-")
+
+    def test_rejects_tampered_urls(self) -> None:
+        url = self.backend.presign_upload_url("direct/a.pdf", "application/pdf", 5)
+        params = dict(parse_qsl(urlsplit(url).query))
+        bigger = url.replace(f"content_length={params['content_length']}", "content_length=500")
+
+        self.assertEqual(self.put(bigger, b"%PDF-").status_code, 403)
+        self.assertEqual(self.put(url, b"%PDF-", content_type="image/png").status_code, 403)
+        self.assertFalse(self.backend.exists("direct/a.pdf"))
+
+    def test_rejects_expired_urls(self) -> None:
+        url = self.backend.presign_upload_url("direct/a.pdf", "application/pdf", 5, expires_in=1)
+
+        with mock.patch("time.time", return_value=time.time() + 10):
+            self.assertEqual(self.put(url, b"%PDF-").status_code, 403)
+
+    def test_rejects_more_than_declared(self) -> None:
+        url = self.backend.presign_upload_url("direct/a.pdf", "application/pdf", 5)
+
+        self.assertEqual(self.put(url, b"%PDF-1.7").status_code, 413)
+        self.assertFalse(self.backend.exists("direct/a.pdf"))
+
+    def test_rejects_streamed_body_over_limit(self) -> None:
+        url = self.backend.presign_upload_url("direct/a.pdf", "application/pdf", 5)
+
+        # No Content-Length up front, so the limit has to apply while the body streams in
+        response = self.put(url, (chunk for chunk in [b"%PDF", b"-1.7"]))
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(self.backend.exists("direct/a.pdf"))
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir.name, "direct")), [])
+
+    def test_rejects_more_than_max_upload_bytes(self) -> None:
+        # Signed before max_upload_bytes was lowered
+        url = self.backend.presign_upload_url("direct/a.pdf", "application/pdf", 5)
+
+        with mock.patch.object(config, "max_upload_bytes", 4):
+            self.assertEqual(self.put(url, b"%PDF-").status_code, 413)
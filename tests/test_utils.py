@@ -0,0 +1,14 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from app.utils import to_naive_utc
+
+
+class ToNaiveUtcTest(unittest.TestCase):
+    def test_aware_is_converted_to_utc(self) -> None:
+        since = datetime(2022, 5, 1, 12, 30, tzinfo=timezone(timedelta(hours=2)))
+        self.assertEqual(to_naive_utc(since), datetime(2022, 5, 1, 10, 30))
+
+    def test_naive_is_left_alone(self) -> None:
+        since = datetime(2022, 5, 1, 12, 30)
+        self.assertEqual(to_naive_utc(since), since)
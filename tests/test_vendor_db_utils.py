@@ -0,0 +1,35 @@
+from decimal import Decimal
+
+from helpers import DatabaseTestCase
+
+from app.db.models import Invoice, User, Vendor
+from app.vendors.db_utils import query_vendors_with_aggregates
+
+
+class QueryVendorsWithAggregatesTest(DatabaseTestCase):
+    def test_only_aggregates_the_users_invoices(self) -> None:
+        user = User(email="vendors@example.com", password_hash="x")
+        other_user = User(email="other@example.com", password_hash="x")
+        self.db.add_all([user, other_user])
+        self.db.flush()
+        acme, other_acme = Vendor(user_id=user.id, name="Acme"), Vendor(user_id=other_user.id, name="Acme")
+        empty = Vendor(user_id=user.id, name="Empty")
+        self.db.add_all([acme, other_acme, empty])
+        self.db.flush()
+        self.db.add_all(
+            [
+                Invoice(user_id=user.id, vendor_id=acme.id, amount_due=Decimal("10.00"), is_paid=True),
+                Invoice(user_id=user.id, vendor_id=acme.id, amount_due=Decimal("2.50")),
+                Invoice(user_id=other_user.id, vendor_id=other_acme.id, amount_due=Decimal("99.00")),
+                # Not the user's invoice even though it points at their vendor
+                Invoice(user_id=other_user.id, vendor_id=acme.id, amount_due=Decimal("1000.00")),
+            ]
+        )
+        self.db.flush()
+
+        rows = query_vendors_with_aggregates(self.db, user.id)
+
+        self.assertEqual(
+            [(r.Vendor.name, r.total_paid, r.total_due, r.total_invoice_count) for r in rows],
+            [("Acme", Decimal("10.00"), Decimal("2.50"), 2), ("Empty", 0, 0, 0)],
+        )